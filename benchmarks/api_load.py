@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2007-2015, GoodData(R) Corporation. All rights reserved
+"""
+Measure throughput and latency of smokerd REST API under concurrent load
+
+Every client sends requests one after another, over single keep-alive
+connection unless --no-keep-alive is given.
+
+Usage: python benchmarks/api_load.py [-c clients] [-n requests] [url]
+"""
+
+import argparse
+import http.client
+import threading
+import time
+import urllib.parse
+
+
+def client(url, count, keep_alive, latencies, errors):
+    """
+    Send count requests to url, record latency of each of them
+    """
+    url = urllib.parse.urlsplit(url)
+    path = url.path or "/"
+    if url.query:
+        path += "?" + url.query
+
+    connection = None
+    for _ in range(count):
+        start = time.time()
+        try:
+            if not connection:
+                connection = http.client.HTTPConnection(url.hostname, url.port, timeout=60)
+            connection.request("GET", path)
+            response = connection.getresponse()
+            response.read()
+            if response.status != 200:
+                errors.append(response.status)
+            if not keep_alive or response.will_close:
+                connection.close()
+                connection = None
+        except Exception as e:
+            errors.append(e)
+            connection = None
+        latencies.append(time.time() - start)
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100.0))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("-c", "--clients", type=int, default=100)
+    parser.add_argument("-n", "--requests", type=int, default=20,
+                        help="Requests sent by each client")
+    parser.add_argument("--no-keep-alive", dest="keep_alive", action="store_false")
+    parser.add_argument("url", nargs="?", default="http://localhost:8086/plugins")
+    args = parser.parse_args()
+
+    latencies = []
+    errors = []
+    threads = [
+        threading.Thread(
+            target=client,
+            args=(args.url, args.requests, args.keep_alive, latencies, errors),
+        )
+        for _ in range(args.clients)
+    ]
+
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+
+    print("clients:       %d" % args.clients)
+    print("requests:      %d" % len(latencies))
+    print("errors:        %d" % len(errors))
+    print("requests/s:    %.1f" % (len(latencies) / elapsed))
+    print("p50 latency:   %.1f ms" % (percentile(latencies, 50) * 1000))
+    print("p99 latency:   %.1f ms" % (percentile(latencies, 99) * 1000))
+    if errors:
+        print("first error:   %s" % errors[0])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2007-2015, GoodData(R) Corporation. All rights reserved
+"""
+Measure memory used by in-memory history of plugin results
+
+Results are passed through pickle like they are passed through
+the queue from plugin workers, so they don't share any objects.
+
+Usage: python benchmarks/result_memory.py [number of results]
+"""
+
+import os
+import pickle
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from smoker.server.history import ResultRecord  # noqa: E402
+from smoker.server.plugins import Result  # noqa: E402
+
+
+def make_results(count):
+    """
+    Return results of typical plugins as they arrive from the queue
+    """
+    simple = Result()
+    simple.set_status("OK")
+    simple.add_info("Everything is fine")
+
+    components = Result()
+    for n in range(5):
+        components.add_component("Component %d" % n, "OK", info=["Passed"])
+    components.set_status()
+
+    results = []
+    for n in range(count):
+        result = simple if n % 2 else components
+        results.append(pickle.loads(pickle.dumps(result.get_result())))
+    return results
+
+
+def measure(function, results):
+    """
+    Return number of bytes allocated by function
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    history = function(results)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del history
+    return after - before
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+
+    dicts = measure(lambda results: pickle.loads(pickle.dumps(results)),
+                    make_results(count))
+    records = measure(lambda results: [ResultRecord.from_dict(result)
+                                       for result in results],
+                      make_results(count))
+
+    print("results:            %d" % count)
+    print("dict per result:    %d B" % (dicts / count))
+    print("record per result:  %d B" % (records / count))
+    print("saved per result:   %d B (%.0f %%)" % (
+        (dicts - records) / count, 100.0 * (dicts - records) / dicts))
+
+
+if __name__ == "__main__":
+    main()
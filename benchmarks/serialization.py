@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2007-2015, GoodData(R) Corporation. All rights reserved
+"""
+Compare encoding and decoding of /plugins response by available formats
+
+Response of synthetic host with given number of plugins is encoded
+by every installed JSON encoder and by MessagePack, sizes are reported
+also after gzip compression.
+
+Usage: python benchmarks/serialization.py [-p plugins] [-n repeat]
+"""
+
+import argparse
+import datetime
+import gzip
+import json
+import timeit
+
+from smoker.util import encoding
+
+
+def make_plugins(count):
+    """
+    Return /plugins response of host with count plugins
+    """
+    now = datetime.datetime(2020, 1, 1)
+    items = []
+    for n in range(count):
+        name = "Plugin%04d" % n
+        components = None
+        if n % 10 == 0:
+            components = [
+                {
+                    "componentResult": {
+                        "name": "www%02d" % c,
+                        "status": "OK",
+                        "messages": {"info": ["Response time: 0.01%d" % c], "warn": [], "error": []},
+                    }
+                }
+                for c in range(5)
+            ]
+        items.append({
+            "plugin": {
+                "name": name,
+                "links": {"self": "/plugins/%s" % name},
+                "nextRun": (now + datetime.timedelta(seconds=n)).isoformat(),
+                "parameters": {
+                    "Command": "/usr/lib/smoker/checks/%s" % name.lower(),
+                    "Category": "system",
+                    "Component": "component%d" % (n % 7),
+                    "Type": "smokeTest",
+                    "Interval": 60,
+                    "Timeout": 30,
+                    "History": 10,
+                },
+                "lastResult": {
+                    "status": "OK" if n % 13 else "ERROR",
+                    "lastRun": now.isoformat(),
+                    "forced": False,
+                    "messages": {"info": ["Everything is fine on %s" % name], "warn": [], "error": []},
+                    "componentResults": components,
+                    "action": None,
+                    "resources": {"privateMemory": 3842048 + n},
+                    "seq": n + 1,
+                },
+            }
+        })
+    return {"plugins": {"items": items}}
+
+
+def formats():
+    """
+    Return list of (name, encode, decode) of installed formats
+    """
+    result = []
+    for name in encoding.ENCODER_NAMES:
+        try:
+            dumps = encoding.get_encoder(name)
+        except ValueError:
+            continue
+        loads = json.loads
+        if name != "json":
+            loads = __import__(name).loads
+        result.append((name, dumps, loads))
+
+    if encoding.msgpack:
+        result.append((
+            "msgpack",
+            encoding.dumps_msgpack,
+            lambda data: encoding.loads(data, encoding.MSGPACK_MIMETYPE),
+        ))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("-p", "--plugins", type=int, default=1000)
+    parser.add_argument("-n", "--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    data = make_plugins(args.plugins)
+    print("%-8s %12s %12s %10s %10s" % ("format", "encode ms", "decode ms", "bytes", "gzip"))
+    for name, dumps, loads in formats():
+        encoded = dumps(data)
+        assert loads(encoded) == data
+        encode = timeit.timeit(lambda: dumps(data), number=args.repeat) / args.repeat
+        decode = timeit.timeit(lambda: loads(encoded), number=args.repeat) / args.repeat
+        print("%-8s %12.2f %12.2f %10d %10d" % (
+            name, encode * 1000, decode * 1000, len(encoded),
+            len(gzip.compress(encoded, encoding.GZIP_LEVEL))))
+
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,7 @@ import logging
 import smoker.logger
 import smoker.util.nagios as nagios
 from smoker.client import Client
+from smoker.util.statustable import DEFAULT_PATH, StatusTable, slot_name
 
 UNKNOWN = "UNKNOWN"
 ERROR = "ERROR"
@@ -31,6 +32,11 @@ parser.add_argument('-f', '--force', dest='force', action='store_true',
 parser.add_argument('--category', default=None, help='The category of tests to run')
 parser.add_argument('--component', default=None, help='The tests component to run')
 parser.add_argument('--health', default=False, dest='health', action='store_true', help="Run only healthchecks")
+parser.add_argument('--status-table', dest='status_table', default=DEFAULT_PATH,
+                    help="Status table published by smokerd, REST API is used when it's not available "
+                         "(default %s)" % DEFAULT_PATH)
+parser.add_argument('--host', default='localhost',
+                    help="Address of smokerd REST API, eg. unix:///var/run/smokerd.sock (default localhost)")
 parser.add_argument('plugin', default=None, nargs='*', help="Plugin to check")
 args = parser.parse_args()
 
@@ -47,16 +53,68 @@ def parse_issue(plugin_result):
     return out
 
 
-def main():
-    client = Client(['localhost'])
-    plugins = None
+def load_status_table():
+    """
+    Return dict of plugins matching arguments with their last result
+    from the status table, None if the table of running smokerd isn't available
+    """
+    try:
+        table = StatusTable.open(args.status_table)
+    except (OSError, ValueError) as e:
+        lg.info("Can't read status table, using REST API: %s" % e)
+        return None
 
-    if args.plugin:
-        if args.category or args.component or args.health:
-            lg.warn("Plugins specified by name, ignoring --category, --component and --health")
+    try:
+        if not table.is_alive():
+            lg.info("Status table %s is stale, using REST API" % args.status_table)
+            return None
+        statuses = table.items()
+    finally:
+        table.close()
+
+    # Long names are shortened in the table
+    requested = dict((slot_name(name), name) for name in args.plugin or [])
+
+    plugins = {}
+    for status in statuses:
+        name = status['name']
+        if args.plugin:
+            if name not in requested:
+                continue
+            name = requested[name]
+        else:
+            if args.category and status['category'] != args.category:
+                continue
+            if args.component and status['component'] != args.component:
+                continue
+            if args.health and status['type'] != 'healthCheck':
+                continue
+
+        last_result = None
+        if status['lastRun']:
+            messages = {}
+            if status['message'] and status['status'] != OK:
+                messages[status['status'].lower()] = [status['message']]
+            last_result = {
+                'status': status['status'],
+                'lastRun': status['lastRun'],
+                'messages': messages,
+                'componentResults': [],
+            }
+        plugins[name] = {'name': name, 'lastResult': last_result}
+    return plugins
+
+
+def load_rest_api():
+    """
+    Return dict of plugins matching arguments from the REST API,
+    force their run if requested
+    """
+    client = Client([args.host])
 
+    if args.plugin:
         plugins = client.get_plugins([args.plugin])
-    elif args.category or args.component or args.health:
+    else:
         filter = []
         if args.category:
             filter.append({'key': 'Category', 'value': args.category})
@@ -65,10 +123,30 @@ def main():
         if args.health:
             filter.append({'key': 'Type', 'value': 'healthCheck'})
         plugins = client.get_plugins(filter)
-    else:
+
+    if plugins and args.force:
+        plugins = client.force_run(plugins, progress=False)
+
+    if not plugins:
+        return {}
+    return list(plugins.values())[0]['plugins']
+
+
+def main():
+    if args.plugin:
+        if args.category or args.component or args.health:
+            lg.warn("Plugins specified by name, ignoring --category, --component and --health")
+    elif not (args.category or args.component or args.health):
         nagios.exit_unknown("invalid startup configuration - neither plugin nor --category nor --component "
                             "nor --health specified")
 
+    # Status table can't force plugins run
+    plugins = None
+    if not args.force:
+        plugins = load_status_table()
+    if plugins is None:
+        plugins = load_rest_api()
+
     # No plugin found
     if not plugins:
         if args.plugin:
@@ -78,16 +156,13 @@ def main():
                       (args.category, args.component, args.health)
         nagios.exit_unknown(message)
 
-    if args.force:
-        plugins = client.force_run(plugins, progress=False)
-
     status_methods_pairs = [(ERROR, nagios.exit_critical), (UNKNOWN, nagios.exit_unknown),
                             (WARN, nagios.exit_warning), (OK, nagios.exit_ok)]
 
     # Manage plugin result. We can't return much data to Nagios, so just say if it's alright or not
     results = dict((s, []) for s, _ in status_methods_pairs)
 
-    for plugin in list(plugins.values())[0]['plugins'].values():
+    for plugin in plugins.values():
         plugin_name = plugin['name']
         if not plugin['lastResult']:
             results[UNKNOWN].append({'name': plugin_name, 'message': "plugin has no last result"})
@@ -113,7 +188,7 @@ def main():
 
     for status, exit_method in status_methods_pairs:
         if results[status]:
-            if len(list(plugins.values())[0]['plugins']) == 1:
+            if len(plugins) == 1:
                 # if only one plugin has been executed, do not print summary
                 exit_method(results[status][0]['message'])
             else:
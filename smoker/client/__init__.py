@@ -3,14 +3,18 @@
 # Copyright (C) 2007-2012, GoodData(R) Corporation. All rights reserved
 
 import datetime
+import http.client
 import json
 import logging
+import queue
+import socket
 import threading
 import time
 import urllib.error
 import urllib.parse
 import urllib.request
 
+from smoker.util import encoding, tracing
 from smoker.util.progressbar import NonInteractiveError, ProgressBar
 
 lg = logging.getLogger('smoker')
@@ -77,6 +81,30 @@ class Client(object):
         result = self._format_plugins(plugins, filters=filters, filters_negative=filters_negative, exclude_plugins=exclude_plugins)
         return PluginsResult(**result)
 
+    def iter_plugins(self, filters=None, filters_negative=False, exclude_plugins=None):
+        """
+        Yield PluginsResult of single host as soon as the host responds
+
+        Accept same filters as get_plugins(), hosts without
+        matching plugins are skipped
+        """
+        results = queue.Queue()
+
+        def load(host):
+            results.put((host.name, host.open(resource='plugins')))
+
+        lg.info("Getting plugins for %d hosts" % len(self.hosts))
+        for host in self.hosts:
+            t = threading.Thread(name=host.name, target=load, args=(host,))
+            t.daemon = True
+            t.start()
+
+        for _ in range(len(self.hosts)):
+            name, plugins = results.get()
+            result = self._format_plugins({name: plugins or {}}, filters=filters, filters_negative=filters_negative, exclude_plugins=exclude_plugins)
+            if result:
+                yield PluginsResult(**result)
+
     def force_run(self, plugins, progress=True):
         """
         Force plugins run
@@ -86,18 +114,20 @@ class Client(object):
         for host in self.hosts:
             host_map[host.name] = host
 
-        pool = []
-        # For each host in plugins result, force run of it's plugins
-        for hostname, host in plugins.items():
-            t = threading.Thread(name=hostname, target=host_map[hostname].force_run, args=(host['plugins'],))
-            t.daemon = True
-            t.start()
-            pool.append(t)
-
-        if progress:
-            self.wait_progress(pool)
-        else:
-            self.wait(pool)
+        with tracing.span('force run', attributes={'hosts': len(plugins)}):
+            pool = []
+            # For each host in plugins result, force run of it's plugins
+            for hostname, host in plugins.items():
+                target = tracing.bind(host_map[hostname].force_run)
+                t = threading.Thread(name=hostname, target=target, args=(host['plugins'],))
+                t.daemon = True
+                t.start()
+                pool.append(t)
+
+            if progress:
+                self.wait_progress(pool)
+            else:
+                self.wait(pool)
 
         result = {}
         for hostname in plugins.keys():
@@ -289,9 +319,40 @@ class Client(object):
             lg.warning(e)
             self.wait(pool)
 
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """
+    HTTP connection over Unix domain socket
+    """
+    def __init__(self, path, *args, **kwargs):
+        super(UnixHTTPConnection, self).__init__(*args, **kwargs)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+class UnixHTTPHandler(urllib.request.HTTPHandler):
+    """
+    Send all HTTP requests of the opener to Unix domain socket
+    """
+    def __init__(self, path):
+        super(UnixHTTPHandler, self).__init__()
+        self.path = path
+
+    def http_open(self, req):
+        return self.do_open(
+            lambda host, **kwargs: UnixHTTPConnection(self.path, host, **kwargs), req)
+
+
 class Host(object):
     """
     Object representing single smokerd server
+
+    Address is host name with optional port or unix:///path
+    of the socket smokerd listens on
     """
     name = None
     url = None
@@ -299,19 +360,27 @@ class Host(object):
     links = {}
 
     _result  = None
+    _opener = None
 
     def __init__(self, address, default_port=8086):
         """
         Initialize object
         """
-        host = address.split(':')
-        try:
-            port = host[1]
-        except IndexError:
-            port = default_port
+        if address.startswith('unix://'):
+            self.url = "http://localhost"
+            # Proxy has no meaning for local socket
+            self._opener = urllib.request.build_opener(
+                urllib.request.ProxyHandler({}),
+                UnixHTTPHandler(address[len('unix://'):]))
+        else:
+            host = address.split(':')
+            try:
+                port = host[1]
+            except IndexError:
+                port = default_port
+            self.url = "http://%s:%s" % (host[0], port)
 
         self.name = address
-        self.url = "http://%s:%s" % (host[0], port)
         self.address = address
         self.links = {}
         self._result = None
@@ -350,17 +419,34 @@ class Host(object):
 
         url = '%s%s' % (self.url, uri)
         lg.info("Host %s: requesting url %s" % (self.name, url))
-        try:
-            with urllib.request.urlopen(url, timeout=timeout, data=data) as fh:
-                resp = fh.read().decode('utf-8')
-        except Exception as e:
-            lg.error("Host %s: can't open resource %s: %s" % (self.name, url, e))
-            return False
+        # MessagePack is preferred when installed, it's faster to decode
+        headers = {
+            'Accept': encoding.ACCEPT,
+            'Accept-Encoding': encoding.ACCEPT_ENCODING,
+        }
+        method = 'POST' if data else 'GET'
+        attributes = {'http.method': method, 'http.url': url}
+        urlopen = self._opener.open if self._opener else urllib.request.urlopen
+        with tracing.span('%s %s' % (method, uri), kind=tracing.CLIENT,
+                          attributes=attributes) as span:
+            if span:
+                headers[tracing.TRACEPARENT] = tracing.format_traceparent(span.context)
+            request = urllib.request.Request(url, data=data, headers=headers)
+            try:
+                with urlopen(request, timeout=timeout) as fh:
+                    resp = encoding.decompress(
+                        fh.read(), fh.headers.get('Content-Encoding'))
+                    content_type = fh.headers.get('Content-Type')
+            except Exception as e:
+                lg.error("Host %s: can't open resource %s: %s" % (self.name, url, e))
+                if span:
+                    span.set_error(e)
+                return False
 
         try:
-            json_data = json.loads(resp)
+            json_data = encoding.loads(resp, content_type)
         except Exception as e:
-            lg.error("Host %s: can't load response as JSON: %s" % (self.name, e))
+            lg.error("Host %s: can't load response: %s" % (self.name, e))
             return False
 
         self._result = json_data
@@ -384,15 +470,21 @@ class Host(object):
         })
 
         lg.info("Forcing run of %d plugins on host %s" % (len(plugins_list), self.name))
-        process = self.open(resource='processes', data=data)
+        with tracing.span('force run %s' % self.name,
+                          attributes={'plugins': len(plugins_list)}):
+            process = self.open(resource='processes', data=data)
 
-        if process:
-            poll = process['asyncTask']['link']['poll']
-            return self.poll(uri=poll)
-        else:
-            return False
+            if process:
+                poll = process['asyncTask']['link']['poll']
+                return self.poll(uri=poll)
+            else:
+                return False
 
     def poll(self, uri, sleep=1):
+        with tracing.span('poll', attributes={'uri': uri}):
+            return self._poll(uri, sleep)
+
+    def _poll(self, uri, sleep=1):
         result = None
         retries = 3
 
@@ -20,7 +20,10 @@ import yaml
 import smoker.logger
 from smoker.client import Client
 from smoker.client.out_junit import plugins_to_xml
+from smoker.util import tracing
+from smoker.util.columnar import FORMATS as EXPORT_FORMATS, open_writer, plugin_rows
 from smoker.util.tap import Tap, TapTest
+from smoker.util.timing import format_timing
 
 smoker.logger.init(syslog=False)
 lg = logging.getLogger('smokercli')
@@ -249,7 +252,11 @@ def main():
     group_output.add_argument(
         '-o', '--pretty', dest='pretty', default='normal',
         help=("Output format: minimal / normal / long / full / raw / json / "
-              "tap / xml"))
+              "tap / xml / csv / arrow / parquet"))
+    group_output.add_argument(
+        '--output-file', dest='output_file',
+        help=("Write csv / arrow / parquet output into file "
+              "(default stdout, required for arrow and parquet)"))
     group_output.add_argument(
         '--no-colors', dest='no_colors', action='store_true',
         help="Don't use colors in output")
@@ -268,6 +275,10 @@ def main():
     group_output.add_argument(
         '--junit-config-file', dest='junit_config_file',
         help="Name of configuration file for junit xml formatter")
+    group_output.add_argument(
+        '--trace', dest='trace',
+        help=("Append spans of the requests to given file as OTLP JSON lines, "
+              "smokerd with trace_file set adds spans of forced runs"))
 
     _add_plugin_arguments(parser, config)
     args = parser.parse_args()
@@ -285,6 +296,9 @@ def main():
         parser.print_help()
         sys.exit(0)
 
+    if args.trace:
+        tracing.configure(args.trace, 'smokercli')
+
     if args.pretty == 'minimal':
         # Minimal output (only host and errored plugins)
         if not args.no_colors:
@@ -455,10 +469,15 @@ def main():
             format_plugin_component_msg = '    [{level}] {msg}'
 
         format_plugin_run = '  Last run: {lastResult[lastRun]!s}\n  Next run: {nextRun!s}'
+        format_plugin_timing = '  Timing:   {timing}'
         format_plugin_param = '  {key:<10} {value}'
     elif args.pretty in ['raw', 'json', 'tap', 'xml']:
         # Raw and special outputs doesn't need formatting
         pass
+    elif args.pretty in EXPORT_FORMATS:
+        if args.pretty != 'csv' and not args.output_file:
+            lg.error("Output %s requires --output-file" % args.pretty)
+            sys.exit(1)
     else:
         lg.error("Invalid pretty output %s" % args.pretty)
         sys.exit(1)
@@ -542,6 +561,15 @@ def main():
     else:
         client = Client(hosts)
 
+    # Export last results host by host as they arrive
+    if args.pretty in EXPORT_FORMATS and not args.force and not args.list:
+        results = client.iter_plugins(filters, filters_negative=args.exclude,
+                                      exclude_plugins=args.exclude_plugins)
+        if not dump_columnar(results, args.pretty, args.output_file):
+            lg.error("No plugins found")
+            sys.exit(1)
+        sys.exit(0)
+
     plugins = client.get_plugins(filters, filters_negative=args.exclude,
                                  exclude_plugins=args.exclude_plugins)
 
@@ -604,6 +632,9 @@ def main():
         dump = plugins_to_xml(plugins, args.junit_config_file)
         print(dump)
         sys.exit(0)
+    elif args.pretty in EXPORT_FORMATS:
+        dump_columnar([plugins], args.pretty, args.output_file)
+        sys.exit(0)
 
     # Print result
     output = []
@@ -632,6 +663,11 @@ def main():
         # Print last and next plugin run
         output.append(format_plugin_run.format(**plugin))
 
+        # Print how long the phases of the last run took
+        if args.pretty == 'full' and plugin['lastResult'] and plugin['lastResult'].get('timing'):
+            output.append(format_plugin_timing.format(
+                timing=format_timing(plugin['lastResult']['timing'])))
+
         # Print last and next plugin run
         for key, value in plugin['parameters'].items():
             output.append(format_plugin_param.format(key=key, value=value))
@@ -737,6 +773,36 @@ def dump_tap(plugins):
 
     return tap.dump()
 
+def dump_columnar(results, format, output_file=None):
+    """
+    Write plugins results as flat table, one row per host, plugin
+    and component (see smoker.util.columnar)
+    Rows are written as soon as each PluginsResult is available
+
+    :param results: iterable of PluginsResult
+    :param format: csv, arrow or parquet
+    :param output_file: path of output file, stdout is used for csv if None
+    :rvalue: number of written plugins
+    """
+    if output_file:
+        sink = open(output_file, 'w', newline='') if format == 'csv' else output_file
+    else:
+        sink = sys.stdout
+
+    count = 0
+    try:
+        with open_writer(format, sink) as writer:
+            for plugins in results:
+                rows = []
+                for host, plugin in plugins.get_host_plugins():
+                    rows += plugin_rows(host['name'], plugin)
+                    count += 1
+                writer.write(rows)
+    finally:
+        if sink is not sys.stdout and not isinstance(sink, str):
+            sink.close()
+    return count
+
 if __name__ == '__main__':
     try:
         main()
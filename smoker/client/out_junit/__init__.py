@@ -20,6 +20,8 @@ from html import escape
 import collections
 import yaml
 
+from smoker.util.timing import run_time
+
 from . import default_config
 from . import rows
 from .xml_builder import XmlBuilder
@@ -95,6 +97,14 @@ def plugins_to_xml(dict_data,
         for row in results[res]:
             ts_res[row.Node].append(row)
 
+    # Run time of plugins by node and plugin name
+    times = {}
+    for node, host in dict_data.items():
+        for name, plugin in (host.get('plugins') or {}).items():
+            seconds = run_time((plugin.get('lastResult') or {}).get('timing'))
+            if seconds is not None:
+                times[(node, name)] = seconds
+
     junit_xml = XmlBuilder()
     for template_name, ts in ts_data.items():
         with junit_xml.testsuites as html_tss:
@@ -116,6 +126,8 @@ def plugins_to_xml(dict_data,
                             distinguisher = tc.PluginStatus
                         if not tc.CaseName:
                             html_tc.name = tc.Plugin
+                        if (tc.Node, tc.Plugin) in times:
+                            html_tc.time = '%.3f' % times[(tc.Node, tc.Plugin)]
 
                         if distinguisher == 'ERROR':
                             if tc.MsgError:
@@ -5,6 +5,10 @@
 import os
 import sys
 
+# Descriptors of sockets opened by the REST API server, plugin workers
+# forked from it don't need to guess them to close them
+server_fds = set()
+
 
 def redirect_standard_io(config):
     """
@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2007-2015, GoodData(R) Corporation. All rights reserved
+"""
+Module providing asynchronous delivery of plugin actions
+"""
+
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import time
+
+import setproctitle
+
+import smoker.util.command
+from smoker.server.exceptions import ActionDeliveryError
+from smoker.server.plugins import PluginHelpers, Result
+
+lg = logging.getLogger("smokerd.actions")
+
+# Message put to the queue to stop the runner
+STOP = "STOP"
+
+
+class ActionWorker(PluginHelpers):
+    """
+    Plugin name and parameters to execute action of plugin result with
+    """
+
+    def __init__(self, name, params):
+        self.name = name
+        self.plugin_name = name
+        self.params = params
+
+
+class Batch(object):
+    """
+    Results of plugins waiting for delivery by single action invocation
+    """
+
+    def __init__(self, action):
+        """
+        :param action: action parameters
+        :type action: dict
+        """
+        self.action = action
+        self.items = []
+        self.created = time.time()
+        self.attempt = 0
+        self.next_try = None
+
+    @property
+    def size(self):
+        return self.action.get("BatchSize") or 1
+
+    @property
+    def wait(self):
+        return self.action.get("BatchWait") or 0
+
+    def is_due(self, now):
+        """
+        Return True if batch is full, waits long enough or it's time to retry
+        """
+        if self.next_try is not None:
+            return now >= self.next_try
+        return len(self.items) >= self.size or now >= self.created + self.wait
+
+    def due_time(self):
+        """
+        Return time when batch should be delivered
+        """
+        if self.next_try is not None:
+            return self.next_try
+        return self.created + self.wait
+
+
+class ActionRunner(multiprocessing.Process):
+    """
+    Process delivering actions of plugins with Async action parameter
+
+    Plugin workers put their results into the queue and don't wait for
+    the action. Results of the same action are delivered in batches of
+    BatchSize results collected within BatchWait seconds:
+
+     * Command with BatchInput gets one line per result on stdin,
+       BatchInput is formatted by plugin parameters, result and
+       name of the plugin (plugin)
+     * Module providing run_batch(worker, results) function gets
+       all results at once
+
+    Other actions are executed for each result in the batch.
+    Failed deliveries are retried Retries times with exponential
+    backoff starting at RetryDelay seconds, only results which failed
+    are retried.
+
+    Results of plugins with different uid/gid are never delivered
+    together, action is executed by forked process with UID/GID
+    of the plugins.
+    """
+
+    def __init__(self, queue):
+        """
+        :param queue: queue of results to deliver
+        :type queue: multiprocessing.Queue
+        """
+        self.queue = queue
+        self.pending = {}
+        self.retries = []
+
+        super(ActionRunner, self).__init__()
+        self.daemon = True
+
+    def run(self):
+        setproctitle.setproctitle("smokerd action runner")
+        lg.info("Action runner started")
+
+        while True:
+            try:
+                item = self.queue.get(timeout=self.get_timeout())
+            except queue.Empty:
+                item = None
+
+            if item == STOP:
+                self.flush()
+                lg.info("Action runner stopped")
+                return
+
+            if item:
+                self.add(item)
+
+            self.deliver_due()
+
+    def get_timeout(self):
+        """
+        Return seconds until the next batch should be delivered
+        """
+        batches = list(self.pending.values()) + self.retries
+        if not batches:
+            return 1
+        due = min(batch.due_time() for batch in batches)
+        return min(max(due - time.time(), 0.01), 1)
+
+    def add(self, item):
+        """
+        Add result to the batch of it's action
+
+        :param item: dict with plugin name, plugin params and result
+        """
+        action = item["params"]["Action"]
+        key = json.dumps(
+            [action, item["params"]["uid"], item["params"]["gid"]],
+            sort_keys=True,
+            default=str,
+        )
+        if key not in self.pending:
+            self.pending[key] = Batch(action)
+        self.pending[key].items.append(item)
+
+    def deliver_due(self):
+        """
+        Deliver batches which are due
+        """
+        now = time.time()
+        for key, batch in list(self.pending.items()):
+            if batch.is_due(now):
+                del self.pending[key]
+                self.deliver(batch)
+
+        for batch in list(self.retries):
+            if batch.is_due(now):
+                self.retries.remove(batch)
+                self.deliver(batch)
+
+    def flush(self):
+        """
+        Try to deliver all pending batches without retries
+        """
+        for batch in list(self.pending.values()) + self.retries:
+            batch.action = dict(batch.action, Retries=0)
+            self.deliver(batch)
+        self.pending = {}
+        self.retries = []
+
+    def deliver(self, batch):
+        """
+        Execute action for the batch, schedule retry of failed results
+        """
+        plugins = ", ".join(item["plugin"] for item in batch.items)
+        try:
+            failed = self.execute_as(batch.action, batch.items)
+        except Exception as e:
+            lg.error("Action for plugins %s failed: %s" % (plugins, e))
+            failed = batch.items
+
+        if not failed:
+            lg.debug("Action delivered for plugins %s" % plugins)
+            return
+
+        batch.items = failed
+        plugins = ", ".join(item["plugin"] for item in failed)
+        batch.attempt += 1
+        retries = batch.action.get("Retries", 3)
+        if batch.attempt > retries:
+            lg.error(
+                "Action for plugins %s dropped after %d attempts"
+                % (plugins, batch.attempt)
+            )
+            return
+
+        delay = (batch.action.get("RetryDelay") or 5) * 2 ** (batch.attempt - 1)
+        batch.next_try = time.time() + delay
+        self.retries.append(batch)
+        lg.info("Action for plugins %s will be retried in %s seconds" % (plugins, delay))
+
+    def execute_as(self, action, items):
+        """
+        Execute action for results of plugins with the same uid/gid,
+        in forked process with their UID/GID unless they are default
+        Return list of items which failed, raise exception if whole
+        batch failed
+        """
+        worker = ActionWorker(items[0]["plugin"], items[0]["params"])
+        if worker.params["uid"] == "default" and worker.params["gid"] == "default":
+            return self.execute(action, items)
+
+        read, write = os.pipe()
+        pid = os.fork()
+        if not pid:
+            # Child reports indexes of failed items, exit code 1 if all failed
+            os.close(read)
+            code = 1
+            try:
+                worker.drop_privileged(permanent=True)
+                failed = set(id(item) for item in self.execute(action, items))
+                failed = [index for index, item in enumerate(items) if id(item) in failed]
+                with os.fdopen(write, "w") as fp:
+                    json.dump(failed, fp)
+                code = 0
+            except Exception as e:
+                lg.error("Action for plugin %s failed: %s" % (worker.name, e))
+            finally:
+                os._exit(code)
+
+        os.close(write)
+        with os.fdopen(read) as fp:
+            output = fp.read()
+        _, status = os.waitpid(pid, 0)
+        if status:
+            raise ActionDeliveryError(
+                "Action process failed with status %d, see the log" % status
+            )
+        return [items[index] for index in json.loads(output)]
+
+    def execute(self, action, items):
+        """
+        Execute action for results
+        Return list of items which failed when action is executed
+        for each result, raise exception if whole batch failed
+        """
+        workers = [ActionWorker(item["plugin"], item["params"]) for item in items]
+
+        if action["Command"] and action.get("BatchInput"):
+            # Input is not interpreted by shell, so it's not escaped
+            lines = []
+            for item in items:
+                params = dict(item["params"], plugin=item["plugin"], **item["result"])
+                lines.append(action["BatchInput"] % params)
+
+            try:
+                stdout, stderr, returncode = smoker.util.command.execute(
+                    action["Command"],
+                    timeout=action["Timeout"],
+                    input="\n".join(lines) + "\n",
+                )
+            except Exception as e:
+                raise ActionDeliveryError(
+                    "Can't execute command %s: %s" % (action["Command"], e)
+                )
+            if returncode:
+                raise ActionDeliveryError(
+                    "Command %s failed with exit code %d: %s"
+                    % (action["Command"], returncode, stderr)
+                )
+            return []
+
+        if action["Module"]:
+            results = []
+            for item in items:
+                result = Result()
+                result.result = item["result"]
+                results.append(result)
+
+            module = importlib.import_module(action["Module"])
+            if hasattr(module, "run_batch"):
+                module.run_batch(workers[0], results)
+                return []
+
+        if not action["Command"] and not action["Module"]:
+            raise ActionDeliveryError("No Command or Module to execute!")
+
+        failed = []
+        for index, (worker, item) in enumerate(zip(workers, items)):
+            try:
+                if action["Command"]:
+                    params = worker.escape(dict(item["params"], **item["result"]))
+                    result = worker.run_command(
+                        action["Command"] % params, timeout=action["Timeout"]
+                    )
+                    if result.result["status"] == "ERROR":
+                        raise ActionDeliveryError(
+                            "Command %s failed: %s"
+                            % (action["Command"], result.result["messages"])
+                        )
+                else:
+                    worker.run_module(action["Module"], result=results[index])
+            except Exception as e:
+                lg.error("Action for plugin %s failed: %s" % (item["plugin"], e))
+                failed.append(item)
+
+        return failed
@@ -7,17 +7,25 @@ import logging
 import os
 import signal
 import sys
+import tempfile
 import time
 
 import psutil
 import yaml
 
 from smoker.server import redirect_standard_io
+from smoker.server.actions import STOP, ActionRunner
+from smoker.server.history import HistoryStore
 from smoker.server.plugins import PluginManager
 from smoker.server.restserver import RestServer
+from smoker.util import tracing
 
 lg = logging.getLogger('smokerd.daemon')
 
+# Directory of the history store shared by API processes
+# when history_file is not configured
+SHARED_HISTORY_DIR = '/dev/shm'
+
 
 class Smokerd(object):
     """
@@ -26,12 +34,18 @@ class Smokerd(object):
 
     conf = {}
 
-    # ThreadedHTTPServer instance
-    server = None
+    # RestServer instances
+    servers = []
+
+    # Path of the history store created for API processes
+    shared_history = None
 
     # PluginManager instance
     pluginmgr = None
 
+    # ActionRunner instance
+    action_runner = None
+
     def __init__(self, **kwargs):
         """
         Initialize smokerd
@@ -151,6 +165,11 @@ class Smokerd(object):
         if not isinstance(self.conf['bind_port'], int):
             lg.error("Config parameter bind_port has to be integer")
 
+        # Spans of forced runs traced by clients
+        if self.conf.get('trace_file'):
+            lg.info("Spans will be written to %s" % self.conf['trace_file'])
+            tracing.configure(self.conf['trace_file'], 'smokerd')
+
         # Initialize plugin manager
         config = {}
 
@@ -168,6 +187,30 @@ class Smokerd(object):
         if 'nr_concurrent_plugins' in self.conf:
             config['semaphore_count'] = self.conf['nr_concurrent_plugins']
 
+        for key in ['process_ttl', 'process_max', 'change_max', 'status_table',
+                    'profile_dir']:
+            if key in self.conf:
+                config[key] = self.conf[key]
+
+        if 'history_file' in self.conf:
+            lg.info("Results will be stored in %s" % self.conf['history_file'])
+            config['history'] = HistoryStore(
+                self.conf['history_file'],
+                retention=self.conf.get('history_retention'),
+                keep=self.conf.get('history_keep'))
+
+        # API processes share results and forced runs through the store
+        if self.conf.get('api_processes', 1) > 1:
+            if 'history' not in config:
+                directory = SHARED_HISTORY_DIR
+                if not os.path.isdir(directory):
+                    directory = tempfile.gettempdir()
+                self.shared_history = os.path.join(
+                    directory, 'smokerd-%d.db' % os.getpid())
+                lg.info("Results will be shared in %s" % self.shared_history)
+                config['history'] = HistoryStore(self.shared_history)
+            config['shared'] = True
+
         try:
             self.pluginmgr = PluginManager(**config)
         except Exception as e:
@@ -175,11 +218,25 @@ class Smokerd(object):
             lg.exception(e)
             self._shutdown(exitcode=1)
 
+        # Keep only results which can be served
+        if self.shared_history:
+            self.pluginmgr.history.keep = max(
+                plugin.params['History']
+                for plugin in self.pluginmgr.get_plugins().values())
+
+        if self.pluginmgr.action_queue:
+            lg.info("Starting action runner")
+            self.action_runner = ActionRunner(self.pluginmgr.action_queue)
+            self.action_runner.start()
+
         lg.info("Starting webserver on %(bind_host)s:%(bind_port)s"
                 % self.conf)
         try:
-            self.server = RestServer(self)
-            self.server.start()
+            self.servers = []
+            for index in range(self.conf.get('api_processes', 1)):
+                server = RestServer(self, index)
+                server.start()
+                self.servers.append(server)
         except Exception as e:
             lg.error("Can't start HTTP server: %s" % e)
             lg.exception(e)
@@ -201,10 +258,17 @@ class Smokerd(object):
         lg.debug("Starting the smoker watchdog")
 
         while True:
-            if not self.server.is_alive():
-                lg.error("REST API server is dead")
-                self._restart_api_server()
-                lg.info("restarted the REST API server")
+            for index, server in enumerate(self.servers):
+                if not server.is_alive():
+                    lg.error("REST API server %d is dead" % index)
+                    self._restart_api_server(index)
+                    lg.info("restarted the REST API server %d" % index)
+
+            if self.action_runner and not self.action_runner.is_alive():
+                lg.error("Action runner is dead")
+                self.action_runner = ActionRunner(self.pluginmgr.action_queue)
+                self.action_runner.start()
+                lg.info("restarted the action runner")
 
             # Take care of execution of the timed plugins
             self.pluginmgr.run_plugins_with_interval()
@@ -212,25 +276,28 @@ class Smokerd(object):
 
             time.sleep(5)
 
-    def _restart_api_server(self):
-        self.server.terminate()
-        self.server.join()
+    def _restart_api_server(self, index=0):
+        self.servers[index].terminate()
+        self.servers[index].join()
 
         # kill all the running plugins - forked from restapi server holds
         # the smokerd port - new server cannot bind
-        for proc in psutil.process_iter():
-            if proc.name.startswith('smokerd plugin'):
-                lg.info("Killing running plugin %s", proc.name)
-                proc.kill()
+        # (multiple servers bind with SO_REUSEPORT, so they can)
+        if len(self.servers) == 1:
+            for proc in psutil.process_iter():
+                if proc.name.startswith('smokerd plugin'):
+                    lg.info("Killing running plugin %s", proc.name)
+                    proc.kill()
 
-        self.server = RestServer(self)
-        self.server.start()
+        self.servers[index] = RestServer(self, index)
+        self.servers[index].start()
 
     def _reopen_logfiles(self, signum=None, frame=None):
         lg.info("smokerd received SIGHUP, reopening log files")
         redirect_standard_io(self.conf)
         lg.debug("sending SIGHUP to the REST API server")
-        os.kill(self.server.pid, signal.SIGHUP)
+        for server in self.servers:
+            os.kill(server.pid, signal.SIGHUP)
 
     def stop(self):
         """
@@ -314,10 +381,10 @@ class Smokerd(object):
         lg.info("Shutting down")
         try:
             # Shutdown webserver
-            if self.server:
+            for server in self.servers:
                 try:
-                    self.server.terminate()
-                    self.server.join()
+                    server.terminate()
+                    server.join()
                 except AttributeError:
                     pass
 
@@ -325,9 +392,31 @@ class Smokerd(object):
             if self.pluginmgr:
                 self.pluginmgr.stop()
 
+            # Deliver queued actions and stop the action runner
+            if self.action_runner:
+                self.pluginmgr.action_queue.put(STOP)
+                self.action_runner.join(30)
+                if self.action_runner.is_alive():
+                    self.action_runner.terminate()
+
             # Remove PID file if exists
             if os.path.isfile(self.conf['pidfile']):
                 os.remove(self.conf['pidfile'])
+
+            # Don't let local consumers read statuses of stopped daemon
+            status_table = self.pluginmgr and self.pluginmgr.status_table
+            if status_table and os.path.isfile(status_table.path):
+                os.remove(status_table.path)
+
+            # Remove socket of the local API
+            unix_socket = self.conf.get('unix_socket')
+            if unix_socket and os.path.exists(unix_socket):
+                os.remove(unix_socket)
+
+            # Remove history store used only by API processes
+            if self.shared_history:
+                for path in glob.glob(self.shared_history + '*'):
+                    os.remove(path)
         except Exception as e:
             lg.exception(e)
             if exception:
@@ -61,6 +61,12 @@ class NoSuchPlugin(Exception):
     """
     pass
 
+class NoSuchProcess(Exception):
+    """
+    Process does not exists or it was already removed
+    """
+    pass
+
 class NoPluginsFound(Exception):
     """
     No plugins was found by given name(s) or filter
@@ -87,6 +93,12 @@ class PluginMalformedOutput(Exception):
     """
     pass
 
+class ActionDeliveryError(Exception):
+    """
+    Asynchronous action failed and will be retried
+    """
+    pass
+
 class InvalidConfiguration(Exception):
     """
     Not valid configuration parameters
@@ -0,0 +1,971 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2007-2015, GoodData(R) Corporation. All rights reserved
+"""
+Module providing in-memory and persistent storage of plugin results
+"""
+
+import array
+import collections
+import datetime
+import json
+import logging
+import math
+import os
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+
+lg = logging.getLogger("smokerd.history")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    plugin TEXT NOT NULL,
+    time REAL NOT NULL,
+    status TEXT,
+    forced INTEGER NOT NULL DEFAULT 0,
+    result TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_plugin_time ON results (plugin, time);
+CREATE INDEX IF NOT EXISTS results_plugin_id ON results (plugin, id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS processes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    plugins TEXT NOT NULL,
+    created REAL NOT NULL,
+    finished REAL,
+    seq INTEGER NOT NULL
+);
+"""
+
+
+# Order of statuses by severity, worst status wins in downsampled history
+STATUS_SEVERITY = {
+    "OK": 0,
+    "WARN": 1,
+    "ERROR": 2,
+}
+
+
+def parse_time(value):
+    """
+    Parse time given as UNIX timestamp or ISO 8601 string
+    Raise ValueError if it can't be parsed
+    """
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.datetime.fromisoformat(value).timestamp()
+
+
+def downsample(rows, step, limit=None):
+    """
+    Group results into buckets of given number of seconds,
+    worst status in the bucket wins
+
+    :param rows: (timestamp, status) tuples sorted by time
+    :param step: size of bucket in seconds
+    :param limit: maximal number of buckets
+    :rtype: list of dicts with start, end, status and count of results
+    """
+    buckets = []
+    for timestamp, status in rows:
+        start = timestamp - timestamp % step
+        if not buckets or buckets[-1]["start"] != start:
+            if limit and len(buckets) == limit:
+                break
+            buckets.append(
+                {"start": start, "end": start + step, "status": status, "count": 0}
+            )
+
+        bucket = buckets[-1]
+        bucket["count"] += 1
+        if STATUS_SEVERITY.get(status, 0) > STATUS_SEVERITY.get(bucket["status"], 0):
+            bucket["status"] = status
+
+    return buckets
+
+
+def result_timestamp(result):
+    """
+    Return lastRun of result as UNIX timestamp
+    """
+    try:
+        return datetime.datetime.fromisoformat(result["lastRun"]).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return time.time()
+
+
+# Levels of result messages in the order of the API
+MESSAGE_LEVELS = ("info", "error", "warn")
+
+# Messages structure without any message, shared by all records
+EMPTY_MESSAGES = ((), (), ())
+
+
+def _unpack_run(value):
+    """
+    Return lastRun stored in array of runs, NaN stands for unknown time
+    """
+    return None if math.isnan(value) else value
+
+
+def format_run(last_run):
+    """
+    Convert lastRun of record to the ISO format of the API
+    """
+    if isinstance(last_run, float):
+        return datetime.datetime.fromtimestamp(last_run).isoformat()
+    return last_run
+
+
+def _intern(value):
+    """
+    Intern string, so equal strings of many results are stored once
+    """
+    if isinstance(value, str):
+        return sys.intern(value)
+    return value
+
+
+def pack_messages(messages):
+    """
+    Convert messages dict to tuple of tuples of interned messages
+    ordered by MESSAGE_LEVELS
+    """
+    if messages is None:
+        return None
+
+    packed = tuple(
+        tuple(_intern(message) for message in messages.get(level) or ())
+        for level in MESSAGE_LEVELS
+    )
+    if packed == EMPTY_MESSAGES:
+        return EMPTY_MESSAGES
+    return packed
+
+
+def unpack_messages(messages):
+    """
+    Convert packed messages back to dict of lists
+    """
+    if messages is None:
+        return None
+
+    return {
+        level: list(level_messages)
+        for level, level_messages in zip(MESSAGE_LEVELS, messages)
+    }
+
+
+class ResultRecord(object):
+    """
+    Compact representation of plugin result kept in memory
+
+    Result dictionaries are converted to records when they are
+    added to history and back to dictionaries only when they
+    are served by the API. Statuses and messages are interned
+    (results of plugin usually repeat), messages of the levels
+    are stored in tuples and lastRun is stored as UNIX timestamp.
+    """
+
+    __slots__ = (
+        "status",
+        "messages",
+        "last_run",
+        "components",
+        "action",
+        "forced",
+        "resources",
+        "timing",
+        "seq",
+        "extra",
+    )
+
+    # Keys of result dict stored in slots, other keys are kept in extra
+    KEYS = (
+        "status",
+        "messages",
+        "lastRun",
+        "componentResults",
+        "action",
+        "forced",
+        "resources",
+        "timing",
+        "seq",
+    )
+
+    def __init__(self, status=None, messages=None, last_run=None,
+                 components=None, action=None, forced=False,
+                 resources=None, timing=None, seq=None, extra=None):
+        self.status = status
+        self.messages = messages
+        self.last_run = last_run
+        self.components = components
+        self.action = action
+        self.forced = forced
+        self.resources = resources
+        self.timing = timing
+        self.seq = seq
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, result):
+        """
+        Create record from result dictionary
+        """
+        last_run = result.get("lastRun")
+        if isinstance(last_run, str):
+            try:
+                last_run = datetime.datetime.fromisoformat(last_run).timestamp()
+            except ValueError:
+                pass
+
+        components = result.get("componentResults")
+        if components is not None:
+            components = tuple(
+                (
+                    _intern(name),
+                    _intern(component.get("status")),
+                    pack_messages(component.get("messages")),
+                    {
+                        key: value
+                        for key, value in component.items()
+                        if key not in ("status", "messages")
+                    }
+                    or None,
+                )
+                for name, component in components.items()
+            )
+
+        action = result.get("action")
+        if isinstance(action, dict):
+            action = cls.from_dict(action)
+
+        extra = {key: value for key, value in result.items() if key not in cls.KEYS}
+
+        return cls(
+            status=_intern(result.get("status")),
+            messages=pack_messages(result.get("messages")),
+            last_run=last_run,
+            components=components,
+            action=action,
+            forced=bool(result.get("forced")),
+            resources=result.get("resources"),
+            timing=result.get("timing"),
+            seq=result.get("seq"),
+            extra=extra or None,
+        )
+
+    def to_dict(self):
+        """
+        Return result dictionary in the format of the API
+        """
+        last_run = format_run(self.last_run)
+
+        components = None
+        if self.components is not None:
+            components = {}
+            for name, status, messages, extra in self.components:
+                component = {"status": status, "messages": unpack_messages(messages)}
+                if extra:
+                    component.update(extra)
+                components[name] = component
+
+        action = self.action
+        if isinstance(action, ResultRecord):
+            action = action.to_dict()
+
+        result = {
+            "status": self.status,
+            "messages": unpack_messages(self.messages),
+            "lastRun": last_run,
+            "componentResults": components,
+            "action": action,
+            "forced": self.forced,
+            "resources": self.resources,
+        }
+        if self.timing is not None:
+            result["timing"] = self.timing
+        if self.seq is not None:
+            result["seq"] = self.seq
+        if self.extra:
+            result.update(self.extra)
+        return result
+
+    # Slots that differ between runs of plugin even if it's result is same
+    VOLATILE = ("last_run", "resources", "timing", "seq")
+
+    def __eq__(self, other):
+        if not isinstance(other, ResultRecord):
+            return NotImplemented
+        return all(
+            getattr(self, slot) == getattr(other, slot) for slot in self.__slots__
+        )
+
+    def same_as(self, other):
+        """
+        Return True if other record has same result, no matter
+        when it was created and how much resources it took
+        """
+        if isinstance(self.action, ResultRecord) and isinstance(
+            other.action, ResultRecord
+        ):
+            if not self.action.same_as(other.action):
+                return False
+        elif self.action != other.action:
+            return False
+
+        return all(
+            getattr(self, slot) == getattr(other, slot)
+            for slot in self.__slots__
+            if slot not in self.VOLATILE and slot != "action"
+        )
+
+    def __repr__(self):
+        return "<ResultRecord %s %s>" % (self.status, self.last_run)
+
+
+class HistoryEntry(object):
+    """
+    Run of identical consecutive results of plugin
+
+    Only the last result of the run is kept as record, the previous
+    ones differ just in volatile slots, so only their lastRun and
+    sequence number are kept (in arrays, 16 bytes per result).
+    """
+
+    __slots__ = ("record", "runs", "seqs")
+
+    def __init__(self, record):
+        """
+        :param record: last result of the run (ResultRecord)
+        """
+        self.record = record
+        self.runs = array.array("d")
+        self.seqs = array.array("q")
+
+    @property
+    def count(self):
+        return len(self.runs) + 1
+
+    @property
+    def first_run(self):
+        if self.runs:
+            return _unpack_run(self.runs[0])
+        return self.record.last_run
+
+    def add(self, record):
+        """
+        Make record the last result of the run
+        """
+        last_run = self.record.last_run
+        self.runs.append(last_run if isinstance(last_run, float) else math.nan)
+        self.seqs.append(self.record.seq or 0)
+        self.record = record
+
+    def drop_first(self):
+        """
+        Forget the first result of the run, the last one is always kept
+        """
+        del self.runs[0]
+        del self.seqs[0]
+
+    def __iter__(self):
+        """
+        Iterate over (seq, lastRun) of results of the run, oldest first
+        """
+        for last_run, seq in zip(self.runs, self.seqs):
+            yield seq or None, _unpack_run(last_run)
+        yield self.record.seq, self.record.last_run
+
+    def to_dicts(self):
+        """
+        Return results of the run, oldest first
+        Results before the last one have no resources and timing
+        """
+        results = []
+        for seq, last_run in self:
+            result = self.record.to_dict()
+            if len(results) < len(self.runs):
+                result["lastRun"] = format_run(last_run)
+                result["resources"] = None
+                result.pop("timing", None)
+                result.pop("seq", None)
+                if seq is not None:
+                    result["seq"] = seq
+            results.append(result)
+        return results
+
+
+class ResultHistory(object):
+    """
+    In-memory history of plugin results limited to given number of results
+
+    Identical consecutive results (most of the time plugin returns
+    the same result) are merged into single entry, which can be
+    expanded back to the results.
+    """
+
+    def __init__(self, maxlen):
+        """
+        :param maxlen: maximal number of results
+        """
+        self.maxlen = maxlen
+        self.entries = collections.deque()
+        self.size = 0
+
+    def append(self, record):
+        """
+        Add result record, merge it with the last entry if it's the same,
+        forget the oldest result when there are more than maxlen results
+        """
+        if self.entries and self.entries[-1].record.same_as(record):
+            self.entries[-1].add(record)
+        else:
+            self.entries.append(HistoryEntry(record))
+        self.size += 1
+
+        while self.size > self.maxlen:
+            if self.entries[0].count > 1:
+                self.entries[0].drop_first()
+            else:
+                self.entries.popleft()
+            self.size -= 1
+
+    def last(self):
+        """
+        Return last result record or None
+        """
+        if not self.entries:
+            return None
+        return self.entries[-1].record
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        """
+        Return number of results (not entries)
+        """
+        return self.size
+
+    def __getitem__(self, index):
+        return self.entries[index]
+
+
+class HistoryStore(object):
+    """
+    Append-only log of plugin results stored in SQLite database (WAL mode)
+
+    Results are appended by the process collecting them and replayed
+    on startup. Old results are removed by periodic compaction.
+    """
+
+    def __init__(self, path, retention=None, keep=None, compact_interval=3600):
+        """
+        :param path: database file
+        :param retention: remove results older than given number of seconds
+        :param keep: keep at most given number of results for each plugin
+        :param compact_interval: run compaction every given number of seconds
+        """
+        self.path = path
+        self.retention = retention
+        self.keep = keep
+        self.compact_interval = compact_interval
+
+        self.lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+        self._last_compaction = time.time()
+
+    @property
+    def connection(self):
+        """
+        Return database connection of current process
+        Connection can't be shared by forked processes, so each
+        process opens it's own
+        """
+        if self._connection is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+
+            connection = sqlite3.connect(
+                self.path, timeout=30, isolation_level=None, check_same_thread=False
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(SCHEMA)
+
+            self._connection = connection
+            self._pid = os.getpid()
+
+        return self._connection
+
+    def append(self, plugin, result, data=None):
+        """
+        Append plugin result
+        Return id of stored result or None if it can't be stored
+
+        :param plugin: name of the plugin
+        :param result: result dictionary
+        :param data: result encoded by json.dumps(), if it's encoded already
+        """
+        try:
+            with self.lock:
+                cursor = self.connection.execute(
+                    "INSERT INTO results (plugin, time, status, forced, result)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (
+                        plugin,
+                        result_timestamp(result),
+                        result.get("status"),
+                        1 if result.get("forced") else 0,
+                        data or json.dumps(result),
+                    ),
+                )
+                id = cursor.lastrowid
+        except (sqlite3.Error, OSError, TypeError, ValueError) as e:
+            lg.error("Can't store result of plugin %s: %s" % (plugin, e))
+            return None
+
+        return id
+
+    def last(self, plugin, limit):
+        """
+        Return last results of plugin, oldest first
+
+        :param plugin: name of the plugin
+        :param limit: maximal number of results
+        """
+        try:
+            with self.lock:
+                rows = self.connection.execute(
+                    "SELECT id, result FROM results WHERE plugin = ?"
+                    " ORDER BY id DESC LIMIT ?",
+                    (plugin, limit),
+                ).fetchall()
+        except (sqlite3.Error, OSError) as e:
+            lg.error("Can't load results of plugin %s: %s" % (plugin, e))
+            return []
+
+        return [
+            dict(json.loads(result), seq=id) for id, result in reversed(rows)
+        ]
+
+    def query(self, plugin, since=None, until=None, after=None, limit=None, statuses=False):
+        """
+        Return results of plugin in time range in the order they were stored
+
+        :param plugin: name of the plugin
+        :param since: only results with time >= since
+        :param until: only results with time < until
+        :param after: only results with id > after (pagination cursor)
+        :param limit: maximal number of results
+        :param statuses: return only statuses instead of whole results
+        :rtype: list of (id, timestamp, result or status) tuples
+        """
+        query = "SELECT id, time, %s FROM results WHERE plugin = ?" % (
+            "status" if statuses else "result"
+        )
+        args = [plugin]
+        if since is not None:
+            query += " AND time >= ?"
+            args.append(since)
+        if until is not None:
+            query += " AND time < ?"
+            args.append(until)
+        if after is not None:
+            query += " AND id > ?"
+            args.append(after)
+        query += " ORDER BY id"
+        if limit:
+            query += " LIMIT ?"
+            args.append(limit)
+
+        try:
+            with self.lock:
+                rows = self.connection.execute(query, args).fetchall()
+        except (sqlite3.Error, OSError) as e:
+            lg.error("Can't load results of plugin %s: %s" % (plugin, e))
+            return []
+
+        if statuses:
+            return rows
+        return [
+            (id, timestamp, dict(json.loads(result), seq=id))
+            for id, timestamp, result in rows
+        ]
+
+    def changes(self, after, limit=None):
+        """
+        Return results of all plugins stored after given id, ordered by id
+
+        :param after: id of the last known result
+        :param limit: maximal number of results
+        :rtype: list of (id, plugin, result) tuples
+        """
+        query = "SELECT id, plugin, result FROM results WHERE id > ? ORDER BY id"
+        args = [after]
+        if limit:
+            query += " LIMIT ?"
+            args.append(limit)
+
+        try:
+            with self.lock:
+                rows = self.connection.execute(query, args).fetchall()
+        except (sqlite3.Error, OSError) as e:
+            lg.error("Can't load changes: %s" % e)
+            return []
+
+        return [
+            (id, plugin, dict(json.loads(result), seq=id))
+            for id, plugin, result in rows
+        ]
+
+    def id_range(self):
+        """
+        Return ids of the first and last stored result, (None, None) if empty
+
+        The first id is the one after the last result removed by compaction
+        when it's greater than the id of the first stored result, since
+        the results before it are not complete (some plugins keep less
+        results than others).
+        """
+        try:
+            with self.lock:
+                connection = self.connection
+                first, last = connection.execute(
+                    "SELECT MIN(id), MAX(id) FROM results"
+                ).fetchone()
+                compacted = connection.execute(
+                    "SELECT value FROM meta WHERE key = 'compacted'"
+                ).fetchone()
+        except (sqlite3.Error, OSError) as e:
+            lg.error("Can't load ids of results: %s" % e)
+            return None, None
+
+        if first is not None and compacted:
+            first = max(first, int(compacted[0]) + 1)
+        return first, last
+
+    @property
+    def epoch(self):
+        """
+        Return identifier of the database, it changes only when
+        the database is recreated (ids of results start again)
+        """
+        try:
+            with self.lock:
+                connection = self.connection
+                connection.execute(
+                    "INSERT OR IGNORE INTO meta (key, value) VALUES ('epoch', ?)",
+                    (uuid.uuid4().hex,),
+                )
+                return connection.execute(
+                    "SELECT value FROM meta WHERE key = 'epoch'"
+                ).fetchone()[0]
+        except (sqlite3.Error, OSError) as e:
+            lg.error("Can't load epoch of results history: %s" % e)
+            return None
+
+    def add_process(self, plugins, created):
+        """
+        Add forced run of plugins shared by all API processes
+        Return ID of the process
+
+        :param plugins: list of plugin names
+        :param created: UNIX timestamp
+        """
+        try:
+            with self.lock:
+                cursor = self.connection.execute(
+                    "INSERT INTO processes (plugins, created, seq)"
+                    " SELECT ?, ?, IFNULL(MAX(id), 0) FROM results",
+                    (json.dumps(plugins), created),
+                )
+                return cursor.lastrowid
+        except (sqlite3.Error, OSError) as e:
+            lg.error("Can't store process: %s" % e)
+            return None
+
+    def get_process(self, id):
+        """
+        Return process or None if it doesn't exist
+
+        Process is dict with id, plugins, created and finished time
+        and seq, the last id of result stored before it was created
+        """
+        processes = self.list_processes(id=id)
+        return processes[0] if processes else None
+
+    def list_processes(self, after=None, id=None):
+        """
+        Return processes ordered by ID
+
+        :param after: only processes with ID greater than given one
+        :param id: only process with given ID
+        """
+        query = "SELECT id, plugins, created, finished, seq FROM processes"
+        args = []
+        if id is not None:
+            query += " WHERE id = ?"
+            args.append(id)
+        elif after is not None:
+            query += " WHERE id > ?"
+            args.append(after)
+        query += " ORDER BY id"
+
+        try:
+            with self.lock:
+                rows = self.connection.execute(query, args).fetchall()
+        except (sqlite3.Error, OSError) as e:
+            lg.error("Can't load processes: %s" % e)
+            return []
+
+        return [
+            {
+                "id": id,
+                "plugins": json.loads(plugins),
+                "created": created,
+                "finished": finished,
+                "seq": seq,
+            }
+            for id, plugins, created, finished, seq in rows
+        ]
+
+    def finish_process(self, id, finished):
+        """
+        Set finish time of process unless it's already set
+        """
+        try:
+            with self.lock:
+                self.connection.execute(
+                    "UPDATE processes SET finished = ?"
+                    " WHERE id = ? AND finished IS NULL",
+                    (finished, id),
+                )
+        except (sqlite3.Error, OSError) as e:
+            lg.error("Can't finish process %s: %s" % (id, e))
+
+    def forced_plugins(self, plugins, after):
+        """
+        Return set of plugins with forced result stored after given id
+        """
+        try:
+            with self.lock:
+                rows = self.connection.execute(
+                    "SELECT DISTINCT plugin FROM results WHERE forced = 1 AND id > ?"
+                    " AND plugin IN (%s)" % ", ".join("?" * len(plugins)),
+                    [after] + list(plugins),
+                ).fetchall()
+        except (sqlite3.Error, OSError) as e:
+            lg.error("Can't load forced results: %s" % e)
+            return set()
+        return set(plugin for (plugin,) in rows)
+
+    def compact_processes(self, ttl=None, max=None):
+        """
+        Remove processes finished more than ttl seconds ago
+        and the oldest processes over max
+        """
+        try:
+            with self.lock:
+                connection = self.connection
+                if ttl:
+                    connection.execute(
+                        "DELETE FROM processes WHERE finished < ?",
+                        (time.time() - ttl,),
+                    )
+                if max:
+                    connection.execute(
+                        "DELETE FROM processes WHERE id <= ("
+                        " SELECT id FROM processes ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                        (max,),
+                    )
+        except (sqlite3.Error, OSError) as e:
+            lg.error("Can't compact processes: %s" % e)
+
+    def maybe_compact(self):
+        """
+        Run compaction if it wasn't run for compact_interval seconds
+        Called periodically by the process collecting results
+        """
+        if time.time() - self._last_compaction > self.compact_interval:
+            self.compact()
+
+    def compact(self):
+        """
+        Remove results out of retention time or over the limit per plugin
+        and truncate the write-ahead log
+        """
+        self._last_compaction = time.time()
+        lg.info("Compacting results history %s" % self.path)
+
+        try:
+            with self.lock:
+                connection = self.connection
+                # Remember the last removed id, results before it are incomplete
+                compacted = []
+                if self.retention:
+                    compacted.append(connection.execute(
+                        "SELECT MAX(id) FROM results WHERE time < ?",
+                        (time.time() - self.retention,),
+                    ).fetchone()[0])
+                    connection.execute(
+                        "DELETE FROM results WHERE time < ?",
+                        (time.time() - self.retention,),
+                    )
+
+                if self.keep:
+                    plugins = connection.execute(
+                        "SELECT DISTINCT plugin FROM results"
+                    ).fetchall()
+                    for (plugin,) in plugins:
+                        row = connection.execute(
+                            "SELECT id FROM results WHERE plugin = ?"
+                            " ORDER BY id DESC LIMIT 1 OFFSET ?",
+                            (plugin, self.keep),
+                        ).fetchone()
+                        if not row:
+                            continue
+                        compacted.append(row[0])
+                        connection.execute(
+                            "DELETE FROM results WHERE plugin = ? AND id <= ?",
+                            (plugin, row[0]),
+                        )
+
+                compacted = [id for id in compacted if id is not None]
+                if compacted:
+                    connection.execute(
+                        "INSERT OR REPLACE INTO meta (key, value)"
+                        " SELECT 'compacted', MAX(?, IFNULL(("
+                        " SELECT CAST(value AS INTEGER) FROM meta"
+                        " WHERE key = 'compacted'), 0))",
+                        (max(compacted),),
+                    )
+
+                connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except (sqlite3.Error, OSError) as e:
+            lg.error("Can't compact results history: %s" % e)
+
+
+class ChangeFeed(object):
+    """
+    Daemon-wide feed of plugin results ordered by sequence number
+
+    Sequence number is id of the result in the history store when
+    results are stored, otherwise it's counted in memory and the feed
+    keeps only limited number of the last results. Consumers can
+    wait for new results.
+    """
+
+    def __init__(self, history=None, maxlen=10000):
+        """
+        :param history: HistoryStore instance or None
+        :param maxlen: number of results kept in memory without history store
+        """
+        self.history = history
+        self.entries = collections.deque(maxlen=maxlen)
+        self.condition = threading.Condition()
+        self.last_seq = 0
+        self._epoch = None
+
+    @property
+    def epoch(self):
+        """
+        Return identifier of the sequence, consumers have to start
+        from scratch when it changes
+        """
+        if self._epoch is None:
+            if self.history:
+                self._epoch = self.history.epoch
+            if self._epoch is None:
+                self._epoch = uuid.uuid4().hex
+        return self._epoch
+
+    def restore(self):
+        """
+        Continue the sequence of results in the history store
+        """
+        if self.history:
+            last = self.history.id_range()[1]
+            with self.condition:
+                self.last_seq = max(self.last_seq, last or 0)
+
+    def append(self, plugin, record, seq=None):
+        """
+        Add result of plugin and wake up waiting consumers
+        Return sequence number of the result
+
+        :param plugin: name of the plugin
+        :param record: ResultRecord instance
+        :param seq: id of the result in the history store, the result
+            is not added to the feed (None is returned) if the history
+            store is used and it couldn't be stored
+        """
+        with self.condition:
+            if self.history:
+                # Result which couldn't be stored is not part of the feed
+                if seq is None:
+                    return None
+            elif seq is None or seq <= self.last_seq:
+                seq = self.last_seq + 1
+            self.last_seq = max(seq, self.last_seq)
+            if not self.history:
+                self.entries.append((seq, plugin, record))
+            self.condition.notify_all()
+        return seq
+
+    def wait(self, seq, timeout):
+        """
+        Wait until there is result newer than given sequence number
+        Return False on timeout
+        """
+        with self.condition:
+            return self.condition.wait_for(lambda: self.last_seq > seq, timeout)
+
+    def first_seq(self):
+        """
+        Return sequence number of the earliest result retained in the feed,
+        consumers which know only older results have to reload whole state
+        (None if the feed is empty)
+        """
+        if self.history:
+            return self.history.id_range()[0]
+        with self.condition:
+            return self.entries[0][0] if self.entries else None
+
+    def since(self, seq, limit=None):
+        """
+        Return results newer than given sequence number
+
+        Reset is True when the results right after given sequence number
+        are not available anymore (or the sequence number is unknown), so
+        consumer has to reload whole state.
+
+        :param seq: sequence number of the last known result
+        :param limit: maximal number of results
+        :rtype: tuple (reset, list of (seq, plugin, result) tuples)
+        """
+        if self.history:
+            first = self.first_seq()
+            changes = self.history.changes(seq, limit)
+        else:
+            with self.condition:
+                entries = list(self.entries)
+            first = entries[0][0] if entries else None
+            changes = [
+                (entry_seq, plugin, record.to_dict())
+                for entry_seq, plugin, record in entries
+                if entry_seq > seq
+            ][:limit]
+
+        reset = seq > self.last_seq or (first is not None and seq + 1 < first)
+        return reset, changes
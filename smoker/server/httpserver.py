@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2007-2015, GoodData(R) Corporation. All rights reserved
+"""
+Module providing HTTP servers for smokerd REST API
+
+Two worker models are available:
+
+ * threaded - new thread for every connection (default)
+ * pool - fixed number of worker threads, other accepted connections
+   wait in the queue, so burst of clients can't exhaust the daemon
+
+Both keep connections alive between requests unless disabled
+and drop connections of clients which don't send anything
+within the timeout.
+
+Servers listen on TCP host and port or on Unix domain socket
+given as unix:///path host.
+"""
+
+import concurrent.futures
+import http.server
+import logging
+import os
+import select
+import socket
+import socketserver
+import sys
+import threading
+import time
+import urllib.parse
+
+from werkzeug.serving import BaseWSGIServer, ThreadedWSGIServer
+from werkzeug.wsgi import LimitedStream
+
+lg = logging.getLogger("smokerd.httpserver")
+
+# Default size of the queue of connections waiting for accept()
+BACKLOG = 128
+
+# Default number of seconds to wait for request of the client
+TIMEOUT = 30
+
+# Seconds between checks of connections waiting for a free worker
+# while worker waits for next request on kept-alive connection
+IDLE_POLL = 0.05
+
+# Permissions of the Unix domain socket, any local user can connect
+# as well as to the TCP port
+SOCKET_MODE = 0o666
+
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    WSGI request handler keeping connections alive
+
+    Werkzeug's handler closes every connection, because it can't tell
+    how much of the request body the application has read. Request body
+    is limited by Content-Length here, so the rest of it is skipped and
+    the next request on the connection can be read.
+    """
+
+    protocol_version = "HTTP/1.1"
+    keep_alive = True
+    timeout = TIMEOUT
+
+    def handle(self):
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection and self.wait_for_request():
+            self.handle_one_request()
+
+    def handle_one_request(self):
+        try:
+            super(RequestHandler, self).handle_one_request()
+        except (ConnectionError, socket.timeout):
+            self.close_connection = True
+
+    def wait_for_request(self):
+        """
+        Wait for next request on kept-alive connection
+        Return False when client doesn't send it within timeout or,
+        with pool of workers, as soon as other connections wait
+        for a free worker
+        """
+        deadline = time.time() + self.timeout
+        pool = hasattr(self.server, "waiting")
+        while True:
+            # Request could be read into the buffer with the previous one
+            self.connection.settimeout(0)
+            try:
+                if self.rfile.peek(1):
+                    return True
+            except OSError:
+                return False
+            finally:
+                self.connection.settimeout(self.timeout)
+
+            if pool and self.server.waiting:
+                return False
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            readable, _, _ = select.select(
+                [self.connection], [], [], min(remaining, IDLE_POLL) if pool else remaining
+            )
+            if readable:
+                return True
+
+    def __getattr__(self, name):
+        # Let the application handle all methods
+        if name.startswith("do_"):
+            return self.run_wsgi
+        raise AttributeError(name)
+
+    def address_string(self):
+        # Clients of Unix domain socket don't have any address
+        return self.client_address[0] if self.client_address else "local"
+
+    def make_environ(self):
+        path, _, query = self.path.partition("?")
+        if self.server.address_family == socket.AF_UNIX:
+            server_address = (self.server.server_address, 0)
+            client_address = ("", 0)
+        else:
+            server_address = self.server.server_address
+            client_address = self.client_address
+        environ = {
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": "http",
+            "wsgi.input": LimitedStream(self.rfile, int(self.headers.get("Content-Length") or 0)),
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+            "REQUEST_METHOD": self.command,
+            "SCRIPT_NAME": "",
+            "PATH_INFO": urllib.parse.unquote(path, "latin-1"),
+            "QUERY_STRING": query,
+            "REQUEST_URI": self.path,
+            "RAW_URI": self.path,
+            "SERVER_NAME": server_address[0],
+            "SERVER_PORT": str(server_address[1]),
+            "SERVER_PROTOCOL": self.request_version,
+            "REMOTE_ADDR": client_address[0],
+            "REMOTE_PORT": client_address[1],
+        }
+        for key, value in self.headers.items():
+            key = key.upper().replace("-", "_")
+            if key in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+                environ[key] = value
+            else:
+                environ["HTTP_" + key] = value
+        return environ
+
+    def run_wsgi(self):
+        if "Transfer-Encoding" in self.headers:
+            self.close_connection = True
+            self.send_error(411, "Request body has to have Content-Length")
+            return
+
+        environ = self.make_environ()
+        response = {}
+        keep_alive = (
+            self.keep_alive
+            and not self.close_connection
+            and not getattr(self.server, "waiting", 0)
+        )
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and "sent" in response:
+                raise exc_info[1].with_traceback(exc_info[2])
+            response["status"] = status
+            response["headers"] = headers
+            return write
+
+        def write(data):
+            if "sent" not in response:
+                response["sent"] = True
+                code, _, message = response["status"].partition(" ")
+                self.send_response(int(code), message)
+                names = set()
+                for name, value in response["headers"]:
+                    self.send_header(name, value)
+                    names.add(name.lower())
+                if keep_alive and "content-length" not in names and self.command != "HEAD":
+                    response["chunked"] = True
+                    self.send_header("Transfer-Encoding", "chunked")
+                if not keep_alive or ("content-length" not in names and not response.get("chunked")):
+                    self.send_header("Connection", "close")
+                self.end_headers()
+
+            if data and response.get("chunked"):
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            elif data:
+                self.wfile.write(data)
+
+        application_iter = self.server.app(environ, start_response)
+        try:
+            for data in application_iter:
+                write(data)
+            write(b"")
+            if response.get("chunked"):
+                self.wfile.write(b"0\r\n\r\n")
+        finally:
+            if hasattr(application_iter, "close"):
+                application_iter.close()
+            # Skip unread request body
+            environ["wsgi.input"].exhaust()
+
+    def log_request(self, code="-", size="-"):
+        lg.debug('%s "%s" %s', self.address_string(), self.requestline, code)
+
+    def log_message(self, format, *args):
+        lg.info("%s %s", self.address_string(), format % args)
+
+
+class PoolMixIn(socketserver.ThreadingMixIn):
+    """
+    Handle connections by fixed pool of threads
+
+    Worker closes kept-alive connection when other connections wait
+    for a free worker (checked every IDLE_POLL seconds while it waits
+    for the next request), so idle clients can't block them. No more
+    connections are accepted while all workers are busy, the others
+    wait in the listen queue of the socket.
+    """
+
+    workers = 16
+    waiting = 0
+
+    def process_request(self, request, client_address):
+        if not hasattr(self, "executor"):
+            self.executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="api worker"
+            )
+            self.waiting_lock = threading.Lock()
+            self.free_workers = threading.BoundedSemaphore(self.workers)
+
+        with self.waiting_lock:
+            self.waiting += 1
+        self.free_workers.acquire()
+        self.executor.submit(self.process_waiting_request, request, client_address)
+
+    def process_waiting_request(self, request, client_address):
+        with self.waiting_lock:
+            self.waiting -= 1
+        try:
+            self.process_request_thread(request, client_address)
+        finally:
+            self.free_workers.release()
+
+    def server_close(self):
+        super(PoolMixIn, self).server_close()
+        if hasattr(self, "executor"):
+            self.executor.shutdown(wait=False)
+
+
+class PoolWSGIServer(PoolMixIn, BaseWSGIServer):
+    multithread = True
+
+
+class ReusePortMixIn(object):
+    """
+    Let more processes listen on the same port, kernel balances
+    connections between them
+    """
+
+    reuse_port = False
+
+    def server_bind(self):
+        if self.reuse_port and self.address_family != socket.AF_UNIX:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super(ReusePortMixIn, self).server_bind()
+        if self.address_family == socket.AF_UNIX:
+            os.chmod(self.server_address, SOCKET_MODE)
+
+
+def make_server(
+    host,
+    port,
+    app,
+    workers=None,
+    backlog=BACKLOG,
+    keep_alive=True,
+    timeout=TIMEOUT,
+    reuse_port=False,
+):
+    """
+    Create HTTP server for WSGI application
+
+    :param host: host name, address or unix:///path of the socket
+    :param port: TCP port, ignored for Unix domain socket
+    :param workers: number of worker threads, thread per connection if None
+    :param backlog: size of the listen queue
+    :param keep_alive: keep connections open for next requests
+    :param timeout: seconds to wait for request of the client
+    :param reuse_port: allow other processes to listen on the same port
+    """
+    handler = type(
+        "RequestHandler",
+        (RequestHandler,),
+        {"keep_alive": keep_alive, "timeout": timeout},
+    )
+
+    if workers:
+        cls = type("WSGIServer", (PoolWSGIServer,), {"workers": workers})
+    else:
+        cls = ThreadedWSGIServer
+    # Listen queue size is used by server_activate() in the constructor
+    cls = type(
+        "WSGIServer",
+        (ReusePortMixIn, cls),
+        {"request_queue_size": backlog, "reuse_port": reuse_port},
+    )
+
+    lg.info(
+        "Serving %s by %s, backlog %d, keep-alive %s, timeout %s",
+        host if host.startswith("unix://") else "%s:%s" % (host, port),
+        "%d worker threads" % workers if workers else "thread per connection",
+        backlog,
+        keep_alive,
+        timeout,
+    )
+    return cls(host, port, app, handler=handler)
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2007-2015, GoodData(R) Corporation. All rights reserved
+"""
+Module providing metrics of plugin runs in Prometheus text format
+
+Workers record timestamps of the run phases into timing block of the
+result, metrics are updated by the API process when it gets the result,
+so the workers don't need any shared state. Every API process keeps
+it's own metrics of all results it has seen.
+
+Usage example:
+
+RUNS.inc(plugin="Uptime", status="OK")
+DURATION.observe(0.25, plugin="Uptime", status="OK")
+print(REGISTRY.expose())
+"""
+
+import math
+import threading
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Buckets of run phases in seconds, plugins run from milliseconds
+# up to their Timeout (30 minutes by default)
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                30, 60, 120, 300, 600, 1800)
+
+# Buckets of result sizes in bytes
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    labels = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        labels.append('%s="%s"' % (name, value))
+    return "{%s}" % ",".join(labels)
+
+
+class Metric(object):
+    """
+    Base of metrics with values by labels
+    """
+
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+        return tuple(labels[name] for name in self.labels)
+
+    def samples(self):
+        """
+        Return list of (name, label names, label values, value)
+        """
+        with self.lock:
+            return [(self.name, self.labels, key, value)
+                    for key, value in sorted(self.values.items())]
+
+    def expose(self):
+        lines = [
+            "# HELP %s %s" % (self.name, self.help),
+            "# TYPE %s %s" % (self.name, self.type),
+        ]
+        for name, names, values, value in self.samples():
+            lines.append("%s%s %s" % (name, format_labels(names, values), format_value(value)))
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, value=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def get(self, **labels):
+        return self.values.get(self.key(labels), 0)
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+    def get(self, **labels):
+        return self.values.get(self.key(labels))
+
+
+class Histogram(Metric):
+    """
+    Histogram keeps count of observations in each bucket
+    (not cumulative), total count and sum
+    """
+
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=TIME_BUCKETS):
+        super(Histogram, self).__init__(name, help, labels)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0] * len(self.buckets) + [0.0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            counts[-1] += value
+
+    def get(self, **labels):
+        """
+        Return (count, sum) of observations
+        """
+        counts = self.values.get(self.key(labels))
+        if not counts:
+            return 0, 0
+        return sum(counts[:-1]), counts[-1]
+
+    def samples(self):
+        samples = []
+        names = self.labels + ("le",)
+        with self.lock:
+            items = [(key, list(counts)) for key, counts in sorted(self.values.items())]
+        for key, counts in items:
+            total = 0
+            for bound, count in zip(self.buckets, counts):
+                total += count
+                samples.append(("%s_bucket" % self.name, names,
+                                key + (format_value(bound),), total))
+            samples.append(("%s_sum" % self.name, self.labels, key, counts[-1]))
+            samples.append(("%s_count" % self.name, self.labels, key, total))
+        return samples
+
+
+class Registry(object):
+    """
+    Set of metrics exposed together
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def expose(self):
+        """
+        Return all metrics in Prometheus text format
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+RUNS = REGISTRY.register(Counter(
+    "smokerd_plugin_runs_total", "Results of plugin runs",
+    ("plugin", "status", "forced")))
+TIMEOUTS = REGISTRY.register(Counter(
+    "smokerd_plugin_timeouts_total", "Plugin runs killed after Timeout",
+    ("plugin",)))
+DURATION = REGISTRY.register(Histogram(
+    "smokerd_plugin_run_duration_seconds", "Time of plugin execution including action",
+    ("plugin", "status")))
+SCHEDULE_LAG = REGISTRY.register(Histogram(
+    "smokerd_plugin_schedule_lag_seconds", "Delay of worker start after the run was due",
+    ("plugin",)))
+SPAWN_LATENCY = REGISTRY.register(Histogram(
+    "smokerd_plugin_spawn_latency_seconds", "Time from fork of the worker to it's start",
+    ("plugin",)))
+SEMAPHORE_WAIT = REGISTRY.register(Histogram(
+    "smokerd_plugin_semaphore_wait_seconds", "Wait for a slot of concurrent plugins",
+    ("plugin",)))
+ACTION_DURATION = REGISTRY.register(Histogram(
+    "smokerd_plugin_action_duration_seconds", "Time of synchronous action execution",
+    ("plugin",)))
+CPU_TIME = REGISTRY.register(Counter(
+    "smokerd_plugin_cpu_seconds_total", "User and system CPU time of plugin runs",
+    ("plugin", "process")))
+RESULT_SIZE = REGISTRY.register(Histogram(
+    "smokerd_plugin_result_size_bytes", "Size of JSON encoded stored result",
+    ("plugin",), buckets=SIZE_BUCKETS))
+
+WORKERS = REGISTRY.register(Gauge(
+    "smokerd_plugin_workers", "Running plugin workers"))
+FORCED_QUEUED = REGISTRY.register(Gauge(
+    "smokerd_forced_runs_queued", "Forced plugin runs waiting for result"))
+OPEN_FDS = REGISTRY.register(Gauge(
+    "smokerd_open_fds", "Open file descriptors", ("process",)))
+RSS = REGISTRY.register(Gauge(
+    "smokerd_resident_memory_bytes", "Resident memory size", ("process",)))
+
+
+def cpu_time(resources, process=None):
+    """
+    Return user and system CPU seconds of the worker and the commands
+    it executed (or only of the given process), 0 if it's not known
+    """
+    total = 0
+    for name in (process,) if process else ("worker", "children"):
+        usage = (resources or {}).get(name)
+        if usage:
+            total += usage.get("userTime", 0) + usage.get("systemTime", 0)
+    return total
+
+
+def observe_result(plugin, result, size=None):
+    """
+    Update metrics by new result of the plugin
+
+    :param size: size of JSON encoded result when it's encoded anyway
+        (to store it in the history), results are not encoded for metrics
+    """
+    status = result.get("status") or "UNKNOWN"
+    RUNS.inc(plugin=plugin, status=status, forced=str(bool(result.get("forced"))).lower())
+    if size is not None:
+        RESULT_SIZE.observe(size, plugin=plugin)
+    for process in ("worker", "children"):
+        seconds = cpu_time(result.get("resources"), process)
+        if seconds:
+            CPU_TIME.inc(seconds, plugin=plugin, process=process)
+
+    timing = result.get("timing")
+    if not timing:
+        return
+    if timing.get("timedOut"):
+        TIMEOUTS.inc(plugin=plugin)
+
+    def observe(histogram, start, end, **labels):
+        if timing.get(start) and timing.get(end):
+            histogram.observe(max(0, timing[end] - timing[start]), plugin=plugin, **labels)
+
+    observe(SCHEDULE_LAG, "scheduled", "spawned")
+    observe(SPAWN_LATENCY, "spawned", "started")
+    observe(SEMAPHORE_WAIT, "started", "semaphoreAcquired")
+    observe(DURATION, "semaphoreAcquired", "finished", status=status)
+    observe(ACTION_DURATION, "actionStarted", "actionFinished")
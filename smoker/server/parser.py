@@ -7,12 +7,24 @@ from smoker.server.plugins import Result
 class BaseParser(object):
     """
     Base class for all parsers
+
+    Parsers either implement parse() working with complete
+    stdout/stderr or set streaming = True and implement feed()
+    and finish(). Streaming parsers are fed by stdout lines while
+    the command is running, so they don't need to keep whole
+    output in memory.
     """
     stdout = None
     stderr = None
     result = None
 
-    def __init__(self, stdout, stderr):
+    # Parser implements feed() and finish()
+    streaming = False
+
+    # First exception raised by feed()
+    error = None
+
+    def __init__(self, stdout='', stderr=''):
         """
         Set stdout and stderr
         """
@@ -20,6 +32,49 @@ class BaseParser(object):
         self.stderr = stderr
         self.result = Result()
 
+    def feed(self, line):
+        """
+        Process single line of stdout (streaming parsers only)
+        Components can be added to result as soon as they are parsed
+        """
+        raise NotImplementedError
+
+    def feed_line(self, line):
+        """
+        Feed line from the command engine
+        Remember first exception and ignore rest of the output
+        """
+        if self.error:
+            return
+
+        try:
+            self.feed(line)
+        except Exception as e:
+            self.error = e
+
+    def finish(self):
+        """
+        Finish parsing after command exit and return result
+        stderr is available at this point (streaming parsers only)
+        """
+        if self.error:
+            raise self.error
+
+        return self.result
+
+    def parse(self):
+        """
+        Parse complete stdout and return result
+        Streaming parsers are fed by stdout lines
+        """
+        if not self.streaming:
+            raise NotImplementedError
+
+        for line in self.stdout.splitlines():
+            self.feed_line(line)
+
+        return self.finish()
+
     def get_result(self):
         """
         Get result
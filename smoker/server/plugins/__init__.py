@@ -2,21 +2,33 @@
 # -*- coding: utf-8 -*-
 # Copyright (C) 2007-2012, GoodData(R) Corporation. All rights reserved
 
+import collections
 import datetime
 import gc
+import importlib
 import json
 import logging
 import multiprocessing
 import os
 import re
+import resource
 import signal
 import socket
+import stat
+import sys
+import threading
 import time
 from builtins import object, str
 
+import psutil
 import setproctitle
 
 import smoker.util.command
+from smoker.server import metrics, server_fds
+from smoker.server.history import ChangeFeed, ResultHistory, ResultRecord
+from smoker.util import profiling, tracing
+from smoker.util.timing import PHASES
+from smoker.util.statustable import StatusTable, short_message
 from smoker.server.exceptions import (
     ActionNotFound,
     BasePluginTemplateNotFound,
@@ -26,6 +38,7 @@ from smoker.server.exceptions import (
     NoPluginsFound,
     NoRunningPlugins,
     NoSuchPlugin,
+    NoSuchProcess,
     NoTemplatesConfigured,
     PluginExecutionError,
     PluginExecutionTimeout,
@@ -36,12 +49,60 @@ from smoker.server.exceptions import (
 
 lg = logging.getLogger("smokerd.pluginmanager")
 
+# Minimal number of seconds between loading of results stored by
+# another process
+SYNC_INTERVAL = 0.1
+
+# Seconds of results to compute cost of plugins from
+COST_WINDOW = 3600
+
 
 def alarm_handler(signum, frame):
     lg.info("Plugin timeout exceeded")
     raise PluginExecutionTimeout
 
 
+def get_rusage(who):
+    """
+    Return resource usage of the process or it's waited children
+    (resource.RUSAGE_SELF or resource.RUSAGE_CHILDREN)
+
+    CPU time is in seconds, maxRss in bytes (of the largest child)
+    """
+    usage = resource.getrusage(who)
+    # ru_maxrss is in kilobytes, except of macOS
+    maxrss = usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+    return {
+        "userTime": usage.ru_utime,
+        "systemTime": usage.ru_stime,
+        "maxRss": maxrss,
+        "blockInput": usage.ru_inblock,
+        "blockOutput": usage.ru_oublock,
+        "voluntarySwitches": usage.ru_nvcsw,
+        "involuntarySwitches": usage.ru_nivcsw,
+    }
+
+
+def start_worker(worker):
+    """
+    Start worker process with garbage collector frozen
+
+    Objects of the daemon are moved to the permanent generation during
+    fork, so garbage collections in the worker don't touch (and copy)
+    memory pages shared with the daemon. The daemon unfreezes them right
+    after fork to keep collecting it's own garbage.
+    """
+    if not hasattr(gc, "freeze"):
+        worker.start()
+        return
+
+    gc.freeze()
+    try:
+        worker.start()
+    finally:
+        gc.unfreeze()
+
+
 class PluginManager(object):
     """
     PluginManager provides management and
@@ -49,22 +110,61 @@ class PluginManager(object):
     """
 
     def __init__(
-        self, plugins=None, actions=None, templates=None, semaphore_count=None
+        self,
+        plugins=None,
+        actions=None,
+        templates=None,
+        semaphore_count=None,
+        history=None,
+        process_ttl=3600,
+        process_max=1000,
+        change_max=10000,
+        status_table=None,
+        shared=False,
+        profile_dir=None,
     ):
         """
         PluginManager constructor
          * load plugins/templates/actions configuration
          * create plugins objects
+
+        :param history: smoker.server.history.HistoryStore instance to
+            persist results to or None
+        :param process_ttl: remove finished processes after given
+            number of seconds
+        :param process_max: maximal number of kept processes
+        :param change_max: number of results kept in the change feed
+            when there is no history store
+        :param status_table: path of the memory-mapped table of plugin
+            statuses for local consumers or None
+        :param shared: keep forced runs in the history store, so they
+            are shared by all API processes
+        :param profile_dir: directory to save profiles to or None
+            to disable profiling
         """
         self.conf_plugins = plugins
         self.conf_actions = actions
         self.conf_templates = templates
+        self.history = history
+        self.changes = ChangeFeed(history, maxlen=change_max)
 
         self.plugins: dict[str, Plugin] = {}
 
-        # We don't want to have process ID 0 (first index)
-        # so fill it by dummy process
-        self.processes = [None]
+        # Forced runs by process ID, IDs start from 1 and are never reused
+        self.processes = collections.OrderedDict()
+        self.last_process_id = 0
+        self.process_ttl = process_ttl
+        self.process_max = process_max
+        self.process_lock = threading.Lock()
+        if shared and not history:
+            raise InvalidConfiguration("Shared processes require history store")
+        self.shared = shared
+        self.profile_dir = profile_dir
+
+        # Results stored by other process are followed instead of collected
+        self.following = False
+        self.sync_lock = threading.Lock()
+        self.last_sync = 0
 
         self.stopping = False
 
@@ -81,6 +181,32 @@ class PluginManager(object):
         # Load Plugin objects
         self.load_plugins()
 
+        # Results for asynchronous actions, delivered by ActionRunner
+        self.action_queue = None
+        if any(
+            plugin.params["Action"] and plugin.params["Action"].get("Async")
+            for plugin in self.plugins.values()
+        ):
+            self.action_queue = multiprocessing.Queue()
+            for plugin in self.plugins.values():
+                plugin.action_queue = self.action_queue
+
+        # Statuses of plugins published for local consumers
+        self.status_table = None
+        if status_table:
+            try:
+                self.status_table = StatusTable.create(
+                    status_table,
+                    dict((name, plugin.params) for name, plugin in self.plugins.items()),
+                )
+            except (OSError, ValueError) as e:
+                lg.error("Can't create status table %s: %s", status_table, e)
+            for plugin in self.plugins.values():
+                plugin.status_table = self.status_table
+
+        for plugin in self.plugins.values():
+            plugin.profile_dir = self.profile_dir
+
     def stop(self, blocking=True):
         """
         Stop all plugins
@@ -151,6 +277,9 @@ class PluginManager(object):
             except AssertionError as e:
                 lg.error("Plugin %s not loaded: AssertionError, %s" % (plugin, e))
                 continue
+            except InvalidConfiguration as e:
+                lg.error("Plugin %s not loaded: invalid configuration, %s" % (plugin, e))
+                continue
             except Exception as e:
                 lg.error("Plugin %s not loaded: %s" % (plugin, e))
                 lg.exception(e)
@@ -180,7 +309,27 @@ class PluginManager(object):
             options["Action"] = self.get_action(options["Action"])
 
         params = dict(template, **options)
-        return Plugin(plugin, params)
+        plugin = Plugin(plugin, params, history=self.history, changes=self.changes)
+        self.import_modules(plugin)
+        return plugin
+
+    def import_modules(self, plugin):
+        """
+        Import Python modules used by plugin, so forked
+        workers don't have to import them on every run
+        Raise InvalidConfiguration if module can't be imported
+        """
+        modules = [plugin.params["Module"], plugin.params["Parser"]]
+        if plugin.params["Action"]:
+            modules.append(plugin.params["Action"]["Module"])
+
+        for module in modules:
+            if not module:
+                continue
+            try:
+                importlib.import_module(module)
+            except Exception as e:
+                raise InvalidConfiguration("Can't import module %s: %s" % (module, e))
 
     def get_template(self, name):
         """
@@ -255,10 +404,6 @@ class PluginManager(object):
         if len(plugins_list) == 0:
             raise NoPluginsFound
 
-        process = {
-            "plugins": plugins_list,
-        }
-
         plugins_name = []
         for p in plugins_list:
             plugins_name.append(p.name)
@@ -268,29 +413,199 @@ class PluginManager(object):
             % (len(plugins_list), ", ".join(plugins_name))
         )
 
-        # Add process into the list
-        self.processes.append(process)
-        id = len(self.processes) - 1
+        # Add process into the table
+        with self.process_lock:
+            if self.shared:
+                id = self.history.add_process(plugins_name, time.time())
+                if id is None:
+                    raise IOError("Can't store process into the history store")
+            else:
+                self.last_process_id += 1
+                id = self.last_process_id
+                self.processes[id] = {
+                    "id": id,
+                    "plugins": plugins_name,
+                    "created": time.time(),
+                    "finished": None,
+                }
+            self.compact_processes()
 
         # Force run for each plugin and clear forced_result
-        for plugin in plugins_list:
-            plugin.forced = True
-            plugin.forced_result = None
-            plugin.run()
+        with tracing.span("add_process", attributes={"process.id": id}):
+            for plugin in plugins_list:
+                plugin.forced = True
+                plugin.forced_result = None
+                plugin.run()
 
         return id
 
     def get_process(self, id):
         """
         Return process
+        Raise NoSuchProcess if it doesn't exist or it was already removed
+        """
+        if self.shared:
+            process = self.history.get_process(id)
+        else:
+            process = self.processes.get(id)
+        if not process:
+            raise NoSuchProcess("Process %s not found" % id)
+
+        self._update_process(process)
+        if self.shared and process["finished"]:
+            # Forced results of finished process have to be loaded
+            self.sync_results(force=True)
+        return process
+
+    def get_process_list(self, status=None, limit=None, after=None):
+        """
+        Return processes ordered by ID
+
+        :param status: return only "running" or "finished" processes
+        :param limit: maximal number of processes
+        :param after: return only processes with ID greater than given one
+        """
+        with self.process_lock:
+            self.compact_processes()
+            if self.shared:
+                processes = self.history.list_processes(after)
+            else:
+                processes = list(self.processes.values())
+
+        result = []
+        for process in processes:
+            if after is not None and process["id"] <= after:
+                continue
+            if status and self.get_process_status(process) != status:
+                continue
+            result.append(process)
+            if limit and len(result) == limit:
+                break
+
+        return result
+
+    def get_process_status(self, process):
+        """
+        Return "finished" if all plugins of process have forced
+        result, "running" otherwise
+        """
+        self._update_process(process)
+        return "finished" if process["finished"] else "running"
+
+    def _update_process(self, process):
+        """
+        Set finish time of process when all it's plugins are finished
+        """
+        if process["finished"]:
+            return
+
+        if self.shared:
+            # Plugins could be forced by another API process
+            self.sync_results()
+            forced = self.history.forced_plugins(process["plugins"], process["seq"])
+            if set(process["plugins"]) - forced:
+                return
+            process["finished"] = time.time()
+            self.history.finish_process(process["id"], process["finished"])
+            return
+
+        for name in process["plugins"]:
+            plugin = self.plugins.get(name)
+            if plugin and (plugin.forced or not plugin.forced_result):
+                return
+
+        process["finished"] = time.time()
+
+    def compact_processes(self):
         """
-        return self.processes[id]
+        Remove processes finished more than process_ttl seconds ago
+        and the oldest processes over process_max
+        Has to be called with process_lock held
+        """
+        if self.shared:
+            for process in self.history.list_processes():
+                self._update_process(process)
+            self.history.compact_processes(self.process_ttl, self.process_max)
+            return
+
+        now = time.time()
+        for id, process in list(self.processes.items()):
+            self._update_process(process)
+            if (
+                self.process_ttl is not None
+                and process["finished"]
+                and process["finished"] + self.process_ttl < now
+            ):
+                del self.processes[id]
+
+        if self.process_max:
+            while len(self.processes) > self.process_max:
+                self.processes.popitem(last=False)
+
+    def restore_results(self):
+        """
+        Load last results of plugins from the history store
+        """
+        if not self.history:
+            return
+
+        self.changes.restore()
+        for plugin in self.plugins.values():
+            plugin.restore_results()
+
+    def follow_results(self):
+        """
+        Don't collect results from plugin queues, follow results stored
+        into the history store by another process instead
+        """
+        if not self.history:
+            raise InvalidConfiguration("Following results requires history store")
+
+        self.following = True
+        for plugin in self.plugins.values():
+            plugin.follow = self.sync_results
+            # Status table has single writer, the collecting process
+            plugin.status_table = None
+
+    def sync_results(self, force=False):
+        """
+        Load results stored since the last known one
+        Skipped if results were loaded less than SYNC_INTERVAL ago
+        or they are just being loaded by another thread
+
+        :param force: load results anyway, wait for the other thread
+        """
+        if not self.following:
+            return
+        if not force and time.time() - self.last_sync < SYNC_INTERVAL:
+            return
+        if not self.sync_lock.acquire(force):
+            return
+
+        try:
+            self.last_sync = time.time()
+            for seq, name, result in self.history.changes(self.changes.last_seq):
+                plugin = self.plugins.get(name)
+                if plugin:
+                    plugin.add_stored_result(result)
+                else:
+                    self.changes.last_seq = seq
+        finally:
+            self.sync_lock.release()
 
-    def get_process_list(self):
+    def collect_results(self):
         """
-        Return all processes
+        Collect new results of all plugins
         """
-        return self.processes
+        for plugin in self.plugins.values():
+            try:
+                plugin.collect_new_result()
+            except Exception as e:
+                lg.error("Plugin %s: can't collect result: %s" % (plugin.name, e))
+
+        # The collecting process is the only writer of results
+        if self.history and not self.following:
+            self.history.maybe_compact()
 
     def run_plugins_with_interval(self):
         """
@@ -323,6 +638,9 @@ class Plugin(object):
     params = {}
     current_run = None
 
+    # (context, parent) of span of the traced forced run
+    trace = None
+
     params_default = {
         "Command": None,
         "Module": None,
@@ -336,7 +654,7 @@ class Plugin(object):
         "Action": None,
     }
 
-    def __init__(self, name, params):
+    def __init__(self, name, params, history=None, changes=None):
         """
         Plugin constructor
          * prepare the process
@@ -346,12 +664,28 @@ class Plugin(object):
 
         :param params: keyword arguments
         :type params: dict
+
+        :param history: store to persist results to
+        :type history: smoker.server.history.HistoryStore
+
+        :param changes: daemon-wide feed of results
+        :type changes: smoker.server.history.ChangeFeed
         """
         assert isinstance(name, str)
         assert isinstance(params, dict)
         self.name = name
         self.params = dict(self.params_default, **params)
         self.stopping = False
+        self.history = history
+        self.changes = changes
+        self.status_table = None
+
+        # Function loading results stored by another process, see
+        # PluginManager.follow_results()
+        self.follow = None
+
+        # Results are collected by API requests and by collector thread
+        self.lock = threading.Lock()
 
         # Set Action properly to have all
         # required default parameters
@@ -369,13 +703,28 @@ class Plugin(object):
 
         # Set those variables or they will be
         # references, shared between plugins
-        self.result = []
+        self.result = ResultHistory(self.params["History"])
         self.forced_result = None
         self.next_run = False
 
+        # (time, CPU seconds) of results in the last COST_WINDOW
+        self.costs = collections.deque()
+
         # Validate configuration
         self.validate()
 
+        # Queue of asynchronous actions, set by PluginManager
+        self.action_queue = None
+
+        # Number of next runs to profile, set by API process
+        self.profile_dir = None
+        self.profile_runs = multiprocessing.Value("i", 0)
+
+        # Shared by workers to decide when to run action
+        self.action_trigger = None
+        if self.params["Action"]:
+            self.action_trigger = ActionTrigger(self.params["Action"])
+
         # Schedule first plugin run
         if self.params["Interval"]:
             self.schedule_run()
@@ -408,6 +757,11 @@ class Plugin(object):
         Run process
         Check if plugin should be run and execute it
         """
+        # Collector thread replaces current_run too
+        with self.lock:
+            self._run()
+
+    def _run(self):
         if self.current_run:  # already running
             if self.current_run.is_alive():
                 return
@@ -415,16 +769,57 @@ class Plugin(object):
 
         # Plugin run when forced
         if self.forced:
+            # Run forced by traced request is part of it's trace
+            parent = tracing.current()
+            self.trace = (tracing.new_context(parent), parent) if parent else None
             self.current_run = PluginWorker(
-                self.name, self.queue, self.params, self.forced
+                self.name,
+                self.queue,
+                self.params,
+                self.forced,
+                action_trigger=self.action_trigger,
+                action_queue=self.action_queue,
+                scheduled=time.time(),
+                profile_dir=self.next_profile(),
+                trace=self.trace,
             )
-            self.current_run.start()
+            start_worker(self.current_run)
         elif self.params["Interval"]:
             if datetime.datetime.now() >= self.next_run:
-                self.current_run = PluginWorker(self.name, self.queue, self.params)
-                self.current_run.start()
+                self.current_run = PluginWorker(
+                    self.name,
+                    self.queue,
+                    self.params,
+                    action_trigger=self.action_trigger,
+                    action_queue=self.action_queue,
+                    scheduled=self.next_run.timestamp(),
+                    profile_dir=self.next_profile(),
+                )
+                start_worker(self.current_run)
                 self.schedule_run()
 
+    def profile(self, runs):
+        """
+        Profile given number of next runs, 0 to stop profiling
+        """
+        if not self.profile_dir:
+            raise InvalidConfiguration("Profiling requires profile_dir")
+        self.profile_runs.value = runs
+
+    def next_profile(self):
+        """
+        Return directory to save profile of the next run to or None
+        if it shouldn't be profiled
+        """
+        if not self.profile_dir or not self.profile_runs.value:
+            return None
+
+        with self.profile_runs.get_lock():
+            if self.profile_runs.value <= 0:
+                return None
+            self.profile_runs.value -= 1
+        return self.profile_dir
+
     def schedule_run(self, time=None, now=False):
         """
         Schedule next plugin run
@@ -446,16 +841,32 @@ class Plugin(object):
             )
 
     def collect_new_result(self):
+        """
+        Collect results of finished runs from the queue
+        """
+        if self.follow:
+            self.follow()
+            # Result of forced run is collected by another process
+            with self.lock:
+                if self.current_run and not self.current_run.is_alive():
+                    self.current_run.join()
+                    self.current_run = None
+            return
+
+        with self.lock:
+            self._collect_new_result()
+
+    def _collect_new_result(self):
         if self.queue.empty():  # nothing to collect
             # there shouldn't be new results
             if not self.current_run or self.current_run.is_alive():
                 return
 
             # results should be available, but are not
-            self.result.append(
+            self.add_result(
                 self.current_run.error_result(
                     "No run of plugin %s is found alive" % self.name
-                )
+                ).get_result()
             )
             self.forced_result = self.get_last_result()
             self.forced = False
@@ -463,19 +874,161 @@ class Plugin(object):
         while not self.queue.empty():
             result = self.queue.get()
             lg.debug("Plugin %s: got result from queue", self.name)
-            self.result.append(result)
+            if result.get("timing") is not None:
+                result["timing"]["collected"] = time.time()
+                if result.get("forced") and self.trace:
+                    tracing.record(
+                        "queue",
+                        result["timing"].get("enqueued"),
+                        result["timing"]["collected"],
+                        parent=self.trace[0],
+                    )
+                    self.trace = None
+            self.add_result(result)
 
             if "forced" in result.keys() and result["forced"]:
-                self.forced_result = self.get_last_result()
+                self.forced_result = result
                 self.forced = False
 
-            if len(self.result) > self.params["History"]:
-                self.result.pop(0)
-
         if self.current_run:  # forced, not externally fed to the queue
             self.current_run.join()
             self.current_run = None
 
+    def add_result(self, result):
+        """
+        Add result to history, persist it and tag it with
+        sequence number of the change feed
+        """
+        record = ResultRecord.from_dict(result)
+
+        seq = size = None
+        if self.history:
+            # Size of the stored result is reported by metrics
+            data = json.dumps(result, default=str)
+            size = len(data)
+            seq = self.history.append(self.name, result, data)
+        if self.changes:
+            record.seq = self.changes.append(self.name, record, seq)
+
+        self.result.append(record)
+        self.publish_status(result, record)
+        metrics.observe_result(self.name, result, size)
+        self.add_cost(result)
+
+    def add_stored_result(self, result):
+        """
+        Add result stored by another process
+        """
+        record = ResultRecord.from_dict(result)
+        with self.lock:
+            if self.changes:
+                self.changes.append(self.name, record, record.seq)
+            self.result.append(record)
+
+            if result.get("forced"):
+                self.forced_result = result
+                self.forced = False
+        metrics.observe_result(self.name, result)
+        self.add_cost(result)
+
+    def add_cost(self, result, now=None):
+        """
+        Remember CPU time of the run and forget runs older than COST_WINDOW
+        """
+        now = now or time.time()
+        if result.get("resources"):
+            self.costs.append((now, metrics.cpu_time(result["resources"])))
+        while self.costs and self.costs[0][0] < now - COST_WINDOW:
+            self.costs.popleft()
+
+    def get_cost(self, now=None):
+        """
+        Return CPU time of the runs in the last COST_WINDOW and estimate
+        of CPU seconds per hour
+
+        Plugins with Interval are expected to run every Interval seconds,
+        rate of the others is given by their forced runs
+        """
+        now = now or time.time()
+        costs = [cost for cost in list(self.costs) if cost[0] >= now - COST_WINDOW]
+        cpu_time = sum(cost[1] for cost in costs)
+        per_run = cpu_time / len(costs) if costs else 0
+        if self.params["Interval"]:
+            per_hour = per_run * 3600 / self.params["Interval"]
+        else:
+            per_hour = cpu_time * 3600 / COST_WINDOW
+
+        return {
+            "name": self.name,
+            "runs": len(costs),
+            "cpuTime": cpu_time,
+            "cpuPerRun": per_run,
+            "cpuPerHour": per_hour,
+            "links": {"self": "/plugins/%s" % self.name},
+        }
+
+    def publish_status(self, result, record):
+        """
+        Update status of the plugin in the status table
+        """
+        if self.status_table:
+            self.status_table.update(
+                self.name,
+                record.status,
+                record.last_run,
+                short_message(result),
+                record.seq,
+            )
+
+    def restore_results(self):
+        """
+        Replace history by last results from the history store
+        """
+        self.result = ResultHistory(self.params["History"])
+        for result in self.history.last(self.name, self.params["History"]):
+            self.result.append(ResultRecord.from_dict(result))
+
+        record = self.result.last()
+        if record:
+            self.publish_status(record.to_dict(), record)
+
+    def query_history(self, since=None, until=None, after=None, limit=None, statuses=False):
+        """
+        Return results in time range in the order they were added
+        Use history store if available, in-memory history otherwise,
+        results are identified by their sequence number in both cases
+
+        See HistoryStore.query() for parameters
+        """
+        if self.history:
+            return self.history.query(
+                self.name, since, until, after, limit, statuses=statuses
+            )
+
+        rows = []
+        for entry in list(self.result):
+            results = None
+            for index, (seq, timestamp) in enumerate(entry):
+                if after is not None and (seq or 0) <= after:
+                    continue
+                if since is not None or until is not None:
+                    if not isinstance(timestamp, float):
+                        continue
+                    if since is not None and timestamp < since:
+                        continue
+                    if until is not None and timestamp >= until:
+                        continue
+                if statuses:
+                    rows.append((seq, timestamp, entry.record.status))
+                else:
+                    if results is None:
+                        results = entry.to_dicts()
+                    rows.append((seq, timestamp, results[index]))
+                if limit and len(rows) == limit:
+                    return rows
+
+        return rows
+
     def get_last_result(self):
         """
         Get last run result or None
@@ -483,7 +1036,14 @@ class Plugin(object):
         if not self.result:
             return None
 
-        return self.result[-1]
+        return self.result.last().to_dict()
+
+    def get_results(self):
+        """
+        Get history of results, oldest first
+        Entries of identical consecutive results are expanded
+        """
+        return [result for entry in self.result for result in entry.to_dicts()]
 
     def json(self):
         """
@@ -501,53 +1061,128 @@ class Plugin(object):
         }
 
 
-class PluginWorker(multiprocessing.Process):
-    def __init__(self, name, queue, params, forced=False):
-        self.plugin_name = name
-        self.queue = queue
-        self.params = params
-        self.forced = forced
-        self.result = None
+class ActionTrigger(object):
+    """
+    Decide if action should be executed on plugin result
+
+    Action parameters:
+        Trigger: Always (default) or OnChange - run only when
+            status differs from status of the previous run
+        OnStatus: run only on given statuses, eg. [ERROR, WARN]
+        RefreshInterval: with OnChange, run anyway when the action
+            wasn't executed for given number of seconds
+
+    Each run is executed by new worker forked from the daemon or
+    from the REST API server, so the state of the previous run
+    is kept in shared memory.
+    """
 
-        # if self._Popen is not None:
-        #    from multiprocessing.popen_fork import Popen
-        #    self._Popen = Popen
+    triggers = ["Always", "OnChange"]
+    statuses = ["OK", "WARN", "ERROR"]
 
-        super(PluginWorker, self).__init__()
-        self.daemon = True
+    def __init__(self, params):
+        """
+        :param params: action parameters
+        :type params: dict
+        """
+        self.trigger = params.get("Trigger") or "Always"
+        self.on_status = params.get("OnStatus")
+        self.refresh_interval = params.get("RefreshInterval") or 0
 
-    def run(self):
-        setproctitle.setproctitle("smokerd plugin %s" % self.plugin_name)
+        if self.trigger not in self.triggers:
+            raise InvalidConfiguration(
+                "Action Trigger has to be %s" % " or ".join(self.triggers)
+            )
 
-        self.close_unnecessary_sockets()
-        self.drop_privileged()
+        if self.on_status is not None:
+            if isinstance(self.on_status, str):
+                self.on_status = [self.on_status]
+            for status in self.on_status:
+                if status not in self.statuses:
+                    raise InvalidConfiguration(
+                        "Action OnStatus has to be list of OK, WARN or ERROR"
+                    )
 
-        if semaphore:
-            with semaphore:
-                self.run_plugin(self.forced)
-        else:
-            self.run_plugin(self.forced)
+        self.lock = multiprocessing.Lock()
+        # Index of the last status in statuses, -1 if unknown
+        self.last_status = multiprocessing.RawValue("i", -1)
+        self.last_action = multiprocessing.RawValue("d", 0.0)
 
-        self.queue.put(self.result)
-        lg.debug("Plugin %s: result put to queue", self.name)
+    def should_run(self, status):
+        """
+        Remember status of the run and return True if action
+        should be executed
 
-    def run_command(self, command, timeout=0):
+        :param status: status of the plugin result
+        """
+        current = self.statuses.index(status) if status in self.statuses else -1
+
+        with self.lock:
+            changed = current != self.last_status.value
+            self.last_status.value = current
+
+            if self.on_status and status not in self.on_status:
+                return False
+
+            if self.trigger == "OnChange" and not changed:
+                refresh = self.refresh_interval and (
+                    time.time() - self.last_action.value >= self.refresh_interval
+                )
+                if not refresh:
+                    return False
+
+            self.last_action.value = time.time()
+            return True
+
+
+class PluginHelpers(object):
+    """
+    Methods running commands and modules with parameters of plugin,
+    used by plugin workers and by the action runner
+
+    Subclasses have to set name and params attributes
+    """
+
+    def run_command(self, command, timeout=0, max_age=0, timing=None):
         """
         Run system command and parse output
+        Reuse output of the same command executed within
+        last max_age seconds if max_age is set
+
+        :param timing: dict to record time when the command finished
+            (execFinished) and when it's output was parsed (parseFinished)
         """
         result = Result()
         lg.debug("Plugin %s: executing command %s" % (self.name, command))
 
+        # Streaming parser consumes stdout while the command is running,
+        # cached output is complete already so it's parsed at once
+        parser = None
+        if self.params["Parser"] and not max_age:
+            parser = self.get_streaming_parser()
+
         try:
-            stdout, stderr, returncode = smoker.util.command.execute(
-                command, timeout=timeout
-            )
+            if max_age:
+                stdout, stderr, returncode = smoker.util.command.execute_cached(
+                    command, max_age, timeout=timeout
+                )
+            elif parser:
+                stdout, stderr, returncode = smoker.util.command.execute(
+                    command, timeout=timeout, stdout_callback=parser.feed_line
+                )
+            else:
+                stdout, stderr, returncode = smoker.util.command.execute(
+                    command, timeout=timeout
+                )
         except smoker.util.command.ExecutionTimeout as e:
             raise PluginExecutionTimeout(e)
         except Exception as e:
             lg.exception(e)
             raise PluginExecutionError("Can't execute command %s: %s" % (command, e))
 
+        if timing is not None:
+            timing["execFinished"] = time.time()
+
         if returncode:
             status = "ERROR"
         else:
@@ -556,7 +1191,10 @@ class PluginWorker(multiprocessing.Process):
         # Run parser or parse output from stdin
         if self.params["Parser"]:
             try:
-                result = self.run_parser(stdout, stderr)
+                if parser:
+                    result = self.finish_parser(parser, stderr)
+                else:
+                    result = self.run_parser(stdout, stderr)
             except Exception as e:
                 # Error result
                 result.set_status("ERROR")
@@ -595,6 +1233,8 @@ class PluginWorker(multiprocessing.Process):
                 if stdout:
                     result.add_info(re.sub("^\n", "", stdout.strip()))
 
+        if timing is not None:
+            timing["parseFinished"] = time.time()
         return result
 
     def run_parser(self, stdout, stderr):
@@ -636,6 +1276,50 @@ class PluginWorker(multiprocessing.Process):
 
         return result
 
+    def get_streaming_parser(self):
+        """
+        Return initialized parser if it supports streaming, None otherwise
+        Parser load failures are reported by run_parser
+        """
+        try:
+            parser = __import__(
+                self.params["Parser"], globals(), locals(), ["Parser"], 0
+            )
+        except ImportError:
+            return None
+
+        if not getattr(parser.Parser, "streaming", False):
+            return None
+
+        try:
+            return parser.Parser()
+        except Exception as e:
+            lg.error("Plugin %s: can't initialize parser: %s" % (self.name, e))
+            return None
+
+    def finish_parser(self, parser, stderr):
+        """
+        Finish streaming parser fed by command output
+        Raise exceptions if anything happen
+        """
+        lg.debug(
+            "Plugin %s: finishing streaming parser %s"
+            % (self.name, self.params["Parser"])
+        )
+
+        if stderr:
+            lg.debug("Plugin %s: stderr: %s" % (self.name, stderr.strip()))
+
+        parser.stderr = stderr
+        try:
+            result = parser.finish()
+        except Exception as e:
+            lg.error("Plugin %s: parser execution failed: %s" % (self.name, e))
+            lg.exception(e)
+            raise
+
+        return result
+
     def run_module(self, module, **kwargs):
         """
         Run Python module
@@ -677,6 +1361,192 @@ class PluginWorker(multiprocessing.Process):
         signal.alarm(0)
         return result
 
+    def error_result(self, message):
+        result = Result()
+        result.set_status("ERROR")
+        result.add_error(message)
+        return result
+
+    def escape(self, tbe):
+        """
+        Escape given string, dictionary or list
+        If int, None or bool item is found, just pass
+        Also pass if item can't be escaped by some other reason
+        Raise exception if unknown data type
+        """
+        if isinstance(tbe, dict):
+            escaped = {}
+            for key, value in tbe.items():
+                if type(value) in [int, type(None), bool]:
+                    escaped[key] = value
+                else:
+                    try:
+                        escaped[key] = re.escape(value)
+                    except Exception:
+                        escaped[key] = value
+        elif isinstance(tbe, (str, bytes)):
+            try:
+                escaped = re.escape(tbe)
+            except Exception:
+                escaped = tbe
+        elif isinstance(tbe, int) or isinstance(tbe, bool):
+            escaped = tbe
+        elif isinstance(tbe, list):
+            escaped = []
+            for value in tbe:
+                if type(value) in [int, type(None), bool]:
+                    escaped.append(value)
+                else:
+                    try:
+                        escaped.append(re.escape(value))
+                    except Exception:
+                        escaped.append(value)
+        else:
+            raise Exception("Unknown data type")
+
+        return escaped
+
+    def get_param(self, name, default=None):
+        """
+        Get plugin parameter
+        Return default if parameter doesn't exist
+        """
+        try:
+            return self.params[name]
+        except KeyError:
+            return default
+
+    def drop_privileged(self, permanent=False):
+        """
+        Switch effective UID/GID to uid/gid parameters
+
+        :param permanent: switch also real UID/GID, so they can't be
+            switched back (and shell doesn't switch them back on exec)
+        """
+        if self.params["uid"] == "default" and self.params["gid"] == "default":
+            return
+        lg.debug(
+            "Plugin %s: dropping privileges to %s/%s"
+            % (self.name, self.params["uid"], self.params["gid"])
+        )
+        try:
+            if permanent:
+                os.setgroups([])
+                os.setgid(self.params["gid"])
+                os.setuid(self.params["uid"])
+            else:
+                os.setegid(self.params["gid"])
+                os.seteuid(self.params["uid"])
+        except TypeError as e:
+            lg.error(
+                "Plugin %s: config parameters uid/gid have to be "
+                "integers: %s" % (self.name, e)
+            )
+            raise
+        except OSError as e:
+            lg.error(
+                "Plugin %s: can't switch effective UID/GID to %s/%s: %s"
+                % (self.name, self.params["uid"], self.params["gid"], e)
+            )
+            raise
+
+
+class PluginWorker(PluginHelpers, multiprocessing.Process):
+    def __init__(self, name, queue, params, forced=False, action_trigger=None,
+                 action_queue=None, scheduled=None, profile_dir=None,
+                 trace=None):
+        """
+        :param scheduled: UNIX timestamp when the run was due
+        :param profile_dir: directory to save cProfile stats of the run to
+        :param trace: (context, parent) of span of the run to trace
+        """
+        self.plugin_name = name
+        self.queue = queue
+        self.params = params
+        self.forced = forced
+        self.action_trigger = action_trigger
+        self.action_queue = action_queue
+        self.result = None
+        self.profile_dir = profile_dir
+        self.trace = trace
+
+        # UNIX timestamps of the run phases, sent with the result
+        self.timing = {"scheduled": scheduled}
+
+        # if self._Popen is not None:
+        #    from multiprocessing.popen_fork import Popen
+        #    self._Popen = Popen
+
+        super(PluginWorker, self).__init__()
+        self.daemon = True
+
+    def start(self):
+        self.timing["spawned"] = time.time()
+        super(PluginWorker, self).start()
+
+    def run(self):
+        self.timing["started"] = time.time()
+        setproctitle.setproctitle("smokerd plugin %s" % self.plugin_name)
+
+        self.close_unnecessary_sockets()
+        self.drop_privileged()
+
+        if semaphore:
+            with semaphore:
+                self.timing["semaphoreAcquired"] = time.time()
+                self.run_profiled()
+        else:
+            self.timing["semaphoreAcquired"] = time.time()
+            self.run_profiled()
+
+        if self.result.get("timing") is not None:
+            self.result["timing"]["enqueued"] = time.time()
+        if self.trace:
+            self.record_spans()
+        self.queue.put(self.result)
+        lg.debug("Plugin %s: result put to queue", self.name)
+
+    def run_profiled(self):
+        """
+        Run plugin, with cProfile if profile of the run is requested
+        """
+        if not self.profile_dir:
+            self.run_plugin(self.forced)
+            return
+
+        path = os.path.join(
+            self.profile_dir, profiling.profile_name(self.plugin_name, profiling.PSTATS)
+        )
+        lg.info("Plugin %s: saving profile to %s" % (self.name, path))
+        try:
+            profiling.profile_call(path, self.run_plugin, self.forced)
+        except OSError as e:
+            lg.error("Plugin %s: can't save profile: %s" % (self.name, e))
+
+    def record_spans(self):
+        """
+        Write span of the run and spans of it's phases
+        """
+        context, parent = self.trace
+        tracing.record(
+            "plugin %s" % self.plugin_name,
+            self.timing.get("scheduled"),
+            self.timing.get("finished"),
+            context=context,
+            parent=parent,
+            attributes={
+                "plugin": self.plugin_name,
+                "status": self.result.get("status"),
+                "timedOut": self.timing.get("timedOut"),
+            },
+        )
+        for name, start, end in PHASES:
+            # Queue is recorded by the daemon when it gets the result
+            if name != "queue":
+                tracing.record(
+                    name, self.timing.get(start), self.timing.get(end), parent=context
+                )
+
     def run_plugin(self, force=False):
         """
         Run plugin, save result and schedule next run
@@ -684,15 +1554,23 @@ class PluginWorker(multiprocessing.Process):
         :param force: forced run
         :type force: bool
         """
+        self.timing["execStarted"] = time.time()
         # External command will be executed
         if self.params["Command"]:
             command = self.params["Command"] % self.escape(dict(self.params))
             # Execute external command to get result
             try:
-                result = self.run_command(command, self.params["Timeout"])
+                result = self.run_command(
+                    command,
+                    self.params["Timeout"],
+                    max_age=self.get_param("CacheTTL", default=0),
+                    timing=self.timing,
+                )
             except Exception as e:
                 lg.error("Plugin %s: %s" % (self.name, e))
                 result = self.error_result(e)
+                if isinstance(e, PluginExecutionTimeout):
+                    self.timing["timedOut"] = True
         # Python module will be executed
         elif self.params["Module"]:
             try:
@@ -700,14 +1578,26 @@ class PluginWorker(multiprocessing.Process):
             except Exception as e:
                 lg.error("Plugin %s: %s" % (self.name, e))
                 result = self.error_result(re.sub("^\n", "", ("%s" % e).strip()))
+                if isinstance(e, PluginExecutionTimeout):
+                    self.timing["timedOut"] = True
         # No module or command to run
         else:
             lg.error("Plugin %s: no Command or Module to execute!" % self.name)
             result = self.error_result("No Command or Module to execute!")
+        # Commands record it before their output is parsed
+        self.timing.setdefault("execFinished", time.time())
 
         # Run action on result
-        if self.params["Action"]:
+        queue_action = False
+        if self.params["Action"] and not self.should_run_action(result):
+            lg.debug("Plugin %s: action not triggered" % self.name)
+        elif self.params["Action"] and self.action_queue is not None \
+                and self.params["Action"].get("Async"):
+            # Delivered by the action runner when the result is complete
+            queue_action = True
+        elif self.params["Action"]:
             lg.debug("Plugin %s: executing action" % self.name)
+            self.timing["actionStarted"] = time.time()
             # Execute external command
             if self.params["Action"]["Command"]:
                 # Add parameters to command with format
@@ -739,8 +1629,12 @@ class PluginWorker(multiprocessing.Process):
                 action = self.error_result("No Command or Module to execute!")
             # Add action result to plugin result
             result.set_action(action)
+            self.timing["actionFinished"] = time.time()
 
         result.set_forced(force)
+        result.set_resources(self.get_resources())
+        self.timing["finished"] = time.time()
+        result.set_timing(self.timing)
         # send to the daemon
         try:
             self.result = result.get_result()
@@ -748,100 +1642,105 @@ class PluginWorker(multiprocessing.Process):
             lg.error("Plugin %s: ValidationError: %s" % (self.name, e))
             result = self.error_result("ValidationError: %s" % e)
             result.set_forced(force)
+            result.set_timing(self.timing)
             self.result = result.get_result()
 
+        if queue_action:
+            lg.debug("Plugin %s: queueing action" % self.name)
+            self.action_queue.put(
+                {"plugin": self.plugin_name, "params": self.params, "result": self.result}
+            )
+
         # Log result
         lg.info("Plugin %s result: %s" % (self.name, result.get_result()))
 
-    def error_result(self, message):
-        result = Result()
-        result.set_status("ERROR")
-        result.add_error(message)
-        return result
-
-    def escape(self, tbe):
+    def should_run_action(self, result):
         """
-        Escape given string, dictionary or list
-        If int, None or bool item is found, just pass
-        Also pass if item can't be escaped by some other reason
-        Raise exception if unknown data type
+        Return True if action should be executed on result
         """
-        if isinstance(tbe, dict):
-            escaped = {}
-            for key, value in tbe.items():
-                if type(value) in [int, type(None), bool]:
-                    escaped[key] = value
-                else:
-                    try:
-                        escaped[key] = re.escape(value)
-                    except Exception:
-                        escaped[key] = value
-        elif isinstance(tbe, (str, bytes)):
-            try:
-                escaped = re.escape(tbe)
-            except Exception:
-                escaped = tbe
-        elif isinstance(tbe, int) or isinstance(tbe, bool):
-            escaped = tbe
-        elif isinstance(tbe, list):
-            escaped = []
-            for value in tbe:
-                if type(value) in [int, type(None), bool]:
-                    escaped.append(value)
-                else:
-                    try:
-                        escaped.append(re.escape(value))
-                    except Exception:
-                        escaped.append(value)
-        else:
-            raise Exception("Unknown data type")
+        if not self.action_trigger:
+            return True
 
-        return escaped
+        return self.action_trigger.should_run(result.result["status"])
 
-    def get_param(self, name, default=None):
+    def get_resources(self):
         """
-        Get plugin parameter
-        Return default if parameter doesn't exist
+        Return resource usage of the worker
+
+        rss is resident memory of the worker including pages shared
+        with the daemon. privateMemory is memory not shared with the
+        daemon (USS), it grows when the worker writes to pages inherited
+        from the daemon. It's reported only with PrivateMemory parameter,
+        because it requires reading of /proc/<pid>/smaps.
+
+        worker is usage of the worker process since fork. children is
+        usage of the finished commands executed by the worker. Their
+        maxRss includes memory inherited by fork, so it's at least
+        the size of the daemon.
         """
+        resources = {
+            "worker": get_rusage(resource.RUSAGE_SELF),
+            "children": get_rusage(resource.RUSAGE_CHILDREN),
+        }
         try:
-            return self.params[name]
-        except KeyError:
-            return default
+            process = psutil.Process()
+            resources["rss"] = process.memory_info().rss
+            if self.get_param("PrivateMemory"):
+                resources["privateMemory"] = process.memory_full_info().uss
+        except (psutil.Error, OSError) as e:
+            lg.debug("Plugin %s: can't get memory of the worker: %s" % (self.name, e))
 
-    def close_unnecessary_sockets(self):
-        """close unnecessary open sockets cloned on fork"""
-        open_sockets = list()
-        allowed = ["socket.socket", "socket._socketobject"]
-        for x in gc.get_objects():
-            if any(t for t in allowed if t in repr(type(x))):
-                open_sockets.append(x)
-        for cur_socket in open_sockets:
-            # close all TCP (SOCK_STREAM) sockets
-            if cur_socket.type == socket.SOCK_STREAM:
-                cur_socket.close()
-
-    def drop_privileged(self):
-        if self.params["uid"] == "default" and self.params["gid"] == "default":
-            return
         lg.debug(
-            "Plugin %s: dropping privileges to %s/%s"
-            % (self.name, self.params["uid"], self.params["gid"])
+            "Plugin %s: worker used %.3fs of CPU, commands %.3fs"
+            % (
+                self.name,
+                resources["worker"]["userTime"] + resources["worker"]["systemTime"],
+                resources["children"]["userTime"] + resources["children"]["systemTime"],
+            )
         )
+        return resources
+
+    def close_unnecessary_sockets(self):
+        """
+        Close TCP sockets cloned on fork
+
+        Only the file descriptor table is examined, so it doesn't matter
+        how many objects the parent process holds. Descriptors are pointed
+        to /dev/null instead of closing them, so inherited socket objects
+        can't close unrelated files by reused descriptor numbers later.
+        """
         try:
-            os.setegid(self.params["gid"])
-            os.seteuid(self.params["uid"])
-        except TypeError as e:
-            lg.error(
-                "Plugin %s: config parameters uid/gid have to be "
-                "integers: %s" % (self.name, e)
-            )
-            raise
-        except OSError as e:
-            lg.error(
-                "Plugin %s: can't switch effective UID/GID to %s/%s: %s"
-                % (self.name, self.params["uid"], self.params["gid"], e)
-            )
-            raise
+            fds = [int(fd) for fd in os.listdir("/proc/self/fd")]
+        except OSError:
+            fds = [int(fd) for fd in os.listdir("/dev/fd")]
+
+        devnull = os.open(os.devnull, os.O_RDWR)
+        try:
+            for fd in fds:
+                # Keep standard I/O
+                if fd <= 2 or fd == devnull:
+                    continue
+                if fd in server_fds or self._is_stream_socket(fd):
+                    os.dup2(devnull, fd)
+        finally:
+            os.close(devnull)
+
+    def _is_stream_socket(self, fd):
+        """
+        Return True if descriptor is TCP (SOCK_STREAM) socket
+        """
+        try:
+            if not stat.S_ISSOCK(os.fstat(fd).st_mode):
+                return False
+            sock = socket.socket(fileno=fd)
+        except OSError:
+            # Descriptor used for listing or already closed
+            return False
+
+        try:
+            return sock.type == socket.SOCK_STREAM
+        finally:
+            sock.detach()
 
 
 class Result(object):
@@ -862,6 +1761,7 @@ class Result(object):
             "componentResults": None,
             "action": None,
             "forced": False,
+            "resources": None,
         }
 
     def set_status(self, status=None):
@@ -898,6 +1798,18 @@ class Result(object):
     def set_forced(self, forced=True):
         self.result["forced"] = forced
 
+    def set_resources(self, resources):
+        """
+        Set resource usage of the run
+        """
+        self.result["resources"] = resources
+
+    def set_timing(self, timing):
+        """
+        Set UNIX timestamps of the run phases
+        """
+        self.result["timing"] = {key: value for key, value in timing.items() if value}
+
     def add_info(self, msg):
         """
         Add info messge
@@ -16,41 +16,82 @@ from smoker.server.parser import BaseParser
 
 
 class Parser(BaseParser):
-    def parse(self):
+    """
+    Output is parsed line by line, each backend looks like
+
+        Backend <name> is <state>
+        Current states  good:  5 threshold:  3 window:  5
+        Average responsetime of good probes: <restime>
+    """
+    streaming = True
+
+    re_backend = re.compile(r"Backend (.*) is (.*)$")
+    re_restime = re.compile(r"Average responsetime of good probes: (.*)")
+
+    def __init__(self, stdout='', stderr=''):
+        super(Parser, self).__init__(stdout, stderr)
+        self.backends = 0
+        # Backend waiting for it's response time and lines read since
+        self.backend = None
+        self.backend_lines = 0
+
+    def feed(self, line):
         """
-        If we got stdout, parse it and return result.
-        Else return Exception that is handled by smokerd.
+        Parse single line and add backend result once it's complete
         """
-        backends = re.findall("Backend\ (.*)\ is\ (.*)\n.*\nAverage responsetime of good probes:\ (.*)", self.stdout)
+        match = self.re_backend.search(line)
+        if match:
+            self.backend = match.groups()
+            self.backend_lines = 0
+            return
 
-        if not backends:
-            raise Exception("No backends found or output can't be parsed!")
+        if not self.backend:
+            return
+
+        self.backend_lines += 1
+        if self.backend_lines < 2:
+            return
 
-        for backend in backends:
-            name    = backend[0]
-            state   = backend[1]
-            restime = float(backend[2])
-
-            args = {
-                'info' : [],
-                'error': [],
-                'warn' : [],
-            }
-
-            # Check backend state
-            if state == 'Healthy':
-                # Check backend response time
-                if restime > 0.5:
-                    state = 'WARN'
-                    args['warn'].append('Response time: %s' % restime)
-                else:
-                    state = 'OK'
-                    args['info'].append('Response time: %s' % restime)
+        match = self.re_restime.search(line)
+        if match:
+            self.add_backend(self.backend[0], self.backend[1], float(match.group(1)))
+        self.backend = None
+
+    def add_backend(self, name, state, restime):
+        """
+        Add component result for backend
+        """
+        args = {
+            'info' : [],
+            'error': [],
+            'warn' : [],
+        }
+
+        # Check backend state
+        if state == 'Healthy':
+            # Check backend response time
+            if restime > 0.5:
+                status = 'WARN'
+                args['warn'].append('Response time: %s' % restime)
             else:
-                state = 'ERROR'
-                args['error'].append('State: %s' % backend[1])
+                status = 'OK'
+                args['info'].append('Response time: %s' % restime)
+        else:
+            status = 'ERROR'
+            args['error'].append('State: %s' % state)
+
+        self.result.add_component(name, status, **args)
+        self.backends += 1
+
+    def finish(self):
+        """
+        If we got some backends, return result.
+        Else return Exception that is handled by smokerd.
+        """
+        super(Parser, self).finish()
 
-            self.result.add_component(name, state, **args)
+        if not self.backends:
+            raise Exception("No backends found or output can't be parsed!")
 
         self.result.set_status()
 
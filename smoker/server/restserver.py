@@ -4,24 +4,55 @@
 Module providing base http server for smokerd REST API
 """
 
-import json
+import datetime
+import io
 import logging
 import multiprocessing
+import os
 import signal
 import socket
+import threading
+import time
+import urllib.parse
 
+import psutil
 import setproctitle
-from flask import Flask, make_response, request
+from flask import Flask, current_app, g, make_response, request, send_from_directory
 from flask_restful import Api, Resource, abort
-
-from smoker.server import exceptions, redirect_standard_io
+from smoker.server import (
+    exceptions,
+    httpserver,
+    metrics,
+    redirect_standard_io,
+    server_fds,
+)
+from smoker.server.history import downsample, parse_time
+from smoker.server.plugins import COST_WINDOW
+from smoker.util import columnar, encoding, profiling, tracing
 
 lg = logging.getLogger("smokerd.apiserver")
 
+# Default and maximal number of items on single page of plugin history
+HISTORY_LIMIT = 100
+HISTORY_LIMIT_MAX = 1000
+
+# Default number of processes on single page of process list
+PROCESSES_LIMIT = 100
+
+# Maximal number of seconds to wait for changes
+CHANGES_WAIT_MAX = 60
+
+# Maximal number of seconds to sample the API process
+PROFILE_DURATION_MAX = 600
+
 # need to keep the daemon instance and common functions at module level since
 # there's no other way how to pass the to Flask_restful class methods
 smokerd = None
 
+# Sampler of the API process, only one runs at a time
+sampler = None
+sampler_lock = threading.Lock()
+
 
 def next_run_iso_format(next_run):
     """
@@ -118,13 +149,172 @@ def get_plugin_history(name):
     plugin = smokerd.pluginmgr.get_plugin(name)
     results = []
 
-    for res in plugin.result:
+    for res in plugin.get_results():
         res = standardized_api_list(res)
         results.append({"result": res})
 
     return results
 
 
+def get_query_arg(name, type, default=None):
+    """
+    Get query argument converted by given type, abort with
+    bad request if it can't be converted
+
+    :param name: name of the argument
+    :param type: function converting string value
+    :param default: value used when argument is not set
+    """
+    value = request.args.get(name)
+    if value is None or value == "":
+        return default
+
+    try:
+        return type(value)
+    except ValueError:
+        abort(400, message="Invalid value of %s: %s" % (name, value))
+
+
+def print_plugin_history(name, since=None, until=None, after=None,
+                         limit=HISTORY_LIMIT, step=None):
+    """
+    Print page of plugin results in time range, optionally downsampled
+    into buckets of given size (worst status wins)
+
+    :param name: name of the plugin
+    :param since: UNIX timestamp of the first result
+    :param until: UNIX timestamp after the last result
+    :param after: pagination cursor, seq of last result on previous page
+    :param limit: maximal number of items on the page
+    :param step: size of buckets in seconds
+    """
+    plugin = smokerd.pluginmgr.get_plugin(name)
+    plugin.collect_new_result()
+
+    args = {}
+    if until is not None:
+        args["until"] = repr(until)
+    if step:
+        args["step"] = repr(step)
+    args["limit"] = limit
+
+    items = []
+    if step:
+        rows = plugin.query_history(since, until, after, statuses=True)
+        rows = sorted((timestamp, status) for _, timestamp, status in rows)
+        buckets = downsample(rows, step, limit + 1)
+        for bucket in buckets[:limit]:
+            items.append({"bucket": {
+                "start": datetime.datetime.fromtimestamp(bucket["start"]).isoformat(),
+                "end": datetime.datetime.fromtimestamp(bucket["end"]).isoformat(),
+                "status": bucket["status"],
+                "count": bucket["count"],
+            }})
+        if len(buckets) > limit:
+            args["since"] = repr(buckets[limit - 1]["end"])
+    else:
+        rows = plugin.query_history(since, until, after, limit + 1)
+        for seq, timestamp, result in rows[:limit]:
+            items.append({"result": standardized_api_list(result)})
+        if len(rows) > limit:
+            if since is not None:
+                args["since"] = repr(since)
+            args["cursor"] = rows[limit - 1][0]
+
+    links = {"self": request.full_path.rstrip("?")}
+    if "since" in args or "cursor" in args:
+        links["next"] = "/plugins/%s/history?%s" % (
+            name, urllib.parse.urlencode(sorted(args.items())))
+
+    return {"history": {"name": name, "items": items, "links": links}}
+
+
+def format_time(timestamp):
+    """
+    Convert UNIX timestamp to the ISO format
+    """
+    if timestamp is None:
+        return None
+    return datetime.datetime.fromtimestamp(timestamp).isoformat()
+
+
+def print_processes(status=None, limit=PROCESSES_LIMIT, after=None):
+    """
+    Print page of processes ordered by ID
+
+    :param status: print only "running" or "finished" processes
+    :param limit: maximal number of processes on the page
+    :param after: print processes with ID greater than given one
+    """
+    processes = smokerd.pluginmgr.get_process_list(status, limit + 1, after)
+
+    items = []
+    for process in processes[:limit]:
+        items.append({
+            "id": process["id"],
+            "href": "/processes/%d" % process["id"],
+            "plugins": process["plugins"],
+            "status": smokerd.pluginmgr.get_process_status(process),
+            "created": format_time(process["created"]),
+            "finished": format_time(process["finished"]),
+        })
+
+    links = {"self": request.full_path.rstrip("?")}
+    if len(processes) > limit:
+        args = {"limit": limit, "after": processes[limit - 1]["id"]}
+        if status:
+            args["status"] = status
+        links["next"] = "/processes?%s" % urllib.parse.urlencode(sorted(args.items()))
+
+    return {"processes": {"items": items, "links": links}}
+
+
+def print_changes(since=0, limit=HISTORY_LIMIT, wait=None):
+    """
+    Print results of all plugins newer than given sequence number
+
+    :param since: sequence number of the last known result
+    :param limit: maximal number of results
+    :param wait: wait up to given number of seconds for new result
+    """
+    smokerd.pluginmgr.collect_results()
+    changes = smokerd.pluginmgr.changes
+    if wait and since <= changes.last_seq:
+        changes.wait(since, wait)
+
+    reset, rows = changes.since(since, limit)
+
+    items = []
+    for seq, plugin, result in rows:
+        items.append({
+            "seq": seq,
+            "plugin": plugin,
+            "result": standardized_api_list(result),
+        })
+
+    # Continue after the last result, start over from current state on reset
+    if items:
+        next_seq = items[-1]["seq"]
+    elif reset:
+        next_seq = changes.last_seq
+    else:
+        next_seq = since
+
+    return {
+        "changes": {
+            "epoch": changes.epoch,
+            "firstSeq": changes.first_seq(),
+            "lastSeq": changes.last_seq,
+            "reset": reset,
+            "items": items,
+            "links": {
+                "self": request.full_path.rstrip("?"),
+                "next": "/changes?since=%d" % next_seq,
+            },
+        }
+    }
+
+
 def print_in_progress(id):
     """
     Format json info about process in progress
@@ -136,14 +326,141 @@ def print_in_progress(id):
     data = {"asyncTask": {"link": {"poll": location}}}
 
     # need to create response manually in orted to have custom status code
-    response = make_response(json.dumps(data, indent=2))
-    response.status = "Accepted"
-    response.status_code = 202
-    response.headers["Location"] = location
-    response.headers["content-type"] = "application/json"
+    return output(data, 202, {"Location": location})
+
+
+def export_plugins(format="csv"):
+    """
+    Export last results of all plugins as flat table
+    with one row per plugin and component
+
+    :param format: csv, arrow or parquet
+    """
+    host = socket.gethostname()
+    rows = []
+    for name in sorted(smokerd.pluginmgr.get_plugins()):
+        rows += columnar.plugin_rows(host, print_plugin(name)["plugin"])
+
+    if format == "csv":
+        sink = io.StringIO()
+        mimetype = "text/csv"
+    else:
+        sink = io.BytesIO()
+        mimetype = "application/vnd.apache.arrow.file"
+        if format == "parquet":
+            mimetype = "application/vnd.apache.parquet"
+
+    with columnar.open_writer(format, sink) as writer:
+        writer.write(rows)
+
+    response = make_response(sink.getvalue())
+    response.headers["content-type"] = mimetype
+    return response
+
+
+def print_metrics():
+    """
+    Update gauges of the daemon and return all metrics
+    in Prometheus text format
+    """
+    plugins = smokerd.pluginmgr.get_plugins().values()
+    metrics.FORCED_QUEUED.set(sum(1 for plugin in plugins if plugin.forced))
+
+    processes = {"api": psutil.Process()}
+    try:
+        processes["daemon"] = psutil.Process(current_app.config["SMOKER_DAEMON_PID"])
+        children = processes["daemon"].children(recursive=True)
+    except psutil.Error as e:
+        lg.warning("Can't get processes of the daemon: %s" % e)
+        processes.pop("daemon", None)
+    else:
+        workers = 0
+        for child in children:
+            # Workers exit all the time
+            try:
+                cmdline = child.cmdline()
+            except psutil.Error:
+                continue
+            if cmdline[:1] and cmdline[0].startswith("smokerd plugin"):
+                workers += 1
+        metrics.WORKERS.set(workers)
+
+    for name, process in processes.items():
+        try:
+            metrics.OPEN_FDS.set(process.num_fds(), process=name)
+            metrics.RSS.set(process.memory_info().rss, process=name)
+        except psutil.Error:
+            pass
+
+    response = make_response(metrics.REGISTRY.expose())
+    response.headers["Content-Type"] = metrics.CONTENT_TYPE
     return response
 
 
+def print_costs():
+    """
+    Print CPU time of plugins in the last hour, most expensive first
+    """
+    items = [plugin.get_cost() for plugin in smokerd.pluginmgr.get_plugins().values()]
+    items.sort(key=lambda item: item["cpuPerHour"], reverse=True)
+    return {"costs": {"window": COST_WINDOW, "items": items}}
+
+
+def get_profile_dir():
+    """
+    Return directory of profiles, abort if profiling is disabled
+    """
+    if not smokerd.pluginmgr.profile_dir:
+        abort(404, message="Profiling is disabled, set profile_dir in configuration")
+    return smokerd.pluginmgr.profile_dir
+
+
+def print_profiles():
+    """
+    Print saved profiles, newest first, plugins with number of runs
+    to profile and running sampler of this API process
+    """
+    items = []
+    for name, size, mtime in profiling.list_profiles(get_profile_dir()):
+        items.append({
+            "name": name,
+            "size": size,
+            "created": datetime.datetime.fromtimestamp(mtime).isoformat(),
+            "links": {"self": "/profiles/%s" % name},
+        })
+
+    plugins = {}
+    for name, plugin in smokerd.pluginmgr.get_plugins().items():
+        if plugin.profile_runs.value:
+            plugins[name] = plugin.profile_runs.value
+
+    api = None
+    if sampler and sampler.is_alive():
+        api = {
+            "name": os.path.basename(sampler.path),
+            "until": datetime.datetime.fromtimestamp(sampler.until).isoformat(),
+        }
+
+    return {"profiles": {"items": items, "plugins": plugins, "api": api}}
+
+
+def start_sampler(duration, interval=profiling.SAMPLE_INTERVAL):
+    """
+    Sample stacks of the API process for given number of seconds
+    """
+    global sampler
+
+    path = os.path.join(
+        get_profile_dir(), profiling.profile_name("api", profiling.COLLAPSED)
+    )
+    with sampler_lock:
+        if sampler and sampler.is_alive():
+            abort(409, message="API process is already sampled")
+        lg.info("Sampling API process for %ss to %s" % (duration, path))
+        sampler = profiling.Sampler(path, duration, interval)
+        sampler.start()
+
+
 # helper function to serialize objects to JSON
 def default_json_serializer(obj):
     try:
@@ -154,6 +471,114 @@ def default_json_serializer(obj):
         )
 
 
+def output_json(data, code, headers=None):
+    """
+    Make response with JSON encoded body, compact unless
+    pretty output is requested by ?pretty=1
+    """
+    pretty = request.args.get("pretty", "0").lower() not in ("", "0", "false")
+    dumps = current_app.config["SMOKER_JSON_ENCODER"]
+    response = make_response(dumps(data, pretty, default_json_serializer), code)
+    response.headers["Content-Type"] = encoding.JSON_MIMETYPE
+    response.headers.extend(headers or {})
+    if encoding.msgpack:
+        response.vary.add("Accept")
+    return response
+
+
+def output_msgpack(data, code, headers=None):
+    """
+    Make response with MessagePack encoded body
+    """
+    response = make_response(
+        encoding.dumps_msgpack(data, default_json_serializer), code
+    )
+    response.headers["Content-Type"] = encoding.MSGPACK_MIMETYPE
+    response.headers.extend(headers or {})
+    response.vary.add("Accept")
+    return response
+
+
+def output(data, code, headers=None):
+    """
+    Make response in representation preferred by the client
+    """
+    mimetypes = [encoding.JSON_MIMETYPE]
+    if encoding.msgpack:
+        mimetypes.append(encoding.MSGPACK_MIMETYPE)
+    mimetype = request.accept_mimetypes.best_match(mimetypes, encoding.JSON_MIMETYPE)
+    if mimetype == encoding.MSGPACK_MIMETYPE:
+        return output_msgpack(data, code, headers)
+    return output_json(data, code, headers)
+
+
+def compress_response(response):
+    """
+    Compress response by coding accepted by the client
+    """
+    if (
+        response.direct_passthrough
+        or response.is_streamed
+        or "Content-Encoding" in response.headers
+        or response.status_code < 200
+        or response.status_code in (204, 304)
+    ):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    coding = encoding.choose_encoding(request.headers.get("Accept-Encoding"))
+    data = response.get_data()
+    if not coding or len(data) < encoding.COMPRESS_MIN_SIZE:
+        return response
+
+    response.set_data(encoding.compress(data, coding))
+    response.headers["Content-Encoding"] = coding
+    return response
+
+
+def start_request_span():
+    """
+    Trace request of client which sent traceparent header
+    """
+    parent = tracing.parse_traceparent(request.headers.get(tracing.TRACEPARENT))
+    if not parent:
+        return
+
+    rule = request.url_rule.rule if request.url_rule else request.path
+    g.span = tracing.Span(
+        "%s %s" % (request.method, rule),
+        tracing.new_context(parent),
+        parent,
+        tracing.SERVER,
+        attributes={
+            "http.method": request.method,
+            "http.target": request.full_path.rstrip("?"),
+        },
+    )
+    tracing.push(g.span.context)
+
+
+def finish_request_span(response):
+    """
+    Add status code to span of the request
+    """
+    span = g.get("span")
+    if span:
+        span.set_attribute("http.status_code", response.status_code)
+        if response.status_code >= 500:
+            span.set_error(response.status)
+    return response
+
+
+def teardown_request_span(exception=None):
+    span = g.pop("span", None)
+    if span:
+        if exception:
+            span.set_error(exception)
+        tracing.pop()
+        span.finish()
+
+
 class About(Resource):
     """
     Print the basic usage
@@ -177,6 +602,30 @@ class About(Resource):
                         "methods": "GET, POST",
                         "title": "Force plugin run",
                     },
+                    {
+                        "rel": "export",
+                        "href": "/export",
+                        "methods": "GET",
+                        "title": "Export last results as CSV",
+                    },
+                    {
+                        "rel": "metrics",
+                        "href": "/metrics",
+                        "methods": "GET",
+                        "title": "Metrics of plugin runs for Prometheus",
+                    },
+                    {
+                        "rel": "costs",
+                        "href": "/costs",
+                        "methods": "GET",
+                        "title": "CPU time of plugins in the last hour",
+                    },
+                    {
+                        "rel": "profiles",
+                        "href": "/profiles",
+                        "methods": "GET, POST",
+                        "title": "Profile plugin runs or the API process",
+                    },
                 ],
             }
         }
@@ -208,20 +657,210 @@ class Plugin(Resource):
         return plugin
 
 
+class PluginHistory(Resource):
+    def get(self, name):
+        """
+        Print history of plugin results in time range
+
+        Query arguments:
+            since, until: time range as UNIX timestamp or ISO 8601
+            limit: number of items on the page
+            step: downsample results into buckets of given seconds
+            cursor: continue after given result (see links.next)
+
+        :param name: name of the plugin
+        :type name: string
+        """
+        since = get_query_arg("since", parse_time)
+        until = get_query_arg("until", parse_time)
+        after = get_query_arg("cursor", int)
+        step = get_query_arg("step", float)
+        limit = get_query_arg("limit", int, HISTORY_LIMIT)
+
+        if step is not None and step <= 0:
+            abort(400, message="Step has to be positive number")
+        if limit < 1 or limit > HISTORY_LIMIT_MAX:
+            abort(400, message="Limit has to be between 1 and %d" % HISTORY_LIMIT_MAX)
+
+        try:
+            return print_plugin_history(name, since, until, after, limit, step)
+        except exceptions.NoSuchPlugin as e:
+            abort(404, message=str(e))
+
+
+class Changes(Resource):
+    def get(self):
+        """
+        Print results of all plugins newer than given sequence number
+
+        Query arguments:
+            since: sequence number of the last known result (see links.next)
+            limit: number of results
+            wait: wait up to given number of seconds for new result
+
+        When reset is true, results after since are not available
+        anymore and whole state has to be reloaded. Results before
+        firstSeq were removed (some of them) by compaction.
+        """
+        since = get_query_arg("since", int, 0)
+        limit = get_query_arg("limit", int, HISTORY_LIMIT)
+        wait = get_query_arg("wait", float)
+
+        if limit < 1 or limit > HISTORY_LIMIT_MAX:
+            abort(400, message="Limit has to be between 1 and %d" % HISTORY_LIMIT_MAX)
+        if wait is not None and not 0 <= wait <= CHANGES_WAIT_MAX:
+            abort(400, message="Wait has to be between 0 and %d" % CHANGES_WAIT_MAX)
+
+        return print_changes(since, limit, wait)
+
+
+class Export(Resource):
+    def get(self):
+        """
+        Export last results of all plugins as CSV,
+        Arrow or Parquet (if pyarrow is installed)
+
+        Query arguments:
+            format: csv (default), arrow or parquet
+        """
+        format = request.args.get("format", "csv")
+        if format not in columnar.FORMATS:
+            abort(400, message="Format has to be one of %s" % ", ".join(columnar.FORMATS))
+
+        try:
+            return export_plugins(format)
+        except ValueError as e:
+            abort(400, message=str(e))
+
+
+class Metrics(Resource):
+    def get(self):
+        """
+        Print metrics of plugin runs and the daemon
+        """
+        return print_metrics()
+
+
+class Costs(Resource):
+    def get(self):
+        """
+        Print CPU time of plugins, to find the most expensive ones
+        """
+        return print_costs()
+
+
+class Profiles(Resource):
+    def get(self):
+        """
+        Print saved profiles and profiling in progress
+        """
+        return print_profiles()
+
+    def post(self):
+        """
+        Profile next runs of plugin by cProfile or sample
+        the API process for given number of seconds
+        """
+        example = {
+            "example_input": {
+                "profile": {
+                    "plugin": "STRING",
+                    "runs": "INTEGER",
+                },
+            },
+            "example_input_api": {
+                "profile": {
+                    "duration": "NUMBER",
+                    "interval": "NUMBER | NULL",
+                },
+            },
+            "note": "runs 0 stops profiling of the plugin",
+        }
+
+        definition = request.get_json(force=True)
+        profile_dir = get_profile_dir()
+
+        if not definition or not isinstance(definition.get("profile"), dict):
+            abort(400, **example)
+        profile = definition["profile"]
+
+        if "plugin" in profile:
+            runs = profile.get("runs", 1)
+            if not isinstance(runs, int) or runs < 0:
+                example["message"] = "Element runs has to be non-negative integer"
+                abort(400, **example)
+            try:
+                plugin = smokerd.pluginmgr.get_plugin(profile["plugin"])
+            except exceptions.NoSuchPlugin as e:
+                abort(404, message=str(e))
+            lg.info(
+                "Profiling %d next runs of plugin %s to %s"
+                % (runs, plugin.name, profile_dir)
+            )
+            plugin.profile(runs)
+        elif "duration" in profile:
+            duration = profile["duration"]
+            interval = profile.get("interval") or profiling.SAMPLE_INTERVAL
+            if not isinstance(duration, (int, float)) or \
+                    not 0 < duration <= PROFILE_DURATION_MAX:
+                example["message"] = (
+                    "Element duration has to be between 0 and %d"
+                    % PROFILE_DURATION_MAX
+                )
+                abort(400, **example)
+            if not isinstance(interval, (int, float)) or interval <= 0:
+                example["message"] = "Element interval has to be positive number"
+                abort(400, **example)
+            start_sampler(duration, interval)
+        else:
+            example["message"] = "Plugin or duration has to be set"
+            abort(400, **example)
+
+        return print_profiles(), 202
+
+
+class Profile(Resource):
+    def get(self, name):
+        """
+        Download saved profile
+
+        :param name: name of the profile file
+        :type name: string
+        """
+        profile_dir = get_profile_dir()
+        if name.endswith(".%s" % profiling.PSTATS):
+            mimetype = "application/octet-stream"
+        elif name.endswith(".%s" % profiling.COLLAPSED):
+            mimetype = "text/plain"
+        else:
+            abort(404, message="Profile %s not found" % name)
+        return send_from_directory(profile_dir, name, mimetype=mimetype)
+
+
 class Processes(Resource):
     """
     Create or get process
     """
 
     def get(self):
-        result: list[dict] = []
-        processes = smokerd.pluginmgr.get_process_list()
-        # we index processes from 1, having dummy on position 0
-        for id, process in enumerate(processes[1:], start=1):
-            plugins = [plugin.name for plugin in process["plugins"]]
+        """
+        Print processes
+
+        Query arguments:
+            status: running or finished
+            limit: number of processes on the page
+            after: continue after process with given ID (see links.next)
+        """
+        status = request.args.get("status")
+        limit = get_query_arg("limit", int, PROCESSES_LIMIT)
+        after = get_query_arg("after", int)
+
+        if status not in (None, "running", "finished"):
+            abort(400, message="Status has to be running or finished")
+        if limit < 1 or limit > HISTORY_LIMIT_MAX:
+            abort(400, message="Limit has to be between 1 and %d" % HISTORY_LIMIT_MAX)
 
-            result.append(dict(href=f"processes/{id}", plugins=plugins))
-        return result
+        return print_processes(status, limit, after)
 
     def post(self):
         example = {
@@ -280,42 +919,71 @@ class Process(Resource):
         :type id: int
         """
         try:
-            if id < 1:
-                raise IndexError
             process = smokerd.pluginmgr.get_process(int(id))
-        except IndexError:
-            abort(404, message="Process id %s not found" % id)
+        except exceptions.NoSuchProcess as e:
+            abort(404, message=str(e))
 
-        plugins = [plugin.name for plugin in process["plugins"]]
+        # Forced results could be older than the process
+        if not process["finished"]:
+            return print_in_progress(id)
 
         try:
-            return print_plugins(plugins, forced=True)
+            return print_plugins(process["plugins"], forced=True)
         except exceptions.InProgress:
             return print_in_progress(id)
 
 
 class RestServer(multiprocessing.Process):
-    def __init__(self, smoker_daemon):
+    def __init__(self, smoker_daemon, index=0):
         """
         :param smoker_daemon: instance of the smoker daemon
         :type smoker_daemon: smokerd.Smokerd
+        :param index: number of the API process, the first one collects
+            results of plugins, others follow results in the history store
+        :type index: int
         """
         global smokerd
         smokerd = smoker_daemon
 
+        self.index = index
         self.host = smokerd.conf["bind_host"]
         self.port = smokerd.conf["bind_port"]
+        self.processes = smokerd.conf.get("api_processes", 1)
+        self.unix_socket = smokerd.conf.get("unix_socket")
+        self.collect_interval = smokerd.conf.get("collect_interval", 1)
         self.app = Flask(__name__)
-        self.app.config["RESTFUL_JSON"] = {
-            "default": default_json_serializer,
-        }
+        # Plugin workers are children of the daemon process
+        self.app.config["SMOKER_DAEMON_PID"] = os.getpid()
+        self.app.config["SMOKER_JSON_ENCODER"] = encoding.get_encoder(
+            smokerd.conf.get("api_json_encoder", "auto")
+        )
+        if smokerd.conf.get("api_compression", True):
+            self.app.after_request(compress_response)
+        if tracing.enabled():
+            self.app.before_request(start_request_span)
+            self.app.after_request(finish_request_span)
+            self.app.teardown_request(teardown_request_span)
 
         self.api = Api(self.app)
+        self.api.representation(encoding.JSON_MIMETYPE)(output_json)
+        if encoding.msgpack:
+            self.api.representation(encoding.MSGPACK_MIMETYPE)(output_msgpack)
         self.api.add_resource(About, "/")
         self.api.add_resource(Plugins, "/plugins", "/plugins/")
         self.api.add_resource(
             Plugin, "/plugins/<string:name>", "/plugins/<string:name>/"
         )
+        self.api.add_resource(
+            PluginHistory,
+            "/plugins/<string:name>/history",
+            "/plugins/<string:name>/history/",
+        )
+        self.api.add_resource(Changes, "/changes", "/changes/")
+        self.api.add_resource(Export, "/export", "/export/")
+        self.api.add_resource(Metrics, "/metrics", "/metrics/")
+        self.api.add_resource(Costs, "/costs", "/costs/")
+        self.api.add_resource(Profiles, "/profiles", "/profiles/")
+        self.api.add_resource(Profile, "/profiles/<string:name>")
         self.api.add_resource(Processes, "/processes", "/processes/")
         self.api.add_resource(Process, "/processes/<int:id>", "/processes/<int:id>/")
 
@@ -325,14 +993,62 @@ class RestServer(multiprocessing.Process):
         lg.info("REST API server received SIGHUP, reopening log files")
         redirect_standard_io(smokerd.conf)
 
+    def _collect_results(self):
+        """
+        Collect results of plugins as they arrive, so they are
+        stored even if nobody asks for them
+        """
+        while True:
+            smokerd.pluginmgr.collect_results()
+            time.sleep(self.collect_interval)
+
+    def _make_server(self, host, port=0):
+        httpd = httpserver.make_server(
+            host,
+            port,
+            self.app,
+            workers=smokerd.conf.get("api_workers"),
+            backlog=smokerd.conf.get("api_backlog", httpserver.BACKLOG),
+            keep_alive=smokerd.conf.get("api_keep_alive", True),
+            timeout=smokerd.conf.get("api_timeout", httpserver.TIMEOUT),
+            reuse_port=self.processes > 1,
+        )
+        # Let forked plugin workers know what to close
+        server_fds.add(httpd.fileno())
+        return httpd
+
     def run(self):
-        setproctitle.setproctitle("smokerd rest api server")
+        if self.processes > 1:
+            setproctitle.setproctitle("smokerd rest api server %d" % self.index)
+        else:
+            setproctitle.setproctitle("smokerd rest api server")
 
         if hasattr(signal, "SIGHUP"):
             signal.signal(signal.SIGHUP, self._reopen_logfiles)
 
+        # Serve last known results right after (re)start
+        smokerd.pluginmgr.restore_results()
+        if self.index:
+            smokerd.pluginmgr.follow_results()
+
+        collector = threading.Thread(
+            target=self._collect_results, name="result collector"
+        )
+        collector.daemon = True
+        collector.start()
+
         try:
-            self.app.run(self.host, self.port)
+            # Socket file can't be shared, it's served by the first process
+            if self.unix_socket and not self.index:
+                local = self._make_server("unix://%s" % self.unix_socket)
+                thread = threading.Thread(
+                    target=local.serve_forever, name="unix socket server"
+                )
+                thread.daemon = True
+                thread.start()
+
+            httpd = self._make_server(self.host, self.port)
+            httpd.serve_forever()
         except Exception:
             lg.exception("Error occured within the REST API server")
             raise
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2007-2015, GoodData(R) Corporation. All rights reserved
+"""
+Module columnar provides flat export of plugin results for analytics
+
+Each plugin result is turned into one row for the plugin itself and one
+row for each of it's components, so results of many hosts can be loaded
+into a data frame without walking the nested structure.
+
+Usage example:
+
+from smoker.util.columnar import open_writer, plugin_rows
+
+with open_writer('csv', sys.stdout) as writer:
+    for host, plugin in plugins.get_host_plugins():
+        writer.write(plugin_rows(host['name'], plugin))
+
+CSV is always available, Arrow and Parquet formats require pyarrow.
+"""
+
+import csv
+import datetime
+
+# Names of the columns in order
+COLUMNS = (
+    "host",
+    "plugin",
+    "component",
+    "status",
+    "lastRun",
+    "nextRun",
+    "forced",
+    "category",
+    "type",
+    "info",
+    "warn",
+    "error",
+)
+
+# Columns holding timestamps, other columns are strings except forced
+TIME_COLUMNS = ("lastRun", "nextRun")
+
+FORMATS = ("csv", "arrow", "parquet")
+
+# Separator of multiple messages in single cell
+MESSAGE_SEPARATOR = "\n"
+
+
+def parse_datetime(value):
+    """
+    Return datetime for ISO formatted string, datetime or None
+    """
+    if not value or isinstance(value, datetime.datetime):
+        return value or None
+    return datetime.datetime.strptime(value.partition(".")[0], "%Y-%m-%dT%H:%M:%S")
+
+
+def join_messages(messages, level):
+    """
+    Return messages of given level joined into single string
+    """
+    if not messages or not messages.get(level):
+        return ""
+    return MESSAGE_SEPARATOR.join(str(message) for message in messages[level])
+
+
+def iter_components(components):
+    """
+    Yield (name, component result) for components
+
+    Components are dict by name on the daemon and list of
+    {'componentResult': {...}} items in the API response.
+    """
+    if not components:
+        return
+    if isinstance(components, dict):
+        for name in sorted(components):
+            yield name, components[name]
+    else:
+        for item in components:
+            component = item.get("componentResult", item)
+            yield component["name"], component
+
+
+def plugin_rows(host, plugin):
+    """
+    Return rows for the plugin and it's components
+
+    :param host: name of the host
+    :param plugin: plugin as returned by the API (name, parameters,
+                   lastResult, nextRun)
+    :rtype: list of dicts with COLUMNS keys
+    """
+    result = plugin.get("lastResult") or {}
+    params = plugin.get("parameters") or {}
+
+    common = {
+        "host": host,
+        "plugin": plugin["name"],
+        "lastRun": parse_datetime(result.get("lastRun")),
+        "nextRun": parse_datetime(plugin.get("nextRun")),
+        "forced": bool(result.get("forced")),
+        "category": params.get("Category") or "",
+        "type": params.get("Type") or "",
+    }
+
+    rows = []
+    items = [("", result)] + list(iter_components(result.get("componentResults")))
+    for component, component_result in items:
+        messages = component_result.get("messages")
+        row = dict(common)
+        row.update(
+            {
+                "component": component,
+                "status": component_result.get("status") or "UNKNOWN",
+                "info": join_messages(messages, "info"),
+                "warn": join_messages(messages, "warn"),
+                "error": join_messages(messages, "error"),
+            }
+        )
+        rows.append(row)
+    return rows
+
+
+class CsvWriter(object):
+    """
+    Write rows as CSV with header
+    """
+
+    def __init__(self, fh):
+        """
+        :param fh: opened text file
+        """
+        self.fh = fh
+        self.writer = csv.DictWriter(fh, fieldnames=COLUMNS, lineterminator="\n")
+        self.writer.writeheader()
+
+    def write(self, rows):
+        for row in rows:
+            row = dict(row)
+            for column in TIME_COLUMNS:
+                if row[column]:
+                    row[column] = row[column].isoformat()
+            self.writer.writerow(row)
+        self.fh.flush()
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ArrowWriter(object):
+    """
+    Write rows as Arrow IPC file or Parquet, each write is one record batch
+    """
+
+    def __init__(self, sink, format="arrow"):
+        """
+        :param sink: path or opened binary file
+        :param format: arrow or parquet
+        """
+        try:
+            import pyarrow
+        except ImportError:
+            raise ValueError("Format %s requires pyarrow to be installed" % format)
+
+        self.pyarrow = pyarrow
+        fields = []
+        for column in COLUMNS:
+            if column in TIME_COLUMNS:
+                fields.append(pyarrow.field(column, pyarrow.timestamp("s")))
+            elif column == "forced":
+                fields.append(pyarrow.field(column, pyarrow.bool_()))
+            else:
+                fields.append(pyarrow.field(column, pyarrow.string()))
+        self.schema = pyarrow.schema(fields)
+
+        if format == "parquet":
+            import pyarrow.parquet
+
+            self.writer = pyarrow.parquet.ParquetWriter(sink, self.schema)
+        else:
+            import pyarrow.ipc
+
+            self.writer = pyarrow.ipc.new_file(sink, self.schema)
+
+    def write(self, rows):
+        if not rows:
+            return
+        columns = [[row[column] for row in rows] for column in COLUMNS]
+        batch = self.pyarrow.RecordBatch.from_arrays(
+            [
+                self.pyarrow.array(values, type=field.type)
+                for values, field in zip(columns, self.schema)
+            ],
+            schema=self.schema,
+        )
+        self.writer.write_batch(batch)
+
+    def close(self):
+        self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open_writer(format, sink):
+    """
+    Return writer for given format
+
+    :param format: one of FORMATS
+    :param sink: text file for csv, path or binary file otherwise
+    """
+    if format == "csv":
+        return CsvWriter(sink)
+    if format in ("arrow", "parquet"):
+        return ArrowWriter(sink, format)
+    raise ValueError("Unknown export format %s" % format)
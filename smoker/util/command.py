@@ -8,9 +8,14 @@ Module for various command executions
 
 import atexit
 import datetime
+import fcntl
+import hashlib
+import io
+import json
 import logging
 import os
 import subprocess
+import tempfile
 import threading
 import time
 
@@ -18,19 +23,38 @@ import psutil
 
 lg = logging.getLogger(__name__)
 
+# Interval of checks whether the cache file was unlocked, in seconds
+LOCK_POLL = 0.05
 
-def execute(command, timeout=None, **kwargs):
+
+def execute(command, timeout=None, stdout_callback=None, input=None, **kwargs):
     """
     Execute command, wrapper for Command class
 
     :param command: list for non-shell execution, string for shell execution
     :param timeout: timeout in seconds
+    :param stdout_callback: function called with each line of stdout, stdout is not buffered then
+    :param input: string written to stdin of the command
     :param kwargs: keyword arguments to pass to subprocess.Popen
 
     :rtype: tuple (stdout, stderr, retval)
     """
     cmd = Command(command, **kwargs)
-    return cmd.run(timeout)
+    return cmd.run(timeout, stdout_callback=stdout_callback, input=input)
+
+def execute_cached(command, max_age, timeout=None, **kwargs):
+    """
+    Execute command or reuse it's output if the same command
+    was executed within last max_age seconds (by any process)
+
+    :param command: list for non-shell execution, string for shell execution
+    :param max_age: maximal age of reused output in seconds
+    :param timeout: timeout in seconds
+    :param kwargs: keyword arguments to pass to subprocess.Popen
+
+    :rtype: tuple (stdout, stderr, retval)
+    """
+    return CommandCache().execute(command, max_age, timeout=timeout, **kwargs)
 
 def signal_ptree(pid, signal=15):
     """
@@ -155,6 +179,7 @@ class Command(object):
         self.returncode = None
 
         self._exception = None
+        self._callback_exception = None
 
         # Default arguments
         popen_args = {
@@ -176,7 +201,33 @@ class Command(object):
         """
         return '<Command \'%s\'>' % self.command
 
-    def run(self, timeout=None, timeout_sigterm=3, timeout_sigkill=5):
+    def _stream_stdout(self, callback):
+        """
+        Pass stdout of running process to callback line by line instead
+        of buffering it, stderr is read whole by separate thread.
+        If callback fails, rest of the output is drained and ignored.
+
+        :param callback: function accepting single line of stdout
+        :rtype: tuple (stdout, stderr) - stdout is always empty
+        """
+        stderr = []
+        reader = threading.Thread(target=lambda: stderr.append(self.process.stderr.read()))
+        reader.daemon = True
+        reader.start()
+
+        for line in io.BufferedReader(self.process.stdout):
+            if self._callback_exception:
+                continue
+            try:
+                callback(line.decode('utf-8').rstrip('\r\n'))
+            except Exception as e:
+                self._callback_exception = e
+
+        reader.join()
+        self.process.wait()
+        return b'', stderr[0] if stderr else b''
+
+    def run(self, timeout=None, timeout_sigterm=3, timeout_sigkill=5, stdout_callback=None, input=None):
         """
         Run command with given timeout.
         Return tuple of stdout, stderr strings and retval integer.
@@ -184,9 +235,17 @@ class Command(object):
         :param timeout: if command doesn't exit in given timeout, kill the process (default no timeout)
         :param timeout_sigterm: wait approximately given seconds after sending SIGTERM before sending SIGKILL (default 3)
         :param timeout_sigkill: wait approximately given seconds after sending SIGKILL before considering thread as deadlocked (default 5)
+        :param stdout_callback: function called with each line of stdout, returned stdout is empty then
+        :param input: string written to stdin of the command (can't be used with stdout_callback)
 
         :rtype: tuple (stdout, stderr, retval)
         """
+        if input is not None:
+            if stdout_callback:
+                raise ValueError("Input can't be used together with stdout_callback")
+            self.kwargs['stdin'] = subprocess.PIPE
+            input = input.encode('utf-8')
+
         def target():
             """
             Thread target function
@@ -195,7 +254,10 @@ class Command(object):
                 self.process = subprocess.Popen(self.command, **self.kwargs)
                 # Register cleanup function to avoid running processes after program exit
                 _register_cleanup(self.process.pid)
-                self.stdout, self.stderr = self.process.communicate()
+                if stdout_callback:
+                    self.stdout, self.stderr = self._stream_stdout(stdout_callback)
+                else:
+                    self.stdout, self.stderr = self.process.communicate(input)
 
                 # Remove unwanted leading/trailing whitespaces from output
                 # Force stdout/stderr to be string if it's empty
@@ -246,6 +308,11 @@ class Command(object):
             _unregister_cleanup(self.process.pid)
             raise self._exception
 
+        # Process is done, but callback failed
+        if self._callback_exception:
+            _unregister_cleanup(self.process.pid)
+            raise self._callback_exception
+
         lg.debug("Command execution done: time=%s returncode=%s" %
                  ((datetime.datetime.now() - time_start).seconds, self.returncode))
 
@@ -253,6 +320,144 @@ class Command(object):
         _unregister_cleanup(self.process.pid)
         return (self.stdout, self.stderr, self.returncode)
 
+class CommandCache(object):
+    """
+    Cache of command results shared between processes
+
+    Plugins are executed in forked workers, so the cache is kept on disk,
+    one file per rendered command. Concurrent runs of the same command
+    are serialized by lock on that file, so the command is executed only
+    by the first worker and the others get it's output.
+    """
+    def __init__(self, directory=None):
+        """
+        Initialize instance
+
+        :param directory: cache directory, private per effective user by default
+        """
+        if not directory:
+            directory = os.path.join(tempfile.gettempdir(),
+                                     'smokerd-cache-%s' % os.geteuid())
+        self.directory = directory
+
+    def _prepare_directory(self):
+        """
+        Create cache directory and check nobody else can tamper with it
+        """
+        try:
+            os.mkdir(self.directory, 0o700)
+        except FileExistsError:
+            pass
+
+        stat = os.stat(self.directory)
+        if stat.st_uid != os.geteuid() or stat.st_mode & 0o077:
+            raise CacheError("Cache directory %s is not private" % self.directory)
+
+    def get_key(self, command, kwargs=None):
+        """
+        Return key identifying command executed with given Popen
+        keyword arguments (env, cwd, shell, ...)
+        """
+        if isinstance(command, list):
+            command = tuple(command)
+        return json.dumps([command, kwargs or {}], sort_keys=True, default=repr)
+
+    def get_path(self, key):
+        """
+        Return path of cache file for given key
+        """
+        return os.path.join(self.directory,
+                            hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def execute(self, command, max_age, timeout=None, **kwargs):
+        """
+        Return cached output of command if it's not older than max_age
+        seconds, execute command and cache it's output otherwise.
+        Fallback to simple execution if cache can't be used or it's
+        locked by another worker for longer than timeout.
+
+        :rtype: tuple (stdout, stderr, retval)
+        """
+        key = self.get_key(command, kwargs)
+        try:
+            self._prepare_directory()
+            fd = os.open(self.get_path(key), os.O_RDWR | os.O_CREAT, 0o600)
+        except (OSError, CacheError) as e:
+            lg.warning("Command cache is not available, executing directly: %s" % e)
+            return execute(command, timeout=timeout, **kwargs)
+
+        with os.fdopen(fd, 'r+') as fp:
+            # Wait until worker executing the same command is done
+            if not self._lock(fp, timeout):
+                lg.warning("Command cache is locked for %ss, executing directly: "
+                           "command='%s'" % (timeout, command))
+                return execute(command, timeout=timeout, **kwargs)
+            try:
+                cached = self._load(fp, key, max_age)
+                if cached:
+                    lg.debug("Using cached output of command: command='%s'" % command)
+                    return cached
+
+                output = execute(command, timeout=timeout, **kwargs)
+                self._store(fp, key, output)
+                return output
+            finally:
+                fcntl.flock(fp, fcntl.LOCK_UN)
+
+    def _lock(self, fp, timeout=None):
+        """
+        Lock cache file, wait at most timeout seconds (forever if None)
+
+        :return: True if lock was acquired
+        """
+        if timeout is None:
+            fcntl.flock(fp, fcntl.LOCK_EX)
+            return True
+
+        deadline = time.time() + timeout
+        while True:
+            try:
+                fcntl.flock(fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                if time.time() >= deadline:
+                    return False
+                time.sleep(LOCK_POLL)
+
+    def _load(self, fp, key, max_age):
+        """
+        Load cached output or return None if it's missing or stale
+        """
+        fp.seek(0)
+        try:
+            cached = json.load(fp)
+        except ValueError:
+            return None
+
+        if cached.get('key') != key:
+            return None
+
+        if time.time() - cached['time'] > max_age:
+            return None
+
+        return (cached['stdout'], cached['stderr'], cached['returncode'])
+
+    def _store(self, fp, key, output):
+        """
+        Replace cached output
+        """
+        stdout, stderr, returncode = output
+        fp.seek(0)
+        fp.truncate()
+        json.dump({
+            'key': key,
+            'time': time.time(),
+            'stdout': stdout,
+            'stderr': stderr,
+            'returncode': returncode,
+        }, fp)
+        fp.flush()
+
 ## Exceptions
 class ExecutionTimeout(Exception):
     """
@@ -265,3 +470,9 @@ class ThreadDeadlock(Exception):
     Process can't be killed, caused deadlock of executing thread
     """
     pass
+
+class CacheError(Exception):
+    """
+    Command cache can't be used
+    """
+    pass
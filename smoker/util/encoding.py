@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2007-2015, GoodData(R) Corporation. All rights reserved
+"""
+Module encoding provides JSON encoders and compression used by
+smokerd REST API and its clients
+
+Faster JSON encoders are used when installed (orjson, ujson),
+otherwise standard json module. Clients can ask for MessagePack
+instead of JSON when msgpack module is installed. Responses are
+compressed by gzip or by zstd when zstandard module is installed.
+
+Usage example:
+
+dumps = get_encoder()
+data = dumps({'plugins': []}, pretty=True)
+coding = choose_encoding('gzip, deflate')
+if coding:
+    data = compress(data, coding)
+"""
+
+import gzip
+import json
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+JSON_MIMETYPE = "application/json"
+MSGPACK_MIMETYPE = "application/msgpack"
+
+# Encoders in order of preference
+ENCODER_NAMES = ("orjson", "ujson", "json")
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+# Responses smaller than this are sent as they are, compression
+# wouldn't save anything worth the time
+COMPRESS_MIN_SIZE = 1024
+
+
+def _dumps_json(data, pretty=False, default=None):
+    if pretty:
+        return (json.dumps(data, indent=2, default=default) + "\n").encode("utf-8")
+    return json.dumps(data, separators=(",", ":"), default=default).encode("utf-8")
+
+
+def _dumps_orjson(data, pretty=False, default=None):
+    import orjson
+
+    option = orjson.OPT_NON_STR_KEYS
+    if pretty:
+        option |= orjson.OPT_INDENT_2 | orjson.OPT_APPEND_NEWLINE
+    return orjson.dumps(data, default=default, option=option)
+
+
+def _dumps_ujson(data, pretty=False, default=None):
+    import ujson
+
+    return ujson.dumps(
+        data,
+        indent=2 if pretty else 0,
+        default=default,
+        escape_forward_slashes=False,
+    ).encode("utf-8")
+
+
+ENCODERS = {
+    "json": _dumps_json,
+    "orjson": _dumps_orjson,
+    "ujson": _dumps_ujson,
+}
+
+
+def get_encoder(name="auto"):
+    """
+    Return function encoding data into JSON bytes
+
+    Function takes data, pretty (bool) and default (function
+    serializing unknown objects) arguments.
+    Raise ValueError if encoder is unknown or not installed.
+
+    :param name: orjson, ujson, json or auto for the fastest available
+    """
+    names = ENCODER_NAMES if name == "auto" else [name]
+    for name in names:
+        if name not in ENCODERS:
+            raise ValueError("Unknown JSON encoder %s" % name)
+        if name == "json":
+            return ENCODERS[name]
+        try:
+            __import__(name)
+        except ImportError:
+            continue
+        return ENCODERS[name]
+    raise ValueError("JSON encoder %s is not installed" % name)
+
+
+def dumps_msgpack(data, default=None):
+    """
+    Encode data into MessagePack bytes
+    """
+    return msgpack.packb(data, default=default, use_bin_type=True)
+
+
+def loads(data, content_type=None):
+    """
+    Decode body of the response by it's Content-Type,
+    JSON unless it's MessagePack
+    """
+    mimetype = (content_type or "").split(";")[0].strip().lower()
+    if mimetype == MSGPACK_MIMETYPE:
+        if not msgpack:
+            raise ValueError("Can't decode %s, msgpack is not installed" % mimetype)
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+    return json.loads(data.decode("utf-8"))
+
+
+# Value of Accept header sent by clients
+if msgpack:
+    ACCEPT = "%s, %s;q=0.9" % (MSGPACK_MIMETYPE, JSON_MIMETYPE)
+else:
+    ACCEPT = JSON_MIMETYPE
+
+
+def available_encodings():
+    """
+    Return supported content codings in order of preference
+    """
+    if zstandard:
+        return ["zstd", "gzip"]
+    return ["gzip"]
+
+
+# Value of Accept-Encoding header sent by clients
+ACCEPT_ENCODING = ", ".join(available_encodings())
+
+
+def choose_encoding(accept_encoding):
+    """
+    Return preferred coding accepted by the client or None
+
+    :param accept_encoding: value of Accept-Encoding header
+    """
+    accepted = set()
+    for item in (accept_encoding or "").split(","):
+        coding, _, params = item.partition(";")
+        quality = params.strip()
+        if quality.startswith("q="):
+            try:
+                if float(quality[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip().lower())
+
+    for coding in available_encodings():
+        if coding in accepted:
+            return coding
+    return None
+
+
+def compress(data, coding):
+    if coding == "gzip":
+        return gzip.compress(data, GZIP_LEVEL)
+    if coding == "zstd" and zstandard:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    raise ValueError("Unsupported content coding %s" % coding)
+
+
+def decompress(data, coding):
+    """
+    Decode body of the response by it's Content-Encoding
+    """
+    if not coding or coding == "identity":
+        return data
+    if coding == "gzip":
+        return gzip.decompress(data)
+    if coding == "zstd" and zstandard:
+        # Streaming decompressor doesn't need content size in the frame
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    raise ValueError("Unsupported content coding %s" % coding)
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2007-2015, GoodData(R) Corporation. All rights reserved
+"""
+Module profiling provides on-demand profiles of plugin runs and of the daemon
+
+Plugin runs are profiled by cProfile and saved in pstats format, running
+processes are sampled by a thread which saves stacks of all other threads
+in collapsed format (one stack per line with count of samples, as read
+by flamegraph.pl or speedscope).
+
+Usage example:
+
+from smoker.util import profiling
+
+profiling.profile_call('/var/tmp/uname.pstats', plugin.run)
+
+sampler = profiling.Sampler('/var/tmp/api.collapsed', duration=30)
+sampler.start()
+
+Profiles are written to a temporary file and renamed, so incomplete
+profile is never listed.
+"""
+
+import collections
+import cProfile
+import datetime
+import os
+import re
+import sys
+import threading
+import time
+
+# Extensions of the profile formats
+PSTATS = "pstats"
+COLLAPSED = "collapsed"
+
+# Default seconds between samples
+SAMPLE_INTERVAL = 0.01
+
+
+def profile_name(prefix, extension):
+    """
+    Return file name of new profile, eg. Uname-20200101T120000-1234.pstats
+    """
+    prefix = re.sub(r"[^\w.-]", "_", prefix)
+    now = datetime.datetime.now().strftime("%Y%m%dT%H%M%S")
+    return "%s-%s-%d.%s" % (prefix, now, os.getpid(), extension)
+
+
+def _write(path, write):
+    """
+    Write file by the given function through temporary file
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp = "%s.tmp" % path
+    write(tmp)
+    os.rename(tmp, path)
+
+
+def profile_call(path, func, *args, **kwargs):
+    """
+    Call the function with cProfile enabled, save the stats
+    to the given path and return result of the function
+    """
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args, **kwargs)
+    finally:
+        _write(path, profiler.dump_stats)
+
+
+def format_frame(frame):
+    code = frame.f_code
+    return "%s:%s" % (code.co_filename, code.co_name)
+
+
+def collapse_stack(frame):
+    """
+    Return stack of the frame from the outermost call separated by ;
+    """
+    stack = []
+    while frame is not None:
+        stack.append(format_frame(frame))
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+class Sampler(threading.Thread):
+    """
+    Thread sampling stacks of all other threads of the process for the
+    given number of seconds, stacks are prefixed by name of the thread
+    """
+
+    def __init__(self, path, duration, interval=SAMPLE_INTERVAL):
+        super(Sampler, self).__init__(name="profile sampler")
+        self.daemon = True
+        self.path = path
+        self.duration = duration
+        self.interval = interval
+        self.until = time.time() + duration
+        self.stacks = collections.Counter()
+
+    def sample(self):
+        names = dict((thread.ident, thread.name) for thread in threading.enumerate())
+        for ident, frame in sys._current_frames().items():
+            if ident == self.ident:
+                continue
+            name = names.get(ident, "thread-%d" % ident).replace(";", "_")
+            self.stacks["%s;%s" % (name, collapse_stack(frame))] += 1
+
+    def save(self, fp):
+        for stack, count in sorted(self.stacks.items()):
+            fp.write("%s %d\n" % (stack, count))
+
+    def run(self):
+        while time.time() < self.until:
+            self.sample()
+            time.sleep(self.interval)
+
+        def write(path):
+            with open(path, "w") as fp:
+                self.save(fp)
+
+        _write(self.path, write)
+
+
+def list_profiles(directory):
+    """
+    Return list of (name, size, mtime) of profiles in the directory,
+    newest first
+    """
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+
+    profiles = []
+    for name in names:
+        if not name.endswith((".%s" % PSTATS, ".%s" % COLLAPSED)):
+            continue
+        try:
+            stat = os.stat(os.path.join(directory, name))
+        except OSError:
+            continue
+        profiles.append((name, stat.st_size, stat.st_mtime))
+    profiles.sort(key=lambda profile: profile[2], reverse=True)
+    return profiles
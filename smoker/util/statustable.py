@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2007-2015, GoodData(R) Corporation. All rights reserved
+"""
+Module statustable provides memory-mapped table of last plugin statuses
+
+Smokerd publishes status, time of last run, short message and sequence
+number of the last result of each plugin, so local consumers (eg. Nagios
+checks) can read them without asking the REST API.
+
+The file starts with a header followed by one fixed-size slot per plugin.
+Every slot is guarded by it's own counter (seqlock): writer makes it odd
+before it changes the slot and even again when it's done. Readers copy
+the slot and retry when the counter was odd or changed meanwhile, so
+neither side ever waits for the other.
+
+Usage example:
+
+table = StatusTable.open('/var/run/smokerd.status')
+if table.is_alive():
+    print(table.get('Uptime'))
+"""
+
+import datetime
+import hashlib
+import mmap
+import os
+import struct
+import time
+
+DEFAULT_PATH = "/var/run/smokerd.status"
+
+MAGIC = b"SMKT"
+VERSION = 1
+
+# magic, version, number of slots, PID of the writer, time of creation
+HEADER = struct.Struct("<4sHIId")
+HEADER_SIZE = 64
+
+# counter, name, category, component, type, status, last run,
+# sequence number, message
+SLOT = struct.Struct("<Q64s32s32s16s8sdQ256s")
+COUNTER = struct.Struct("<Q")
+# status, last run, sequence number and message
+DYNAMIC = struct.Struct("<8sdQ256s")
+DYNAMIC_OFFSET = SLOT.size - DYNAMIC.size
+
+NAME_SIZE = 64
+MESSAGE_SIZE = 256
+
+# Number of attempts to read slot that is being written
+READ_RETRIES = 1000
+
+
+def encode(value, size):
+    """
+    Encode string into at most size bytes without splitting characters
+    """
+    value = (value or "").encode("utf-8")[:size]
+    return value.decode("utf-8", "ignore").encode("utf-8")
+
+
+def decode(value):
+    return value.rstrip(b"\0").decode("utf-8", "ignore")
+
+
+def slot_name(name):
+    """
+    Return name of plugin as stored in the slot
+
+    Names longer than the slot are shortened and suffixed by their
+    hash, so they stay unique and can be still looked up by full name
+    """
+    if len(name.encode("utf-8")) <= NAME_SIZE:
+        return name
+    digest = hashlib.sha1(name.encode("utf-8")).hexdigest()[:16]
+    prefix = encode(name, NAME_SIZE - len(digest) - 1).decode("utf-8")
+    return "%s~%s" % (prefix, digest)
+
+
+def short_message(result):
+    """
+    Return the most important message of the result
+
+    First message of the result's status level (info for OK) or list
+    of failed components with their first message
+    """
+    status = result.get("status") or ""
+    level = "info" if status == "OK" else status.lower()
+    messages = result.get("messages") or {}
+    if messages.get(level):
+        return str(messages[level][0])
+
+    issues = []
+    for name, component in sorted((result.get("componentResults") or {}).items()):
+        if component["status"] == "OK":
+            continue
+        details = (component.get("messages") or {}).get(component["status"].lower())
+        issue = "%s: %s" % (name, component["status"])
+        if details:
+            issue += ": %s" % details[0]
+        issues.append(issue)
+    return "; ".join(issues)
+
+
+class StatusTable(object):
+    """
+    Memory-mapped table of plugin statuses
+    """
+
+    def __init__(self, path, mapping, writable=False):
+        """
+        Use create() or open() to get the instance
+        """
+        self.path = path
+        self.mapping = mapping
+        self.writable = writable
+
+        magic, version, self.size, self.pid, self.created = HEADER.unpack_from(mapping)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a status table" % path)
+
+        self.slots = {}
+        for index in range(self.size):
+            name = decode(SLOT.unpack_from(mapping, self.offset(index))[1])
+            self.slots[name] = index
+
+    @classmethod
+    def create(cls, path, plugins):
+        """
+        Create new table for plugins and replace the old one atomically
+
+        :param path: path of the table file
+        :param plugins: dict of plugin parameters by plugin name
+        """
+        data = bytearray(HEADER_SIZE + SLOT.size * len(plugins))
+        HEADER.pack_into(data, 0, MAGIC, VERSION, len(plugins), os.getpid(), time.time())
+        for index, name in enumerate(sorted(plugins)):
+            params = plugins[name]
+            SLOT.pack_into(
+                data,
+                HEADER_SIZE + SLOT.size * index,
+                0,
+                encode(slot_name(name), NAME_SIZE),
+                encode(params.get("Category"), 32),
+                encode(params.get("Component"), 32),
+                encode(params.get("Type"), 16),
+                b"UNKNOWN",
+                0,
+                0,
+                b"",
+            )
+
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp, "wb") as fh:
+            fh.write(data)
+        os.rename(tmp, path)
+
+        with open(path, "r+b") as fh:
+            mapping = mmap.mmap(fh.fileno(), 0)
+        return cls(path, mapping, writable=True)
+
+    @classmethod
+    def open(cls, path):
+        """
+        Open existing table for reading
+        Raise OSError if it can't be opened
+        """
+        with open(path, "rb") as fh:
+            size = os.fstat(fh.fileno()).st_size
+            if size < HEADER_SIZE:
+                raise ValueError("%s is not a status table" % path)
+            mapping = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(path, mapping)
+
+    def offset(self, index):
+        return HEADER_SIZE + SLOT.size * index
+
+    def is_alive(self):
+        """
+        Return True if process which created the table still runs
+        """
+        try:
+            os.kill(self.pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def update(self, name, status, last_run=None, message=None, seq=None):
+        """
+        Update status of the plugin, unknown plugins are ignored
+
+        :param last_run: UNIX timestamp of the result
+        :param seq: sequence number of the result
+        """
+        assert self.writable, "Status table is opened read-only"
+        try:
+            offset = self.offset(self.slots[slot_name(name)])
+        except KeyError:
+            return
+
+        counter = COUNTER.unpack_from(self.mapping, offset)[0]
+        COUNTER.pack_into(self.mapping, offset, counter + 1)
+        DYNAMIC.pack_into(
+            self.mapping,
+            offset + DYNAMIC_OFFSET,
+            encode(status, 8),
+            last_run or 0,
+            seq or 0,
+            encode(message, MESSAGE_SIZE),
+        )
+        COUNTER.pack_into(self.mapping, offset, counter + 2)
+
+    def read(self, index):
+        """
+        Return consistent copy of the slot
+        """
+        offset = self.offset(index)
+        for _ in range(READ_RETRIES):
+            counter = COUNTER.unpack_from(self.mapping, offset)[0]
+            if counter % 2 == 0:
+                data = self.mapping[offset:offset + SLOT.size]
+                if COUNTER.unpack_from(self.mapping, offset)[0] == counter:
+                    break
+            time.sleep(0)
+        else:
+            raise RuntimeError("Status table %s is not being updated consistently" % self.path)
+
+        (_, name, category, component, type, status,
+         last_run, seq, message) = SLOT.unpack(data)
+        return {
+            "name": decode(name),
+            "category": decode(category) or None,
+            "component": decode(component) or None,
+            "type": decode(type) or None,
+            "status": decode(status),
+            "lastRun": datetime.datetime.fromtimestamp(last_run) if last_run else None,
+            "seq": seq or None,
+            "message": decode(message),
+        }
+
+    def get(self, name):
+        """
+        Return status of the plugin or None if there is no such plugin
+        """
+        try:
+            return self.read(self.slots[slot_name(name)])
+        except KeyError:
+            return None
+
+    def items(self):
+        """
+        Return statuses of all plugins sorted by name
+        Names longer than NAME_SIZE bytes are shortened, see slot_name()
+        """
+        return [self.read(index) for index in range(self.size)]
+
+    def close(self):
+        self.mapping.close()
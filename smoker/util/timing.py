@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2007-2015, GoodData(R) Corporation. All rights reserved
+"""
+Module timing interprets timing block of plugin result
+
+Timing block contains UNIX timestamps of the run phases recorded by the
+worker (scheduled, spawned, started, semaphoreAcquired, execStarted,
+execFinished, parseFinished, actionStarted, actionFinished, finished,
+enqueued) and by the daemon (collected).
+"""
+
+# Name, first and last timestamp of the phases of plugin run
+PHASES = (
+    ("lag", "scheduled", "spawned"),
+    ("spawn", "spawned", "started"),
+    ("semaphore", "started", "semaphoreAcquired"),
+    ("exec", "execStarted", "execFinished"),
+    ("parse", "execFinished", "parseFinished"),
+    ("action", "actionStarted", "actionFinished"),
+    ("queue", "enqueued", "collected"),
+)
+
+
+def phases(timing):
+    """
+    Return list of (name, seconds) of phases with both timestamps known
+    """
+    result = []
+    for name, start, end in PHASES:
+        if (timing or {}).get(start) and timing.get(end):
+            result.append((name, max(0, timing[end] - timing[start])))
+    return result
+
+
+def run_time(timing):
+    """
+    Return seconds the plugin was executed including parser and action,
+    None if it's not known
+    """
+    if timing and timing.get("execStarted") and timing.get("finished"):
+        return max(0, timing["finished"] - timing["execStarted"])
+    return None
+
+
+def format_timing(timing):
+    """
+    Return one line summary of the phases, eg.
+    run 0.012s (lag 2.011s, spawn 0.003s, exec 0.010s, queue 0.812s)
+    """
+    details = ", ".join("%s %.3fs" % phase for phase in phases(timing))
+    total = run_time(timing)
+    if total is None:
+        return details
+    return "run %.3fs (%s)" % (total, details)
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2007-2015, GoodData(R) Corporation. All rights reserved
+"""
+Module tracing writes spans of forced runs to a local file
+
+Spans are written as JSON lines in the shape of OTLP/JSON export requests
+(one resourceSpans object per line), so the file can be read by the
+OpenTelemetry collector otlpjsonfile receiver or simply by jq. Trace
+context is passed between processes in W3C traceparent HTTP header.
+
+Usage example:
+
+from smoker.util import tracing
+
+tracing.configure('/tmp/smoker-trace.jsonl', 'smokercli')
+with tracing.span('force run') as span:
+    headers = {tracing.TRACEPARENT: tracing.format_traceparent(span.context)}
+
+Tracing is disabled until configure() is called with a path, spans are
+then not created and nothing is written.
+"""
+
+import binascii
+import collections
+import contextlib
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+lg = logging.getLogger("smoker.tracing")
+
+TRACEPARENT = "traceparent"
+
+# Kinds and status codes of OTLP spans
+INTERNAL = 1
+SERVER = 2
+CLIENT = 3
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+SpanContext = collections.namedtuple("SpanContext", ("trace_id", "span_id"))
+
+# Configured by configure(), inherited by forked processes
+path = None
+service = None
+
+_local = threading.local()
+
+
+def configure(trace_file, service_name):
+    """
+    Write spans of the given service to trace_file, None disables tracing
+    """
+    global path, service
+    path = trace_file
+    service = service_name
+
+
+def enabled():
+    return bool(path)
+
+
+def new_id(size):
+    return binascii.hexlify(os.urandom(size)).decode("ascii")
+
+
+def new_context(parent=None):
+    """
+    Return context of new span in the trace of parent
+    or in a new trace
+    """
+    trace_id = parent.trace_id if parent else new_id(16)
+    return SpanContext(trace_id, new_id(8))
+
+
+def parse_traceparent(value):
+    """
+    Return SpanContext of traceparent header or None if it's invalid
+    """
+    try:
+        version, trace_id, span_id, flags = value.strip().split("-")
+        int(trace_id, 16), int(span_id, 16)
+    except (AttributeError, ValueError):
+        return None
+    if len(trace_id) != 32 or len(span_id) != 16 or version == "ff":
+        return None
+    if not int(trace_id, 16) or not int(span_id, 16):
+        return None
+    return SpanContext(trace_id.lower(), span_id.lower())
+
+
+def format_traceparent(context):
+    return "00-%s-%s-01" % (context.trace_id, context.span_id)
+
+
+def format_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def format_attributes(attributes):
+    return [
+        {"key": key, "value": format_value(value)}
+        for key, value in sorted(attributes.items())
+        if value is not None
+    ]
+
+
+class Span(object):
+    """
+    Operation with start and end time, UNIX timestamps in seconds
+    """
+
+    def __init__(self, name, context, parent=None, kind=INTERNAL,
+                 start=None, attributes=None):
+        self.name = name
+        self.context = context
+        self.parent = parent
+        self.kind = kind
+        self.start = start or time.time()
+        self.end = None
+        self.attributes = dict(attributes or {})
+        self.status = None
+        self.message = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def set_error(self, message):
+        self.status = STATUS_ERROR
+        self.message = str(message)
+
+    def finish(self, end=None):
+        self.end = end or time.time()
+        try:
+            write(self)
+        except OSError as e:
+            lg.warning("Can't write span %s to %s: %s" % (self.name, path, e))
+
+    def otlp(self):
+        """
+        Return span in the shape of OTLP/JSON
+        """
+        span = {
+            "traceId": self.context.trace_id,
+            "spanId": self.context.span_id,
+            "parentSpanId": self.parent.span_id if self.parent else "",
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(int(self.start * 1e9)),
+            "endTimeUnixNano": str(int(self.end * 1e9)),
+            "attributes": format_attributes(self.attributes),
+        }
+        if self.status:
+            span["status"] = {"code": self.status, "message": self.message or ""}
+        return span
+
+
+def write(span):
+    """
+    Append span to the trace file as single line
+    """
+    line = json.dumps({
+        "resourceSpans": [{
+            "resource": {"attributes": format_attributes({
+                "service.name": service,
+                "host.name": socket.gethostname(),
+                "process.pid": os.getpid(),
+            })},
+            "scopeSpans": [{
+                "scope": {"name": "smoker"},
+                "spans": [span.otlp()],
+            }],
+        }],
+    }, separators=(",", ":"))
+    # Single write of file opened for appending, so lines of processes
+    # sharing the file are not mixed
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, (line + "\n").encode("utf-8"))
+    finally:
+        os.close(fd)
+
+
+def current():
+    """
+    Return context of the innermost span of the thread or None
+    """
+    stack = getattr(_local, "stack", None)
+    return stack[-1] if stack else None
+
+
+def push(context):
+    """
+    Make context parent of spans created by the thread until pop()
+    """
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    _local.stack.append(context)
+
+
+def pop():
+    _local.stack.pop()
+
+
+@contextlib.contextmanager
+def activate(context):
+    """
+    Make context parent of spans created in the block
+    """
+    push(context)
+    try:
+        yield context
+    finally:
+        pop()
+
+
+@contextlib.contextmanager
+def span(name, parent=None, kind=INTERNAL, attributes=None):
+    """
+    Trace the block as span, child of the parent context or
+    of the current span of the thread. Yield the span or None
+    if tracing is disabled.
+    """
+    if not enabled():
+        yield None
+        return
+
+    parent = parent or current()
+    item = Span(name, new_context(parent), parent, kind, attributes=attributes)
+    try:
+        with activate(item.context):
+            yield item
+    except Exception as e:
+        item.set_error(e)
+        raise
+    finally:
+        item.finish()
+
+
+def record(name, start, end, context=None, parent=None, attributes=None):
+    """
+    Write span of the operation which has already finished
+    """
+    if not enabled() or not start or not end:
+        return None
+    item = Span(name, context or new_context(parent), parent,
+                start=start, attributes=attributes)
+    item.finish(end)
+    return item
+
+
+def bind(func):
+    """
+    Return function running in the current span of the calling thread,
+    for targets of new threads
+    """
+    context = current()
+
+    def wrapper(*args, **kwargs):
+        with activate(context):
+            return func(*args, **kwargs)
+
+    return wrapper
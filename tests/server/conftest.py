@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2007-2015, GoodData(R) Corporation. All rights reserved
+
+import copy
+import os
+
+import pytest
+
+import smoker.server.plugins as server_plugins
+from smoker.server import restserver
+from smoker.server.daemon import Smokerd
+
+conf_dir = (os.path.dirname(os.path.realpath(__file__)) +
+            '/smoker_test_resources/smokerd')
+
+
+@pytest.fixture
+def make_client(monkeypatch):
+    """
+    Return function creating REST API test client for plugin config
+
+    Function takes plugin config, optional dict of daemon config
+    overrides and keyword arguments for the PluginManager. Created
+    daemon is available as restserver.smokerd.
+    """
+    def make_client(config, conf=None, **kwargs):
+        smokerd = Smokerd(config=conf_dir + '/smokerd.yaml')
+        smokerd.conf.update(conf or dict())
+        smokerd.pluginmgr = server_plugins.PluginManager(
+            **dict(copy.deepcopy(config), **kwargs))
+        monkeypatch.setattr(restserver, 'smokerd', smokerd)
+        return restserver.RestServer(smokerd).app.test_client()
+
+    return make_client
@@ -4,10 +4,13 @@
 
 import ast
 import datetime
+import email.message
 import json
 import os
 import re
 import socket
+import urllib.request
+import urllib.response
 
 from flask_restful import abort
 
@@ -21,6 +24,9 @@ HOSTNAME = socket.gethostname()
 
 
 def rest_api_response(k, **kwargs):
+    if isinstance(k, urllib.request.Request):
+        kwargs['data'] = k.data
+        k = k.full_url
     if not os.path.exists(TMP_DIR):
         os.makedirs(TMP_DIR)
     plugin_list = ['Hostname', 'Uptime', 'Uname']
@@ -75,7 +81,7 @@ def rest_api_response(k, **kwargs):
     with open(fp, 'w') as mockf:
         mockf.write(json.dumps(return_value))
 
-    return open(fp, "rb")
+    return urllib.response.addinfourl(open(fp, "rb"), email.message.Message(), k)
 
 about_response = {
     'about': {
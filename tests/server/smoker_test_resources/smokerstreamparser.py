@@ -0,0 +1,18 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2007-2012, GoodData(R) Corporation. All rights reserved
+
+from smoker.server.parser import BaseParser
+
+
+class Parser(BaseParser):
+    streaming = True
+
+    def feed(self, line):
+        name, _, status = line.partition(':')
+        self.result.add_component(name=name, status=status, info=[line])
+
+    def finish(self):
+        super(Parser, self).finish()
+        self.result.set_status()
+        return self.result
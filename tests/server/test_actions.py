@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2007-2015, GoodData(R) Corporation. All rights reserved
+
+import multiprocessing
+import os
+import tempfile
+import time
+
+import pytest
+
+from smoker.server import actions
+
+
+def make_item(plugin, action, status='OK', uid='default'):
+    params = {
+        'Command': 'hostname',
+        'Module': None,
+        'Parser': None,
+        'uid': uid,
+        'gid': uid,
+        'Timeout': 30,
+        'Action': action,
+    }
+    result = {
+        'status': status,
+        'messages': {'info': [], 'warn': [], 'error': []},
+        'componentResults': None,
+        'action': None,
+    }
+    return {'plugin': plugin, 'params': params, 'result': result}
+
+
+class TestActionRunner(object):
+    """Unit tests for the ActionRunner class"""
+
+    def test_results_are_delivered_in_batch(self, tmp_path):
+        output = tmp_path / 'output'
+        action = {
+            'Command': 'cat >> %s' % output,
+            'Module': None,
+            'Timeout': 10,
+            'Async': True,
+            'BatchSize': 3,
+            'BatchWait': 60,
+            'BatchInput': '%(plugin)s %(status)s',
+        }
+        runner = actions.ActionRunner(multiprocessing.Queue())
+        runner.add(make_item('Uname', action))
+        runner.add(make_item('Hostname', action, status='ERROR'))
+        runner.deliver_due()
+        # Batch is not full yet
+        assert not output.exists()
+
+        runner.add(make_item('Uptime', action))
+        runner.deliver_due()
+        assert output.read_text() == 'Uname OK\nHostname ERROR\nUptime OK\n'
+        assert not runner.pending
+
+    def test_failed_delivery_is_retried_with_backoff(self):
+        action = {
+            'Command': 'false',
+            'Module': None,
+            'Timeout': 10,
+            'Async': True,
+            'BatchInput': '%(plugin)s',
+            'Retries': 2,
+            'RetryDelay': 10,
+        }
+        runner = actions.ActionRunner(multiprocessing.Queue())
+        runner.add(make_item('Uname', action))
+        runner.deliver_due()
+
+        batch = runner.retries[0]
+        assert batch.attempt == 1
+        assert 9 < batch.next_try - time.time() <= 10
+
+        batch.next_try = 0
+        runner.deliver_due()
+        assert batch.attempt == 2
+        assert 19 < batch.next_try - time.time() <= 20
+
+        # Dropped after all retries
+        batch.next_try = 0
+        runner.deliver_due()
+        assert not runner.retries
+
+    def test_only_failed_results_are_retried(self):
+        action = {
+            'Command': 'test %(status)s = OK',
+            'Module': None,
+            'Timeout': 10,
+            'Async': True,
+            'BatchSize': 3,
+            'Retries': 2,
+        }
+        runner = actions.ActionRunner(multiprocessing.Queue())
+        runner.add(make_item('Uname', action))
+        runner.add(make_item('Hostname', action, status='ERROR'))
+        runner.add(make_item('Uptime', action))
+        runner.deliver_due()
+
+        batch = runner.retries[0]
+        assert [item['plugin'] for item in batch.items] == ['Hostname']
+        assert batch.attempt == 1
+
+    def test_results_are_batched_by_uid(self):
+        action = {'Command': 'true', 'Module': None, 'Timeout': 10, 'BatchSize': 10}
+        runner = actions.ActionRunner(multiprocessing.Queue())
+        runner.add(make_item('Uname', action))
+        runner.add(make_item('Hostname', action, uid=65534))
+        runner.add(make_item('Uptime', action, uid=65534))
+        assert sorted(len(b.items) for b in runner.pending.values()) == [1, 2]
+
+    @pytest.mark.skipif(os.geteuid() != 0, reason='Requires root')
+    def test_action_is_executed_with_uid_of_plugin(self):
+        directory = tempfile.mkdtemp()
+        os.chmod(directory, 0o777)
+        output = os.path.join(directory, 'output')
+        action = {
+            'Command': 'id -u > %s' % output,
+            'Module': None,
+            'Timeout': 10,
+            'BatchInput': '%(plugin)s',
+        }
+        runner = actions.ActionRunner(multiprocessing.Queue())
+        runner.add(make_item('Uname', action, uid=65534))
+        runner.deliver_due()
+
+        with open(output) as fp:
+            assert fp.read() == '65534\n'
+        assert not runner.retries
+        # Runner itself keeps it's privileges
+        assert os.geteuid() == 0
+        os.unlink(output)
+        os.rmdir(directory)
+
+    def test_runner_stops_and_flushes_queue(self, tmp_path):
+        output = tmp_path / 'output'
+        action = {
+            'Command': 'cat >> %s' % output,
+            'Module': None,
+            'Timeout': 10,
+            'Async': True,
+            'BatchSize': 10,
+            'BatchWait': 60,
+            'BatchInput': '%(plugin)s',
+        }
+        queue = multiprocessing.Queue()
+        runner = actions.ActionRunner(queue)
+        runner.start()
+        queue.put(make_item('Uname', action))
+        queue.put(actions.STOP)
+        runner.join(10)
+
+        assert not runner.is_alive()
+        assert output.read_text() == 'Uname\n'
@@ -5,12 +5,15 @@
 import os
 import shutil
 import socket
+import threading
 
 import mock
 import pytest
+from flask import Flask
 
 import smoker.client as smoker_client
 from smoker.client import cli as smoker_cli
+from smoker.server import httpserver
 from tests.server.smoker_test_resources import client_mock_result
 from tests.server.smoker_test_resources.client_mock_result import (
     TMP_DIR,
@@ -42,6 +45,23 @@ class TestHost(object):
         assert host.links == client_mock_result.links
         assert host.name == client_mock_result.about_response['about']['host']
 
+    def test_unix_socket_address(self, tmp_path):
+        path = str(tmp_path / 'smokerd.sock')
+        app = Flask(__name__)
+        app.route('/')(lambda: client_mock_result.about_response)
+        server = httpserver.make_server('unix://%s' % path, 0, app)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        host = smoker_client.Host('unix://%s' % path)
+        assert host.url == 'http://localhost'
+        try:
+            assert host.load_about() == client_mock_result.about_response
+        finally:
+            server.shutdown()
+        assert host.links == client_mock_result.links
+
     @mock.patch('urllib.request.urlopen', rest_api_response)
     def test_result_will_be_cleared_after_getting(self):
         # Mock: http://${hostname}:8089/  load_about
@@ -257,6 +277,31 @@ class TestClient(object):
         result = smoker_cli.plugins_to_xml(plugins)
         assert result == expected
 
+    @mock.patch('urllib.request.urlopen', rest_api_response)
+    def test_plugins_to_xml_with_run_time(self):
+        cli = smoker_client.Client(['%s:8086' % self.hostname])
+        plugins = cli.get_plugins(filters=list())
+        host = list(plugins.keys())[0]
+        plugins[host]['plugins']['Uname']['lastResult']['timing'] = {
+            'execStarted': 100.0, 'execFinished': 101.0, 'finished': 101.5}
+
+        result = smoker_cli.plugins_to_xml(plugins)
+        assert result.count(' time="1.500"') == 1
+        assert result.count('<testcase ') == 3
+
+    def test_format_timing(self):
+        timing = {
+            'scheduled': 100.0, 'spawned': 102.0, 'started': 102.5,
+            'semaphoreAcquired': 102.5, 'execStarted': 102.5,
+            'execFinished': 103.0, 'parseFinished': 103.25,
+            'finished': 103.5, 'enqueued': 103.5, 'collected': 104.0,
+        }
+        assert smoker_cli.format_timing(timing) == (
+            'run 1.000s (lag 2.000s, spawn 0.500s, semaphore 0.000s, '
+            'exec 0.500s, parse 0.250s, queue 0.500s)')
+        assert smoker_cli.format_timing({'enqueued': 1.0, 'collected': 2.0}) == \
+            'queue 1.000s'
+
 
 class TestCleanUp(object):
     """Clean up all temporary files used by Mock"""
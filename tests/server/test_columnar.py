@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2007-2015, GoodData(R) Corporation. All rights reserved
+
+import csv
+import datetime
+import io
+import socket
+
+import mock
+import pytest
+
+import smoker.client as smoker_client
+from smoker.client import cli as smoker_cli
+from smoker.server import restserver
+from smoker.util import columnar
+from tests.server.smoker_test_resources.client_mock_result import \
+    rest_api_response
+
+
+def make_plugin(components=None):
+    return {
+        'name': 'Uname',
+        'parameters': {'Category': 'system', 'Interval': 1},
+        'nextRun': '2016-05-31T15:31:35.191518',
+        'lastResult': {
+            'status': 'WARN',
+            'lastRun': '2016-05-31T15:32:53.187552',
+            'forced': True,
+            'messages': {'info': [], 'warn': ['first', 'second'], 'error': []},
+            'componentResults': components,
+            'action': None,
+        },
+    }
+
+
+class TestColumnar(object):
+    """Unit tests for the columnar export"""
+
+    def test_plugin_rows(self):
+        components = [
+            {'componentResult': {
+                'name': 'Kernel',
+                'status': 'OK',
+                'messages': {'info': ['Linux'], 'warn': [], 'error': []},
+            }},
+        ]
+        rows = columnar.plugin_rows('host1', make_plugin(components))
+        assert [(r['component'], r['status']) for r in rows] == [
+            ('', 'WARN'), ('Kernel', 'OK')]
+        assert all(sorted(row) == sorted(columnar.COLUMNS) for row in rows)
+        assert rows[0]['warn'] == 'first\nsecond'
+        assert rows[1]['info'] == 'Linux'
+        assert rows[1]['lastRun'] == datetime.datetime(2016, 5, 31, 15, 32, 53)
+        assert rows[1]['category'] == 'system'
+        assert rows[1]['host'] == 'host1'
+
+    def test_rows_of_plugin_without_result(self):
+        plugin = make_plugin()
+        plugin['lastResult'] = None
+        plugin['nextRun'] = None
+        rows = columnar.plugin_rows('host1', plugin)
+        assert len(rows) == 1
+        assert rows[0]['status'] == 'UNKNOWN'
+        assert rows[0]['lastRun'] is None
+
+    def test_csv_writer(self):
+        fh = io.StringIO()
+        with columnar.open_writer('csv', fh) as writer:
+            writer.write(columnar.plugin_rows('host1', make_plugin()))
+            writer.write(columnar.plugin_rows('host2', make_plugin()))
+
+        rows = list(csv.DictReader(io.StringIO(fh.getvalue())))
+        assert [row['host'] for row in rows] == ['host1', 'host2']
+        assert rows[0]['lastRun'] == '2016-05-31T15:32:53'
+        assert rows[0]['warn'] == 'first\nsecond'
+
+    def test_unknown_format(self):
+        with pytest.raises(ValueError):
+            columnar.open_writer('xls', io.StringIO())
+
+    def test_arrow_writer(self, tmp_path):
+        path = str(tmp_path / 'export.arrow')
+        try:
+            import pyarrow.ipc
+        except ImportError:
+            with pytest.raises(ValueError):
+                columnar.open_writer('arrow', path)
+            return
+
+        with columnar.open_writer('arrow', path) as writer:
+            writer.write(columnar.plugin_rows('host1', make_plugin()))
+        table = pyarrow.ipc.open_file(path).read_all()
+        assert table.column_names == list(columnar.COLUMNS)
+        assert table.num_rows == 1
+
+
+class TestColumnarExport(object):
+    """Unit tests for the export by client and REST API"""
+
+    hostname = socket.gethostname()
+    config = {
+        'plugins': {
+            'Hostname': {'Command': 'hostname'},
+        },
+        'templates': {
+            'BasePlugin': {'Interval': 0, 'Timeout': 30, 'History': 3},
+        },
+        'actions': dict(),
+    }
+
+    @mock.patch('urllib.request.urlopen', rest_api_response)
+    def test_client_export(self, tmp_path, monkeypatch):
+        # Hosts are shared by all Client instances
+        monkeypatch.setattr(smoker_client.Client, 'hosts', [])
+        path = str(tmp_path / 'export.csv')
+        cli = smoker_client.Client(['%s:8086' % self.hostname])
+        results = cli.iter_plugins(filters=list())
+        assert smoker_cli.dump_columnar(results, 'csv', path) == 3
+
+        with open(path) as fh:
+            rows = list(csv.DictReader(fh))
+        assert sorted(row['plugin'] for row in rows) == [
+            'Hostname', 'Uname', 'Uptime']
+        assert set(row['host'] for row in rows) == {self.hostname}
+
+    def test_export_endpoint(self, make_client):
+        client = make_client(self.config)
+        plugin = restserver.smokerd.pluginmgr.get_plugin('Hostname')
+        plugin.forced = True
+        plugin.run()
+        plugin.current_run.join()
+
+        response = client.get('/export')
+        assert response.status_code == 200
+        assert response.headers['content-type'].startswith('text/csv')
+        rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+        assert len(rows) == 1
+        assert rows[0]['plugin'] == 'Hostname'
+        assert rows[0]['status'] == 'OK'
+        assert rows[0]['info'] == socket.gethostname()
+
+        assert client.get('/export?format=xls').status_code == 400
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2007-2015, GoodData(R) Corporation. All rights reserved
+
+import gzip
+import json
+
+import pytest
+
+from smoker.util import encoding
+
+
+class TestEncoding(object):
+    """Unit tests for JSON encoders and compression"""
+
+    data = {'plugins': {'items': [{'name': u'Uname', 'path': '/plugins/ž',
+                                   'count': 3, 'lastRun': None}]}}
+
+    @pytest.mark.parametrize('name', encoding.ENCODER_NAMES)
+    def test_encoders(self, name):
+        try:
+            dumps = encoding.get_encoder(name)
+        except ValueError:
+            pytest.skip('%s is not installed' % name)
+
+        compact = dumps(self.data)
+        assert isinstance(compact, bytes)
+        assert json.loads(compact) == self.data
+        assert b'\n' not in compact and b', ' not in compact
+
+        pretty = dumps(self.data, pretty=True)
+        assert json.loads(pretty) == self.data
+        assert b'\n  "plugins"' in pretty
+
+        with pytest.raises(TypeError):
+            dumps({'value': object()})
+        assert json.loads(dumps({'value': object()}, default=str))['value']
+
+    def test_unknown_encoder(self):
+        assert encoding.get_encoder('auto')
+        with pytest.raises(ValueError):
+            encoding.get_encoder('marshal')
+
+    def test_choose_encoding(self):
+        assert encoding.choose_encoding('gzip, deflate') == 'gzip'
+        assert encoding.choose_encoding('deflate, GZIP;q=0.5') == 'gzip'
+        assert encoding.choose_encoding('gzip;q=0') is None
+        assert encoding.choose_encoding('') is None
+        assert encoding.choose_encoding(None) is None
+
+    def test_compression(self):
+        data = b'x' * 10000
+        for coding in encoding.available_encodings():
+            compressed = encoding.compress(data, coding)
+            assert len(compressed) < len(data)
+            assert encoding.decompress(compressed, coding) == data
+        assert encoding.decompress(data, None) == data
+        with pytest.raises(ValueError):
+            encoding.decompress(data, 'br')
+
+    def test_loads(self, monkeypatch):
+        assert encoding.loads(b'{"a":1}') == {'a': 1}
+        assert encoding.loads(b'{"a":1}', 'application/json; charset=utf-8') == {'a': 1}
+        monkeypatch.setattr(encoding, 'msgpack', None)
+        with pytest.raises(ValueError):
+            encoding.loads(b'\x81', encoding.MSGPACK_MIMETYPE)
+
+    def test_msgpack(self):
+        pytest.importorskip('msgpack')
+        data = encoding.dumps_msgpack(self.data)
+        assert encoding.loads(data, encoding.MSGPACK_MIMETYPE) == self.data
+        assert len(data) < len(encoding.get_encoder('json')(self.data))
+
+
+class TestEncodingAPI(object):
+    """Unit tests for encoding of the REST API responses"""
+
+    config = {
+        'plugins': {'Plugin%d' % n: {'Command': 'hostname'} for n in range(20)},
+        'templates': {'BasePlugin': {'Interval': 0, 'Timeout': 30, 'History': 3}},
+        'actions': dict(),
+    }
+
+    def test_compact_and_pretty_output(self, make_client):
+        client = make_client(self.config)
+        compact = client.get('/plugins')
+        assert compact.headers['Content-Type'] == 'application/json'
+        assert b'\n' not in compact.get_data().strip()
+
+        pretty = client.get('/plugins?pretty=1')
+        assert pretty.get_data().count(b'\n') > 20
+        assert pretty.get_json() == compact.get_json()
+
+    def test_compressed_response(self, make_client):
+        client = make_client(self.config)
+        plain = client.get('/plugins')
+        assert 'Content-Encoding' not in plain.headers
+        assert 'Accept-Encoding' in plain.headers['Vary']
+
+        response = client.get('/plugins', headers={'Accept-Encoding': 'gzip'})
+        assert response.headers['Content-Encoding'] == 'gzip'
+        data = response.get_data()
+        assert int(response.headers['Content-Length']) == len(data)
+        assert len(data) < len(plain.get_data())
+        assert gzip.decompress(data) == plain.get_data()
+
+        # Short responses are not compressed
+        response = client.get('/processes', headers={'Accept-Encoding': 'gzip'})
+        assert 'Content-Encoding' not in response.headers
+
+    def test_compression_disabled(self, make_client):
+        client = make_client(self.config, {'api_compression': False,
+                                           'api_json_encoder': 'json'})
+        response = client.get('/plugins', headers={'Accept-Encoding': 'gzip'})
+        assert 'Content-Encoding' not in response.headers
+        assert response.get_json()['plugins']['items']
+
+    def test_msgpack_representation(self, make_client):
+        pytest.importorskip('msgpack')
+        client = make_client(self.config)
+        accept = {'Accept': encoding.ACCEPT}
+        json_response = client.get('/plugins')
+        response = client.get('/plugins', headers=accept)
+        assert response.headers['Content-Type'] == encoding.MSGPACK_MIMETYPE
+        assert 'Accept' in response.headers['Vary']
+        assert encoding.loads(response.get_data(), encoding.MSGPACK_MIMETYPE) == \
+            json_response.get_json()
+
+        # Errors and responses created by hand are negotiated too
+        response = client.get('/plugins/Invalid', headers=accept)
+        assert response.status_code == 404
+        assert response.headers['Content-Type'] == encoding.MSGPACK_MIMETYPE
+        response = client.post('/processes', json={'process': {'plugins': ['Plugin1']}})
+        poll = response.get_json()['asyncTask']['link']['poll']
+        response = client.get(poll, headers=accept)
+        assert response.status_code == 202
+        assert response.headers['Content-Type'] == encoding.MSGPACK_MIMETYPE
@@ -0,0 +1,496 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2007-2015, GoodData(R) Corporation. All rights reserved
+
+import copy
+import datetime
+import pickle
+import threading
+import time
+
+import pytest
+
+import smoker.server.plugins as server_plugins
+from smoker.server import restserver
+from smoker.server.exceptions import InvalidConfiguration
+from smoker.server.history import (EMPTY_MESSAGES, ChangeFeed, HistoryStore,
+                                   ResultHistory, ResultRecord, downsample)
+
+
+def make_result(status='OK', info='GoodData', forced=False, last_run=None):
+    if not last_run:
+        last_run = datetime.datetime.now()
+    return {
+        'status': status,
+        'messages': {'info': [info], 'warn': [], 'error': []},
+        'lastRun': last_run.isoformat(),
+        'componentResults': None,
+        'action': None,
+        'forced': forced,
+        'resources': None,
+    }
+
+
+class TestResultRecord(object):
+    """Unit tests for the ResultRecord class"""
+
+    def test_record_is_converted_back_to_same_result(self):
+        result = make_result(status='WARN', info='GoodData')
+        result['messages']['warn'] = ['first', 'second']
+        result['componentResults'] = {
+            'Unit tests': {
+                'status': 'OK',
+                'messages': {'info': ['passed'], 'warn': [], 'error': []},
+            },
+        }
+        result['action'] = make_result()
+        result['resources'] = {'privateMemory': 1024}
+        result['custom'] = 'value'
+
+        record = ResultRecord.from_dict(copy.deepcopy(result))
+        assert isinstance(record.last_run, float)
+        assert isinstance(record.action, ResultRecord)
+        assert record.to_dict() == result
+        assert ResultRecord.from_dict(record.to_dict()) == record
+
+    def test_records_share_statuses_and_messages(self):
+        result = make_result(info='hostname')
+        result['componentResults'] = {
+            'Unit tests': {
+                'status': 'OK',
+                'messages': {'info': [], 'warn': [], 'error': []},
+            },
+        }
+        # Results from the queue don't share any objects
+        first = ResultRecord.from_dict(pickle.loads(pickle.dumps(result)))
+        second = ResultRecord.from_dict(pickle.loads(pickle.dumps(result)))
+
+        assert first.status is second.status
+        assert first.messages[0][0] is second.messages[0][0]
+        assert first.components[0][2] is EMPTY_MESSAGES
+        assert ResultRecord.from_dict(make_result()).to_dict()['messages'] == {
+            'info': ['GoodData'], 'error': [], 'warn': []}
+
+
+class TestResultHistory(object):
+    """Unit tests for the ResultHistory class"""
+
+    def test_identical_results_are_merged(self):
+        history = ResultHistory(10)
+        start = datetime.datetime(2020, 1, 1)
+        statuses = ['OK', 'OK', 'OK', 'ERROR', 'OK', 'OK']
+        for n, status in enumerate(statuses):
+            result = make_result(status, last_run=start + datetime.timedelta(minutes=n))
+            result['resources'] = {'privateMemory': n}
+            history.append(ResultRecord.from_dict(result))
+
+        assert [(e.record.status, e.count) for e in history] == [
+            ('OK', 3), ('ERROR', 1), ('OK', 2)]
+        assert history[0].first_run == start.timestamp()
+        assert history.last().status == 'OK'
+
+        # Entries are expanded back to the results
+        results = history[0].to_dicts()
+        assert [r['lastRun'] for r in results] == [
+            (start + datetime.timedelta(minutes=n)).isoformat() for n in range(3)]
+        assert [r['resources'] for r in results] == [
+            None, None, {'privateMemory': 2}]
+        assert all(r['messages'] == results[-1]['messages'] for r in results)
+
+    def test_results_with_different_action_time_are_merged(self):
+        history = ResultHistory(10)
+        start = datetime.datetime(2020, 1, 1)
+        for n in range(3):
+            last_run = start + datetime.timedelta(minutes=n)
+            result = make_result(last_run=last_run)
+            result['action'] = make_result(info='Sent', last_run=last_run)
+            history.append(ResultRecord.from_dict(result))
+
+        assert len(history.entries) == 1
+        assert history[0].count == 3
+
+    def test_history_is_limited_by_results(self):
+        history = ResultHistory(3)
+        for n in range(5):
+            history.append(ResultRecord.from_dict(make_result(info=str(n))))
+            history.append(ResultRecord.from_dict(make_result(info=str(n))))
+
+        assert len(history) == 3
+        assert [(e.record.messages[0], e.count) for e in history] == [
+            (('3',), 1), (('4',), 2)]
+
+    def test_identical_results_are_limited(self):
+        history = ResultHistory(3)
+        start = datetime.datetime(2020, 1, 1)
+        for n in range(1000):
+            last_run = start + datetime.timedelta(minutes=n)
+            history.append(ResultRecord.from_dict(make_result(last_run=last_run)))
+
+        assert len(history) == 3
+        assert history[0].count == 3
+        assert [r['lastRun'] for r in history[0].to_dicts()] == [
+            (start + datetime.timedelta(minutes=n)).isoformat()
+            for n in range(997, 1000)]
+
+
+class TestHistoryStore(object):
+    """Unit tests for the HistoryStore class"""
+
+    def test_append_and_load_last_results(self, tmp_path):
+        store = HistoryStore(str(tmp_path / 'history.db'))
+        for n in range(5):
+            assert store.append('Uname', make_result(info=str(n)))
+        store.append('Hostname', make_result())
+
+        results = store.last('Uname', 3)
+        assert [r['messages']['info'] for r in results] == [['2'], ['3'], ['4']]
+        assert len(store.last('Hostname', 10)) == 1
+        assert store.last('InvalidPlugin', 10) == []
+
+    def test_compact_keeps_limited_number_of_results(self, tmp_path):
+        store = HistoryStore(str(tmp_path / 'history.db'), keep=2)
+        for n in range(5):
+            store.append('Uname', make_result(info=str(n)))
+        store.compact()
+
+        results = store.last('Uname', 10)
+        assert [r['messages']['info'] for r in results] == [['3'], ['4']]
+
+    def test_compact_removes_old_results(self, tmp_path):
+        store = HistoryStore(str(tmp_path / 'history.db'), retention=3600)
+        old = datetime.datetime.now() - datetime.timedelta(hours=2)
+        store.append('Uname', make_result(info='old', last_run=old))
+        store.append('Uname', make_result(info='new'))
+        store.compact()
+
+        results = store.last('Uname', 10)
+        assert [r['messages']['info'] for r in results] == [['new']]
+
+
+    def test_query_results_in_time_range(self, tmp_path):
+        store = HistoryStore(str(tmp_path / 'history.db'))
+        start = datetime.datetime(2020, 1, 1)
+        for n in range(10):
+            last_run = start + datetime.timedelta(minutes=n)
+            store.append('Uname', make_result(info=str(n), last_run=last_run))
+
+        since = (start + datetime.timedelta(minutes=2)).timestamp()
+        until = (start + datetime.timedelta(minutes=8)).timestamp()
+        rows = store.query('Uname', since, until, limit=3)
+        assert [r['messages']['info'] for _, _, r in rows] == [['2'], ['3'], ['4']]
+        assert [id for id, _, _ in rows] == [r['seq'] for _, _, r in rows]
+
+        rows = store.query('Uname', since, until, after=rows[-1][0])
+        assert [r['messages']['info'] for _, _, r in rows] == [['5'], ['6'], ['7']]
+
+        rows = store.query('Uname', until=since, statuses=True)
+        assert [status for _, _, status in rows] == ['OK', 'OK']
+
+    def test_processes(self, tmp_path):
+        store = HistoryStore(str(tmp_path / 'history.db'))
+        store.append('Uname', make_result())
+        id = store.add_process(['Uname', 'Hostname'], time.time())
+        process = store.get_process(id)
+        assert process['plugins'] == ['Uname', 'Hostname']
+        assert process['seq'] == 1
+        assert not process['finished']
+
+        store.append('Uname', make_result(forced=True))
+        assert store.forced_plugins(['Uname', 'Hostname'], process['seq']) == {'Uname'}
+
+        store.finish_process(id, time.time() - 7200)
+        assert store.get_process(id)['finished']
+        second = store.add_process(['Uname'], time.time())
+        assert [p['id'] for p in store.list_processes(after=id)] == [second]
+
+        store.compact_processes(ttl=3600)
+        assert store.get_process(id) is None
+        assert store.get_process(second)
+
+    def test_compact_is_not_run_on_append(self, tmp_path):
+        store = HistoryStore(str(tmp_path / 'history.db'), keep=1, compact_interval=0)
+        for n in range(3):
+            store.append('Uname', make_result(info=str(n)))
+        assert len(store.last('Uname', 10)) == 3
+
+        store.maybe_compact()
+        assert len(store.last('Uname', 10)) == 1
+
+    def test_processes_survive_store_errors(self, tmp_path):
+        store = HistoryStore(str(tmp_path / 'history.db'))
+        store.add_process(['Uname'], time.time())
+        store.connection.execute('DROP TABLE processes')
+        store.connection.execute('CREATE TABLE processes (id INTEGER PRIMARY KEY)')
+
+        assert store.add_process(['Uname'], time.time()) is None
+        assert store.list_processes() == []
+        assert store.get_process(1) is None
+        store.finish_process(1, time.time())
+        store.compact_processes(ttl=3600, max=10)
+
+        store.connection.execute('DROP TABLE results')
+        store.connection.execute('CREATE TABLE results (id INTEGER PRIMARY KEY)')
+        assert store.forced_plugins(['Uname'], 0) == set()
+
+    def test_downsample_worst_status_wins(self):
+        rows = [(0, 'OK'), (10, 'ERROR'), (20, 'WARN'),
+                (60, 'OK'), (70, 'WARN'), (130, 'OK')]
+        buckets = downsample(rows, 60)
+        assert [(b['start'], b['status'], b['count']) for b in buckets] == [
+            (0, 'ERROR', 3), (60, 'WARN', 2), (120, 'OK', 1)]
+        assert len(downsample(rows, 60, limit=2)) == 2
+
+
+class TestChangeFeed(object):
+    """Unit tests for the ChangeFeed class"""
+
+    def test_changes_in_memory(self):
+        feed = ChangeFeed(maxlen=3)
+        for n in range(5):
+            record = ResultRecord.from_dict(make_result(info=str(n)))
+            assert feed.append('Uname', record) == n + 1
+
+        reset, changes = feed.since(3)
+        assert not reset
+        assert [(seq, result['messages']['info']) for seq, _, result in changes] == [
+            (4, ['3']), (5, ['4'])]
+
+        # Results after 1 are not available anymore
+        reset, changes = feed.since(1)
+        assert reset
+        assert [seq for seq, _, _ in changes] == [3, 4, 5]
+        # Unknown sequence number (eg. before restart)
+        assert feed.since(10)[0]
+
+    def test_changes_are_tagged_by_history_store_id(self, tmp_path):
+        path = str(tmp_path / 'history.db')
+        store = HistoryStore(path)
+        feed = ChangeFeed(store)
+        for n in range(3):
+            result = make_result(info=str(n))
+            id = store.append('Uname', result)
+            assert feed.append('Uname', ResultRecord.from_dict(result), id) == id
+
+        reset, changes = feed.since(1, limit=1)
+        assert not reset
+        assert [(seq, plugin) for seq, plugin, _ in changes] == [(2, 'Uname')]
+        assert changes[0][2]['seq'] == 2
+
+        # Sequence continues after restart
+        feed = ChangeFeed(HistoryStore(path))
+        feed.restore()
+        assert feed.last_seq == 3
+        assert feed.epoch == store.epoch
+
+    def test_failed_store_write_is_not_in_feed(self, tmp_path):
+        store = HistoryStore(str(tmp_path / 'history.db'))
+        feed = ChangeFeed(store)
+        record = ResultRecord.from_dict(make_result())
+        assert feed.append('Uname', record, store.append('Uname', make_result())) == 1
+        assert feed.append('Uname', record, None) is None
+        assert feed.last_seq == 1
+        assert feed.append('Uname', record, store.append('Uname', make_result())) == 2
+
+    def test_first_seq_after_compaction(self, tmp_path):
+        store = HistoryStore(str(tmp_path / 'history.db'), keep=2)
+        feed = ChangeFeed(store)
+        for plugin in ('Hostname', 'Uname', 'Uname', 'Uname', 'Uname'):
+            result = make_result()
+            feed.append(plugin, ResultRecord.from_dict(result),
+                        store.append(plugin, result))
+        assert feed.first_seq() == 1
+        assert not feed.since(1)[0]
+
+        # Results of Hostname are kept, but the first results of Uname are not
+        store.compact()
+        assert [seq for seq, _, _ in feed.since(0)[1]] == [1, 4, 5]
+        assert feed.first_seq() == 4
+        assert feed.since(1)[0]
+        assert not feed.since(3)[0]
+
+    def test_wait_for_change(self):
+        feed = ChangeFeed()
+        assert not feed.wait(0, 0.1)
+
+        record = ResultRecord.from_dict(make_result())
+        timer = threading.Timer(0.2, feed.append, ('Uname', record))
+        timer.start()
+        assert feed.wait(0, 5)
+        timer.join()
+
+
+class TestPluginManagerHistory(object):
+    """Unit tests for persisting results of the PluginManager"""
+
+    config = {
+        'plugins': {
+            'Hostname': {'Command': 'hostname'},
+        },
+        'templates': {
+            'BasePlugin': {'Interval': 0, 'Timeout': 30, 'History': 3},
+        },
+        'actions': dict(),
+    }
+
+    def test_results_are_restored(self, tmp_path):
+        path = str(tmp_path / 'history.db')
+        pluginmgr = server_plugins.PluginManager(
+            history=HistoryStore(path), **copy.deepcopy(self.config))
+        plugin = pluginmgr.get_plugin('Hostname')
+        for n in range(4):
+            plugin.forced = True
+            plugin.run()
+            time.sleep(0.5)
+            pluginmgr.collect_results()
+        expected = plugin.get_last_result()
+        assert len(HistoryStore(path).last('Hostname', 10)) == 4
+
+        # New daemon serves last known results right away
+        pluginmgr = server_plugins.PluginManager(
+            history=HistoryStore(path), **copy.deepcopy(self.config))
+        assert not pluginmgr.get_plugin('Hostname').get_last_result()
+        pluginmgr.restore_results()
+        assert pluginmgr.get_plugin('Hostname').get_last_result() == expected
+        # History of last results is restored, same results are merged
+        assert pluginmgr.get_plugin('Hostname').result[-1].count == 3
+
+    def test_results_are_shared(self, tmp_path):
+        path = str(tmp_path / 'history.db')
+        collector = server_plugins.PluginManager(
+            history=HistoryStore(path), shared=True, **copy.deepcopy(self.config))
+        follower = server_plugins.PluginManager(
+            history=HistoryStore(path), shared=True, **copy.deepcopy(self.config))
+        follower.follow_results()
+        # Queues are inherited from the daemon by all API processes
+        plugin = follower.get_plugin('Hostname')
+        plugin.queue = collector.get_plugin('Hostname').queue
+
+        id = follower.add_process(plugins=['Hostname'])
+        time.sleep(0.5)
+        assert not follower.get_process(id)['finished']
+
+        # Any API process collects the result and the process is finished
+        collector.collect_results()
+        time.sleep(server_plugins.SYNC_INTERVAL)
+        follower.collect_results()
+        assert follower.get_process(id)['finished']
+        assert collector.get_process(id)['finished']
+        assert plugin.get_last_result() == \
+            collector.get_plugin('Hostname').get_last_result()
+        assert plugin.current_run is None
+
+    def test_finished_shared_process_has_forced_result(self, tmp_path):
+        path = str(tmp_path / 'history.db')
+        collector = server_plugins.PluginManager(
+            history=HistoryStore(path), shared=True, **copy.deepcopy(self.config))
+        follower = server_plugins.PluginManager(
+            history=HistoryStore(path), shared=True, **copy.deepcopy(self.config))
+        follower.follow_results()
+        plugin = follower.get_plugin('Hostname')
+        plugin.queue = collector.get_plugin('Hostname').queue
+
+        id = follower.add_process(plugins=['Hostname'])
+        plugin.current_run.join()
+        collector.collect_results()
+
+        # Follower has just synced, but the result of finished process is loaded
+        follower.last_sync = time.time()
+        assert follower.get_process(id)['finished']
+        assert plugin.forced_result['lastRun'] == \
+            collector.get_plugin('Hostname').forced_result['lastRun']
+
+    def test_shared_processes_require_history(self):
+        with pytest.raises(InvalidConfiguration):
+            server_plugins.PluginManager(shared=True, **copy.deepcopy(self.config))
+
+
+class TestHistoryAPI(object):
+    """Unit tests for the plugin history REST API"""
+
+    config = TestPluginManagerHistory.config
+    start = datetime.datetime(2020, 1, 1)
+
+    @pytest.fixture(params=['store', 'memory'])
+    def client(self, request, tmp_path, make_client):
+        history = None
+        if request.param == 'store':
+            history = HistoryStore(str(tmp_path / 'history.db'))
+
+        config = copy.deepcopy(self.config)
+        config['templates']['BasePlugin']['History'] = 100
+        client = make_client(config, history=history)
+
+        plugin = restserver.smokerd.pluginmgr.get_plugin('Hostname')
+        for n in range(30):
+            last_run = self.start + datetime.timedelta(minutes=n)
+            status = 'ERROR' if n == 12 else 'OK'
+            plugin.add_result(make_result(status, str(n), last_run=last_run))
+
+        return client
+
+    def test_history_pagination(self, client):
+        since = (self.start + datetime.timedelta(minutes=5)).isoformat()
+        response = client.get('/plugins/Hostname/history?since=%s&limit=10' % since)
+        history = response.get_json()['history']
+        assert response.status_code == 200
+        assert [i['result']['messages']['info'] for i in history['items']] == [
+            [str(n)] for n in range(5, 15)]
+
+        response = client.get(history['links']['next'])
+        history = response.get_json()['history']
+        assert [i['result']['messages']['info'] for i in history['items']] == [
+            [str(n)] for n in range(15, 25)]
+
+        history = client.get(history['links']['next']).get_json()['history']
+        assert len(history['items']) == 5
+        assert 'next' not in history['links']
+
+    def test_history_pagination_of_results_with_same_time(self, client):
+        last_run = self.start + datetime.timedelta(hours=1)
+        plugin = restserver.smokerd.pluginmgr.get_plugin('Hostname')
+        for n in range(5):
+            plugin.add_result(make_result(last_run=last_run))
+
+        url = '/plugins/Hostname/history?since=%s&limit=2' % last_run.isoformat()
+        seqs = []
+        while url:
+            history = client.get(url).get_json()['history']
+            seqs.extend(i['result']['seq'] for i in history['items'])
+            url = history['links'].get('next')
+        assert len(seqs) == 5
+        assert seqs == sorted(set(seqs))
+
+    def test_history_downsampling(self, client):
+        response = client.get('/plugins/Hostname/history?step=600&limit=2')
+        history = response.get_json()['history']
+        buckets = [i['bucket'] for i in history['items']]
+        assert [(b['status'], b['count']) for b in buckets] == [
+            ('OK', 10), ('ERROR', 10)]
+        assert buckets[0]['start'] == self.start.isoformat()
+
+        history = client.get(history['links']['next']).get_json()['history']
+        assert [i['bucket']['status'] for i in history['items']] == ['OK']
+
+    def test_history_invalid_arguments(self, client):
+        assert client.get('/plugins/Hostname/history?limit=0').status_code == 400
+        assert client.get('/plugins/Hostname/history?step=-1').status_code == 400
+        assert client.get('/plugins/Hostname/history?since=x').status_code == 400
+        assert client.get('/plugins/Invalid/history').status_code == 404
+
+    def test_changes(self, client):
+        changes = client.get('/changes?limit=20').get_json()['changes']
+        assert not changes['reset']
+        assert changes['lastSeq'] == 30
+        assert changes['firstSeq'] == 1
+        assert [i['seq'] for i in changes['items']] == list(range(1, 21))
+        assert changes['items'][0]['plugin'] == 'Hostname'
+
+        changes = client.get(changes['links']['next']).get_json()['changes']
+        assert [i['seq'] for i in changes['items']] == list(range(21, 31))
+
+        # Nothing new, wait for change
+        start = time.time()
+        changes = client.get('/changes?since=30&wait=0.5').get_json()['changes']
+        assert changes['items'] == []
+        assert time.time() - start >= 0.5
+        assert changes['links']['next'] == '/changes?since=30'
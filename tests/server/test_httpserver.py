@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2007-2015, GoodData(R) Corporation. All rights reserved
+
+import http.client
+import os
+import socket
+import threading
+import time
+
+import pytest
+from flask import Flask
+
+import smoker.client as smoker_client
+from smoker.server import httpserver
+
+
+def make_app():
+    app = Flask(__name__)
+    app.active = 0
+    app.max_active = 0
+    lock = threading.Lock()
+
+    @app.route('/')
+    def index():
+        with lock:
+            app.active += 1
+            app.max_active = max(app.max_active, app.active)
+        time.sleep(0.1)
+        with lock:
+            app.active -= 1
+        return 'OK'
+
+    @app.route('/ignore', methods=['POST'])
+    def ignore():
+        return 'ignored'
+
+    return app
+
+
+class TestHTTPServer(object):
+    """Unit tests for the REST API HTTP servers"""
+
+    @pytest.fixture
+    def serve(self):
+        servers = []
+
+        def serve(app, host='127.0.0.1', **kwargs):
+            server = httpserver.make_server(host, 0, app, **kwargs)
+            thread = threading.Thread(target=server.serve_forever)
+            thread.daemon = True
+            thread.start()
+            servers.append(server)
+            return server
+
+        yield serve
+        for server in servers:
+            server.shutdown()
+
+    def request(self, server, count=1):
+        connection = http.client.HTTPConnection('127.0.0.1', server.port)
+        for _ in range(count):
+            connection.request('GET', '/')
+            response = connection.getresponse()
+            assert response.read() == b'OK'
+        return connection, response
+
+    @pytest.mark.parametrize('workers', [None, 4])
+    def test_keep_alive(self, serve, workers):
+        server = serve(make_app(), workers=workers)
+        connection, response = self.request(server, count=3)
+        assert response.version == 11
+        assert not response.will_close
+
+    def test_unread_body_is_skipped(self, serve):
+        server = serve(make_app())
+        connection = http.client.HTTPConnection('127.0.0.1', server.port)
+        connection.request('POST', '/ignore', body=b'x' * 100000)
+        assert connection.getresponse().read() == b'ignored'
+
+        connection.request('GET', '/')
+        assert connection.getresponse().read() == b'OK'
+
+    def test_keep_alive_disabled(self, serve):
+        server = serve(make_app(), keep_alive=False)
+        _, response = self.request(server)
+        assert response.will_close
+
+    def test_pool_limits_concurrency(self, serve):
+        app = make_app()
+        server = serve(app, workers=2, keep_alive=False)
+        threads = [threading.Thread(target=self.request, args=(server,))
+                   for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert app.max_active == 2
+
+    def test_busy_pool_does_not_accept_connections(self, serve):
+        app = make_app()
+        server = serve(app, workers=2, keep_alive=False)
+        threads = [threading.Thread(target=self.request, args=(server,))
+                   for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.05)
+        # Only the connection waiting for a free worker is accepted
+        assert server.executor._work_queue.qsize() == 0
+        assert server.waiting == 1
+        for thread in threads:
+            thread.join()
+        assert server.waiting == 0
+
+    def test_idle_connections_dont_block_pool(self, serve):
+        server = serve(make_app(), workers=2, timeout=5)
+        idle = [self.request(server)[0] for _ in range(2)]
+
+        start = time.time()
+        self.request(server)
+        # Idle connection is closed to serve the waiting one
+        assert time.time() - start < 1
+
+    def test_idle_connection_is_dropped(self, serve):
+        server = serve(make_app(), workers=1, timeout=0.2)
+        connection = socket.create_connection(('127.0.0.1', server.port))
+        connection.settimeout(5)
+        # Server closes the connection without any response
+        assert connection.recv(1024) == b''
+
+        # and the only worker is free for other clients
+        self.request(server)
+
+    def test_backlog(self, serve):
+        server = serve(make_app(), backlog=512)
+        assert server.request_queue_size == 512
+
+    def test_reuse_port(self, serve):
+        server = serve(make_app(), reuse_port=True)
+        other = httpserver.make_server(
+            '127.0.0.1', server.port, make_app(), reuse_port=True)
+        other.server_close()
+        self.request(server)
+
+    def test_unix_socket(self, serve, tmp_path):
+        path = str(tmp_path / 'smokerd.sock')
+        serve(make_app(), host='unix://%s' % path)
+        connection = smoker_client.UnixHTTPConnection(path, 'localhost')
+        connection.request('GET', '/')
+        assert connection.getresponse().read() == b'OK'
+        assert os.stat(path).st_mode & 0o777 == httpserver.SOCKET_MODE
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2007-2015, GoodData(R) Corporation. All rights reserved
+
+import copy
+import time
+
+import psutil
+
+import smoker.server.plugins as server_plugins
+from smoker.server import metrics, restserver
+
+
+class TestMetrics(object):
+    """Unit tests for the metrics registry"""
+
+    def test_exposition(self):
+        registry = metrics.Registry()
+        counter = registry.register(metrics.Counter(
+            'runs_total', 'Runs', ('plugin', 'status')))
+        histogram = registry.register(metrics.Histogram(
+            'duration_seconds', 'Duration', ('plugin',), buckets=(0.1, 1)))
+
+        counter.inc(plugin='Uname', status='OK')
+        counter.inc(2, plugin='Say "hi"\n', status='OK')
+        for value in (0.05, 0.5, 5):
+            histogram.observe(value, plugin='Uname')
+
+        lines = registry.expose().splitlines()
+        assert lines[:3] == [
+            '# HELP runs_total Runs',
+            '# TYPE runs_total counter',
+            'runs_total{plugin="Say \\"hi\\"\\n",status="OK"} 2',
+        ]
+        assert 'runs_total{plugin="Uname",status="OK"} 1' in lines
+        assert lines[-5:] == [
+            'duration_seconds_bucket{plugin="Uname",le="0.1"} 1',
+            'duration_seconds_bucket{plugin="Uname",le="1"} 2',
+            'duration_seconds_bucket{plugin="Uname",le="+Inf"} 3',
+            'duration_seconds_sum{plugin="Uname"} 5.55',
+            'duration_seconds_count{plugin="Uname"} 3',
+        ]
+
+    def test_observe_result(self):
+        runs = metrics.RUNS.get(plugin='Timing', status='ERROR', forced='true')
+        now = time.time()
+        metrics.observe_result('Timing', {
+            'status': 'ERROR',
+            'forced': True,
+            'timing': {
+                'scheduled': now - 3,
+                'spawned': now - 2,
+                'started': now - 1.5,
+                'semaphoreAcquired': now - 1,
+                'finished': now,
+                'timedOut': True,
+            },
+        })
+        assert metrics.RUNS.get(plugin='Timing', status='ERROR', forced='true') == runs + 1
+        assert metrics.TIMEOUTS.get(plugin='Timing') == 1
+        assert metrics.SCHEDULE_LAG.get(plugin='Timing') == (1, 1)
+        assert metrics.SEMAPHORE_WAIT.get(plugin='Timing') == (1, 0.5)
+        assert metrics.DURATION.get(plugin='Timing', status='ERROR') == (1, 1)
+        assert metrics.ACTION_DURATION.get(plugin='Timing') == (0, 0)
+
+        # Results are not encoded just to measure their size
+        metrics.observe_result('Size', {'status': 'OK'})
+        assert metrics.RESULT_SIZE.get(plugin='Size') == (0, 0)
+        metrics.observe_result('Size', {'status': 'OK'}, 100)
+        assert metrics.RESULT_SIZE.get(plugin='Size') == (1, 100)
+
+    def test_cpu_time(self):
+        resources = {
+            'privateMemory': 1024,
+            'worker': {'userTime': 0.5, 'systemTime': 0.25},
+            'children': {'userTime': 1.0, 'systemTime': 0.5},
+        }
+        assert metrics.cpu_time(resources) == 2.25
+        assert metrics.cpu_time(resources, 'children') == 1.5
+        assert metrics.cpu_time({'privateMemory': 1024}) == 0
+        assert metrics.cpu_time(None) == 0
+
+        metrics.observe_result('Cpu', {'status': 'OK', 'resources': resources})
+        assert metrics.CPU_TIME.get(plugin='Cpu', process='worker') == 0.75
+        assert metrics.CPU_TIME.get(plugin='Cpu', process='children') == 1.5
+
+
+class TestPluginMetrics(object):
+    """Unit tests for metrics of plugin runs"""
+
+    config = {
+        'plugins': {'Metrics': {'Command': 'hostname'}},
+        'templates': {'BasePlugin': {'Interval': 0, 'Timeout': 30, 'History': 3}},
+        'actions': dict(),
+    }
+
+    def test_run_is_measured(self, make_client):
+        client = make_client(self.config)
+        smokerd = restserver.smokerd
+        duration = metrics.DURATION.get(plugin='Metrics', status='OK')[0]
+
+        plugin = smokerd.pluginmgr.get_plugin('Metrics')
+        plugin.forced = True
+        plugin.run()
+        time.sleep(0.5)
+        plugin.collect_new_result()
+
+        timing = plugin.get_last_result()['timing']
+        assert timing['scheduled'] <= timing['spawned'] <= timing['started'] \
+            <= timing['semaphoreAcquired'] <= timing['execStarted'] \
+            <= timing['execFinished'] <= timing['parseFinished'] \
+            <= timing['finished'] <= timing['enqueued'] <= timing['collected']
+        assert metrics.DURATION.get(plugin='Metrics', status='OK')[0] == duration + 1
+
+        response = client.get('/metrics')
+        assert response.status_code == 200
+        assert response.headers['Content-Type'] == metrics.CONTENT_TYPE
+        text = response.get_data(as_text=True)
+        assert 'smokerd_plugin_runs_total{plugin="Metrics",status="OK",forced="true"}' in text
+        assert 'smokerd_plugin_spawn_latency_seconds_count{plugin="Metrics"}' in text
+        assert 'smokerd_open_fds{process="api"}' in text
+        assert 'smokerd_forced_runs_queued 0' in text
+        assert 'smokerd_plugin_cpu_seconds_total{plugin="Metrics",process="children"}' in text
+
+    def test_exited_worker_is_skipped(self, monkeypatch, make_client):
+        client = make_client(self.config)
+        smokerd = restserver.smokerd
+
+        class Child(object):
+            def __init__(self, cmdline):
+                self._cmdline = cmdline
+
+            def cmdline(self):
+                if self._cmdline is None:
+                    raise psutil.NoSuchProcess(1)
+                return self._cmdline
+
+        children = [Child(['smokerd plugin Metrics']), Child(None)]
+        monkeypatch.setattr(psutil.Process, 'children', lambda *args, **kwargs: children)
+
+        text = client.get('/metrics').get_data(as_text=True)
+        assert 'smokerd_plugin_workers 1' in text
+        assert 'smokerd_open_fds{process="daemon"}' in text
+
+    def test_costs(self, make_client):
+        config = copy.deepcopy(self.config)
+        config['plugins']['Interval'] = {'Command': 'hostname', 'Interval': 60}
+        client = make_client(config)
+        smokerd = restserver.smokerd
+
+        def result(cpu):
+            return {'resources': {'worker': {'userTime': cpu, 'systemTime': 0}}}
+
+        now = time.time()
+        forced = smokerd.pluginmgr.get_plugin('Metrics')
+        forced.add_cost(result(100), now - server_plugins.COST_WINDOW - 1)
+        forced.add_cost(result(2), now - 10)
+        forced.add_cost(result(4), now)
+        forced.add_cost({'resources': None}, now)
+        interval = smokerd.pluginmgr.get_plugin('Interval')
+        interval.add_cost(result(1), now)
+
+        assert forced.get_cost(now)['runs'] == 2
+        assert forced.get_cost(now)['cpuTime'] == 6
+        assert forced.get_cost(now)['cpuPerRun'] == 3
+        assert forced.get_cost(now)['cpuPerHour'] == 6
+        assert interval.get_cost(now)['cpuPerHour'] == 60
+
+        costs = client.get('/costs').get_json()['costs']
+        assert costs['window'] == server_plugins.COST_WINDOW
+        assert [item['name'] for item in costs['items']] == ['Interval', 'Metrics']
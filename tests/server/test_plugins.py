@@ -5,9 +5,13 @@
 # from builtins import str
 import copy
 import datetime
+import fcntl
+import gc
 import multiprocessing
 import os
 import re
+import socket
+import stat
 import sys
 import time
 
@@ -15,6 +19,7 @@ import psutil
 import pytest
 
 import smoker.server.plugins as server_plugins
+import smoker.util.command
 from smoker.server import exceptions as smoker_exceptions
 
 
@@ -181,6 +186,28 @@ class TestPluginManager(object):
         pluginmgr = server_plugins.PluginManager(**conf)
         assert not pluginmgr.plugins['Hostname'].params['Action']
 
+    def test_plugins_with_invalid_module_should_not_be_loaded(self):
+        conf = copy.deepcopy(self.config)
+        conf['plugins']['InvalidModule'] = {
+            'Module': 'smoker.server.plugins.InvalidModule'}
+        conf['plugins']['InvalidParser'] = {
+            'Command': 'hostname',
+            'Parser': 'smoker.server.plugins.InvalidParser'}
+        pluginmgr = server_plugins.PluginManager(**conf)
+        assert 'InvalidModule' not in pluginmgr.get_plugins()
+        assert 'InvalidParser' not in pluginmgr.get_plugins()
+        assert 'Uname' in pluginmgr.get_plugins()
+
+    def test_plugin_modules_are_imported_on_load(self):
+        conf = copy.deepcopy(self.config)
+        conf['plugins']['Varnish'] = {
+            'Command': 'varnishadm debug.health',
+            'Parser': 'smoker.server.plugins.varnishparser'}
+        sys.modules.pop('smoker.server.plugins.varnishparser', None)
+        server_plugins.PluginManager(**conf)
+        assert 'smoker.server.plugins.uname' in sys.modules
+        assert 'smoker.server.plugins.varnishparser' in sys.modules
+
     def test_plugins_without_params_will_use_params_from_base_plugin(self):
         expected_interval = self.conf_templates['BasePlugin']['Interval']
         for plugin_name, plugin in self.conf_plugins_to_load.items():
@@ -221,8 +248,8 @@ class TestPluginManager(object):
             expected_plugins.append(pluginmgr.get_plugin(plugin))
 
         process_id = pluginmgr.add_process(plugins=plugin_list)
-        added_process = pluginmgr.get_process_list()[process_id]['plugins']
-        assert expected_plugins == added_process
+        added_process = pluginmgr.get_process(process_id)['plugins']
+        assert [plugin.name for plugin in expected_plugins] == added_process
 
     def test_add_process_using_filter(self):
         pluginmgr = server_plugins.PluginManager(**copy.deepcopy(self.config))
@@ -230,8 +257,8 @@ class TestPluginManager(object):
         expected_plugins = pluginmgr.get_plugins(filter=filter_)
 
         process_id = pluginmgr.add_process(filter=filter_)
-        added_process = pluginmgr.get_process_list()[process_id]['plugins']
-        assert expected_plugins == added_process
+        added_process = pluginmgr.get_process(process_id)['plugins']
+        assert [plugin.name for plugin in expected_plugins] == added_process
 
     def test_add_process_using_plugin_list_and_filter(self):
         pluginmgr = server_plugins.PluginManager(**copy.deepcopy(self.config))
@@ -246,8 +273,8 @@ class TestPluginManager(object):
         expected_plugins += pluginmgr.get_plugins(filter=filter_)
 
         process_id = pluginmgr.add_process(plugins=plugin_list, filter=filter_)
-        added_process = pluginmgr.get_process_list()[process_id]['plugins']
-        assert expected_plugins == added_process
+        added_process = pluginmgr.get_process(process_id)['plugins']
+        assert [plugin.name for plugin in expected_plugins] == added_process
 
     def test_add_process_without_any_plugin(self):
         conf = copy.deepcopy(self.config)
@@ -262,10 +289,42 @@ class TestPluginManager(object):
         assert 'Plugin InvalidPlugin not found' in repr(exc_info.value)
 
     def test_get_process_with_invalid_process_id(self):
-        with pytest.raises(IndexError):
+        with pytest.raises(smoker_exceptions.NoSuchProcess):
             self.pluginmgr.get_process(9999)
-        # Should equal None
-        assert not self.pluginmgr.get_process(0)
+        # Process IDs start from 1
+        with pytest.raises(smoker_exceptions.NoSuchProcess):
+            self.pluginmgr.get_process(0)
+
+    def test_process_table_is_limited(self):
+        pluginmgr = server_plugins.PluginManager(
+            process_max=3, **copy.deepcopy(self.config))
+        ids = [pluginmgr.add_process(plugins=['Uname']) for n in range(5)]
+        assert ids == [1, 2, 3, 4, 5]
+
+        # IDs stay valid, the oldest processes are removed
+        assert [p['id'] for p in pluginmgr.get_process_list()] == [3, 4, 5]
+        assert pluginmgr.get_process(4)['plugins'] == ['Uname']
+        with pytest.raises(smoker_exceptions.NoSuchProcess):
+            pluginmgr.get_process(1)
+        assert [p['id'] for p in pluginmgr.get_process_list(
+            limit=1, after=3)] == [4]
+
+    def test_finished_processes_are_removed_after_ttl(self):
+        pluginmgr = server_plugins.PluginManager(
+            process_ttl=0, **copy.deepcopy(self.config))
+        id = pluginmgr.add_process(plugins=['Uname'])
+        process = pluginmgr.get_process(id)
+        assert process['created'] and not process['finished']
+        assert pluginmgr.get_process_list(status='finished') == []
+        assert pluginmgr.get_process_list(status='running') == [process]
+
+        time.sleep(1)
+        pluginmgr.get_plugin('Uname').collect_new_result()
+        assert pluginmgr.get_process_status(process) == 'finished'
+        assert process['finished'] >= process['created']
+
+        time.sleep(0.1)
+        assert pluginmgr.get_process_list() == []
 
     def test_run_plugins_with_interval(self):
         pluginmgr = server_plugins.PluginManager(**copy.deepcopy(self.config))
@@ -485,6 +544,17 @@ class TestPlugin(object):
         assert 'status' in result and result['status'] == 'OK'
         assert 'forced' in result and result['forced']
 
+    def test_garbage_collector_is_unfrozen_after_fork(self):
+        plugin = server_plugins.Plugin(name=self.test_plugin_name,
+                                       params=self.test_params_default)
+        plugin.forced = True
+        plugin.run()
+        assert plugin.current_run.pid
+        if hasattr(gc, 'get_freeze_count'):
+            assert gc.get_freeze_count() == 0
+        time.sleep(0.5)
+        plugin.collect_new_result()
+
     def test_history_of_collect_new_result(self):
         params = dict(self.test_params_default, **{'History': 5})
         plugin = server_plugins.Plugin(name=self.test_plugin_name,
@@ -496,7 +566,8 @@ class TestPlugin(object):
             plugin.collect_new_result()
 
         assert len(plugin.result) == params['History']
-        assert plugin.forced_result == plugin.result[-1]
+        assert len(plugin.get_results()) == params['History']
+        assert plugin.forced_result == plugin.get_last_result()
 
 
 class TestPluginWorker(object):
@@ -531,6 +602,74 @@ class TestPluginWorker(object):
         assert 'info' in worker.result['messages']
         assert worker.result['messages']['info'] == [os.uname()[1]]
 
+    def test_worker_reports_resources(self):
+        worker = server_plugins.PluginWorker(**self.conf_worker)
+        worker.run()
+        resources = worker.result['resources']
+        assert resources['rss'] > 0
+        assert 'privateMemory' not in resources
+        for process in ('worker', 'children'):
+            assert resources[process]['userTime'] + resources[process]['systemTime'] > 0
+            assert resources[process]['maxRss'] > 0
+            assert 'blockInput' in resources[process]
+            assert 'voluntarySwitches' in resources[process]
+
+    def test_worker_reports_private_memory(self):
+        params = dict(self.params_default, PrivateMemory=True)
+        worker = server_plugins.PluginWorker(**dict(self.conf_worker, params=params))
+        worker.run()
+        assert worker.result['resources']['privateMemory'] > 0
+
+    def test_action_runs_only_on_status_change(self):
+        action = dict(self.action, Trigger='OnChange')
+        params = dict(self.params_default, Action=action)
+        trigger = server_plugins.ActionTrigger(action)
+
+        actions = []
+        for n in range(2):
+            worker = server_plugins.PluginWorker(
+                name='Hostname', queue=self.queue, params=params,
+                action_trigger=trigger)
+            worker.run()
+            actions.append(worker.result['action'])
+
+        assert actions[0]['status'] == 'OK'
+        assert actions[1] is None
+
+    def test_async_action_is_queued(self):
+        action = dict(self.action, Async=True)
+        params = dict(self.params_default, Action=action)
+        action_queue = multiprocessing.Queue()
+        worker = server_plugins.PluginWorker(
+            name='Hostname', queue=self.queue, params=params,
+            action_queue=action_queue)
+        worker.run()
+
+        assert worker.result['action'] is None
+        item = action_queue.get(timeout=5)
+        assert item['plugin'] == 'Hostname'
+        assert item['params']['Action']['Async']
+        assert item['result'] == worker.result
+
+    def test_action_trigger(self):
+        trigger = server_plugins.ActionTrigger(
+            {'Trigger': 'OnChange', 'OnStatus': ['ERROR', 'WARN']})
+        statuses = ['OK', 'ERROR', 'ERROR', 'WARN', 'OK', 'ERROR']
+        assert [trigger.should_run(status) for status in statuses] == [
+            False, True, False, True, False, True]
+
+        trigger = server_plugins.ActionTrigger(
+            {'Trigger': 'OnChange', 'RefreshInterval': 0.2})
+        assert trigger.should_run('OK')
+        assert not trigger.should_run('OK')
+        time.sleep(0.3)
+        assert trigger.should_run('OK')
+
+        with pytest.raises(smoker_exceptions.InvalidConfiguration):
+            server_plugins.ActionTrigger({'Trigger': 'Sometimes'})
+        with pytest.raises(smoker_exceptions.InvalidConfiguration):
+            server_plugins.ActionTrigger({'OnStatus': ['FAILED']})
+
     def test_running_worker_process_title_should_be_changed(self):
         expected = 'smokerd plugin Hostname'
         worker = server_plugins.PluginWorker(**self.conf_worker)
@@ -538,6 +677,21 @@ class TestPluginWorker(object):
         procs = get_process_list()
         assert expected in procs.values()
 
+    def test_close_unnecessary_sockets(self):
+        tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        tcp.bind(('127.0.0.1', 0))
+        tcp.listen(1)
+        udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+        worker = server_plugins.PluginWorker(**self.conf_worker)
+        worker.close_unnecessary_sockets()
+        try:
+            assert not stat.S_ISSOCK(os.fstat(tcp.fileno()).st_mode)
+            assert stat.S_ISSOCK(os.fstat(udp.fileno()).st_mode)
+        finally:
+            tcp.close()
+            udp.close()
+
     def test_drop_privileged_with_invalid_params(self):
         test_params = {
             'uid': 99999,
@@ -574,6 +728,59 @@ class TestPluginWorker(object):
         assert 'warn' in worker.result['messages']
         assert re.search(expected, worker.result['messages']['error'][0])
 
+    def test_run_command_with_cache(self):
+        test_params = {
+            'Command': 'echo %s $$' % random_string(),
+            'CacheTTL': 60
+        }
+        params = dict(self.params_default, **test_params)
+        results = []
+        for n in range(2):
+            worker = server_plugins.PluginWorker(name='Cached',
+                                                 queue=self.queue,
+                                                 params=params)
+            worker.run()
+            results.append(worker.result['messages']['info'])
+        # Shell PID is part of the output, so it has to be executed once
+        assert results[0] == results[1]
+
+    def test_command_cache_key_includes_kwargs(self, tmp_path):
+        cache = smoker.util.command.CommandCache(str(tmp_path / 'cache'))
+        command = ['sh', '-c', 'echo $VALUE $$']
+        first = cache.execute(command, 60, env={'VALUE': 'a'})
+        assert cache.execute(list(command), 60, env={'VALUE': 'a'}) == first
+        assert cache.execute(command, 60, env={'VALUE': 'b'})[0].startswith('b ')
+
+    def test_command_cache_lock_timeout(self, tmp_path):
+        cache = smoker.util.command.CommandCache(str(tmp_path / 'cache'))
+        command = ['sh', '-c', 'echo $$']
+        first = cache.execute(command, 60, timeout=1)
+
+        # Worker holding the lock doesn't block others longer than timeout
+        with open(cache.get_path(cache.get_key(command)), 'r') as fp:
+            fcntl.flock(fp, fcntl.LOCK_EX)
+            start = time.time()
+            output = cache.execute(command, 60, timeout=0.3)
+            assert 0.3 <= time.time() - start < 1
+            assert output[0] != first[0]
+            assert output[2] == 0
+
+        assert cache.execute(command, 60, timeout=1) == first
+
+    def test_run_command_without_cache(self):
+        test_params = {
+            'Command': 'echo %s $$' % random_string(),
+        }
+        params = dict(self.params_default, **test_params)
+        results = []
+        for n in range(2):
+            worker = server_plugins.PluginWorker(name='NotCached',
+                                                 queue=self.queue,
+                                                 params=params)
+            worker.run()
+            results.append(worker.result['messages']['info'])
+        assert results[0] != results[1]
+
     def test_run_command_with_parser(self):
         expected = {
             'Unit tests': {
@@ -598,6 +805,42 @@ class TestPluginWorker(object):
         assert worker.result['componentResults'] == expected
         assert 'messages' in worker.result and not worker.result['messages']
 
+    def test_run_command_with_streaming_parser(self):
+        test_params = {
+            'Command': 'printf "first:OK\\nsecond:WARN\\n"',
+            'Parser': 'tests.server.smoker_test_resources.smokerstreamparser'
+        }
+        params = dict(self.params_default, **test_params)
+        worker = server_plugins.PluginWorker(name='Hostname',
+                                             queue=self.queue, params=params)
+        worker.run()
+        assert worker.result['status'] == 'WARN'
+        components = worker.result['componentResults']
+        assert components['first']['status'] == 'OK'
+        assert components['second']['messages']['info'] == ['second:WARN']
+
+    def test_run_command_with_varnish_parser(self):
+        output = '\\n'.join([
+            'Backend web1 is Healthy',
+            'Current states  good:  5 threshold:  3 window:  5',
+            'Average responsetime of good probes: 0.012',
+            'Backend web2 is Sick',
+            'Current states  good:  0 threshold:  3 window:  5',
+            'Average responsetime of good probes: 0.000',
+        ])
+        test_params = {
+            'Command': 'printf "%s\\n"' % output,
+            'Parser': 'smoker.server.plugins.varnishparser'
+        }
+        params = dict(self.params_default, **test_params)
+        worker = server_plugins.PluginWorker(name='Varnish',
+                                             queue=self.queue, params=params)
+        worker.run()
+        assert worker.result['status'] == 'ERROR'
+        components = worker.result['componentResults']
+        assert components['web1']['status'] == 'OK'
+        assert components['web2']['messages']['error'] == ['State: Sick']
+
     def test_run_command_with_invalid_parser_path(self):
         expected_info = ['GoodData Smoker']
         test_params = {
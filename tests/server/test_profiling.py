@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2007-2015, GoodData(R) Corporation. All rights reserved
+
+import os
+import pstats
+import time
+
+from smoker.server import restserver
+from smoker.util import profiling
+
+
+def busy(seconds):
+    until = time.time() + seconds
+    while time.time() < until:
+        pass
+    return 'done'
+
+
+class TestProfiling(object):
+    """Unit tests for profiling helpers"""
+
+    def test_profile_call(self, tmp_path):
+        path = str(tmp_path / profiling.profile_name('Say/hi', profiling.PSTATS))
+        assert os.path.basename(path).startswith('Say_hi-')
+        assert profiling.profile_call(path, busy, 0.01) == 'done'
+        stats = pstats.Stats(path)
+        assert any(func[2] == 'busy' for func in stats.stats)
+
+    def test_sampler(self, tmp_path):
+        path = str(tmp_path / 'api.collapsed')
+        sampler = profiling.Sampler(path, 0.2, interval=0.005)
+        sampler.start()
+        busy(0.1)
+        sampler.join()
+
+        with open(path) as fp:
+            lines = fp.read().splitlines()
+        assert any(line.startswith('MainThread;') and ':busy ' in line for line in lines)
+        assert all(line.rsplit(' ', 1)[1].isdigit() for line in lines)
+        assert profiling.list_profiles(str(tmp_path)) == [
+            ('api.collapsed', os.path.getsize(path), os.path.getmtime(path))]
+        assert profiling.list_profiles(str(tmp_path / 'missing')) == []
+
+
+class TestProfilingAPI(object):
+    """Unit tests for profiling of plugin runs and the API process"""
+
+    config = {
+        'plugins': {'Profiled': {'Command': 'hostname'}},
+        'templates': {'BasePlugin': {'Interval': 0, 'Timeout': 30, 'History': 3}},
+        'actions': dict(),
+    }
+
+    def test_profiling_disabled(self, make_client):
+        client = make_client(self.config)
+        assert client.get('/profiles').status_code == 404
+        response = client.post('/profiles', json={'profile': {'plugin': 'Profiled'}})
+        assert response.status_code == 404
+
+    def test_profile_plugin_runs(self, make_client, tmp_path):
+        client = make_client(self.config, profile_dir=str(tmp_path))
+        response = client.post('/profiles', json={'profile': {'plugin': 'Invalid'}})
+        assert response.status_code == 404
+        response = client.post('/profiles', json={'profile': {'plugin': 'Profiled', 'runs': -1}})
+        assert response.status_code == 400
+
+        response = client.post('/profiles', json={'profile': {'plugin': 'Profiled', 'runs': 2}})
+        assert response.status_code == 202
+        assert response.get_json()['profiles']['plugins'] == {'Profiled': 2}
+
+        plugin = restserver.smokerd.pluginmgr.get_plugin('Profiled')
+        for n in range(3):
+            plugin.forced = True
+            plugin.run()
+            plugin.current_run.join()
+            plugin.collect_new_result()
+            assert plugin.get_last_result()['status'] == 'OK'
+
+        profiles = client.get('/profiles').get_json()['profiles']
+        assert profiles['plugins'] == {}
+        assert len(profiles['items']) == 2
+        response = client.get(profiles['items'][0]['links']['self'])
+        assert response.status_code == 200
+        assert response.headers['Content-Type'] == 'application/octet-stream'
+        assert client.get('/profiles/missing.pstats').status_code == 404
+        assert client.get('/profiles/..%2Fsecret').status_code == 404
+
+    def test_sample_api_process(self, monkeypatch, make_client, tmp_path):
+        monkeypatch.setattr(restserver, 'sampler', None)
+        client = make_client(self.config, profile_dir=str(tmp_path))
+        response = client.post('/profiles', json={'profile': {'duration': 0}})
+        assert response.status_code == 400
+
+        response = client.post('/profiles', json={'profile': {'duration': 0.2}})
+        assert response.status_code == 202
+        api = response.get_json()['profiles']['api']
+        assert api['name'].endswith('.collapsed')
+        assert client.post('/profiles', json={'profile': {'duration': 1}}).status_code == 409
+
+        restserver.sampler.join()
+        response = client.get('/profiles/%s' % api['name'])
+        assert response.status_code == 200
+        assert response.headers['Content-Type'].startswith('text/plain')
+        assert b'profile sampler' not in response.get_data()
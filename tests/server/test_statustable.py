@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2007-2015, GoodData(R) Corporation. All rights reserved
+
+import copy
+import datetime
+import os
+import socket
+import time
+
+import pytest
+
+import smoker.server.plugins as server_plugins
+from smoker.util.statustable import StatusTable, short_message
+
+
+class TestStatusTable(object):
+    """Unit tests for the memory-mapped status table"""
+
+    plugins = {
+        'Uptime': {'Category': 'system'},
+        'Hostname': {'Category': 'system', 'Type': 'healthCheck'},
+    }
+
+    def test_reader_sees_updates(self, tmp_path):
+        path = str(tmp_path / 'status')
+        table = StatusTable.create(path, self.plugins)
+        reader = StatusTable.open(path)
+
+        assert reader.get('Uptime')['status'] == 'UNKNOWN'
+        assert reader.get('Uptime')['lastRun'] is None
+
+        now = time.time()
+        table.update('Uptime', 'WARN', now, 'load is high', 42)
+        status = reader.get('Uptime')
+        assert status['status'] == 'WARN'
+        assert status['message'] == 'load is high'
+        assert status['seq'] == 42
+        assert status['lastRun'] == datetime.datetime.fromtimestamp(now)
+        assert status['category'] == 'system'
+
+        assert [s['name'] for s in reader.items()] == ['Hostname', 'Uptime']
+        assert reader.items()[0]['type'] == 'healthCheck'
+        assert reader.get('Unknown') is None
+        assert reader.is_alive()
+
+    def test_long_message_is_truncated(self, tmp_path):
+        table = StatusTable.create(str(tmp_path / 'status'), self.plugins)
+        table.update('Uptime', 'ERROR', time.time(), u'ž' * 1000)
+        assert table.get('Uptime')['message'] == u'ž' * 128
+
+    def test_long_names_stay_unique(self, tmp_path):
+        prefix = u'Ž' * 40
+        plugins = {prefix + 'First': {}, prefix + 'Second': {}}
+        path = str(tmp_path / 'status')
+        table = StatusTable.create(path, plugins)
+        table.update(prefix + 'First', 'OK', time.time())
+        table.update(prefix + 'Second', 'ERROR', time.time())
+
+        reader = StatusTable.open(path)
+        assert reader.get(prefix + 'First')['status'] == 'OK'
+        assert reader.get(prefix + 'Second')['status'] == 'ERROR'
+        names = [s['name'] for s in reader.items()]
+        assert len(set(names)) == 2
+        assert all(len(name.encode('utf-8')) <= 64 for name in names)
+
+    def test_unknown_plugin_is_ignored(self, tmp_path):
+        table = StatusTable.create(str(tmp_path / 'status'), self.plugins)
+        table.update('Unknown', 'OK', time.time())
+        assert table.get('Unknown') is None
+
+    def test_reader_retries_while_slot_is_written(self, tmp_path):
+        path = str(tmp_path / 'status')
+        table = StatusTable.create(path, self.plugins)
+        table.update('Uptime', 'OK', time.time(), 'fine')
+
+        # Simulate writer in the middle of the update
+        offset = table.offset(table.slots['Uptime'])
+        table.mapping[offset] += 1
+        with pytest.raises(RuntimeError):
+            StatusTable.open(path).get('Uptime')
+
+        table.mapping[offset] += 1
+        assert StatusTable.open(path).get('Uptime')['message'] == 'fine'
+
+    def test_invalid_table(self, tmp_path):
+        path = str(tmp_path / 'status')
+        with open(path, 'wb') as fh:
+            fh.write(b'\0' * 100)
+        with pytest.raises(ValueError):
+            StatusTable.open(path)
+        with pytest.raises(OSError):
+            StatusTable.open(str(tmp_path / 'missing'))
+
+    def test_short_message(self):
+        result = {
+            'status': 'ERROR',
+            'messages': {'info': ['ok'], 'warn': [], 'error': []},
+            'componentResults': {
+                'www01': {'status': 'OK', 'messages': {'info': ['fine']}},
+                'www02': {'status': 'ERROR', 'messages': {'error': ['timeout']}},
+                'www03': {'status': 'WARN', 'messages': {'warn': []}},
+            },
+        }
+        assert short_message(result) == 'www02: ERROR: timeout; www03: WARN'
+
+        result['messages']['error'] = ['failed']
+        assert short_message(result) == 'failed'
+
+    def test_plugin_manager_publishes_statuses(self, tmp_path):
+        path = str(tmp_path / 'status')
+        config = {
+            'plugins': {'Hostname': {'Command': 'hostname'}},
+            'templates': {'BasePlugin': {'Interval': 0, 'Timeout': 30, 'History': 3}},
+            'actions': dict(),
+        }
+        pluginmgr = server_plugins.PluginManager(
+            status_table=path, **copy.deepcopy(config))
+        assert os.path.exists(path)
+
+        plugin = pluginmgr.get_plugin('Hostname')
+        plugin.forced = True
+        plugin.run()
+        time.sleep(0.5)
+        plugin.collect_new_result()
+
+        status = StatusTable.open(path).get('Hostname')
+        assert status['status'] == 'OK'
+        assert status['message'] == socket.gethostname()
+        assert status['seq'] == plugin.result.last().seq
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2007-2015, GoodData(R) Corporation. All rights reserved
+
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from smoker.client import Host
+from smoker.server import restserver
+from smoker.util import tracing
+
+
+@pytest.fixture
+def trace_file(tmp_path, monkeypatch):
+    path = str(tmp_path / 'trace.jsonl')
+    monkeypatch.setattr(tracing, 'path', path)
+    monkeypatch.setattr(tracing, 'service', 'test')
+    return path
+
+
+def load_spans(path):
+    spans = []
+    with open(path) as fp:
+        for line in fp:
+            for resource in json.loads(line)['resourceSpans']:
+                for scope in resource['scopeSpans']:
+                    spans.extend(scope['spans'])
+    return dict((span['name'], span) for span in spans)
+
+
+class TestTracing(object):
+    """Unit tests for span tracing"""
+
+    def test_traceparent(self):
+        context = tracing.new_context()
+        assert len(context.trace_id) == 32 and len(context.span_id) == 16
+        header = tracing.format_traceparent(context)
+        assert tracing.parse_traceparent(header) == context
+
+        child = tracing.new_context(context)
+        assert child.trace_id == context.trace_id
+        assert child.span_id != context.span_id
+
+        for value in (None, '', 'invalid', '00-%s-%s-01' % ('0' * 32, '1' * 16),
+                      '00-%s-%s-01' % ('x' * 32, '1' * 16)):
+            assert tracing.parse_traceparent(value) is None
+
+    def test_disabled(self, monkeypatch):
+        monkeypatch.setattr(tracing, 'path', None)
+        with tracing.span('disabled') as span:
+            assert span is None
+            assert tracing.current() is None
+        assert tracing.record('disabled', 1, 2) is None
+
+    def test_spans_are_written(self, trace_file):
+        def worker():
+            with tracing.span('thread'):
+                pass
+
+        with tracing.span('root', attributes={'hosts': 2}) as root:
+            assert tracing.current() == root.context
+            thread = threading.Thread(target=tracing.bind(worker))
+            thread.start()
+            thread.join()
+            tracing.record('phase', time.time() - 1, time.time(), parent=root.context)
+            with pytest.raises(ValueError):
+                with tracing.span('failed', kind=tracing.CLIENT):
+                    raise ValueError('Broken')
+        assert tracing.current() is None
+
+        with open(trace_file) as fp:
+            resource = json.loads(fp.readline())['resourceSpans'][0]['resource']
+        assert {'key': 'service.name', 'value': {'stringValue': 'test'}} in \
+            resource['attributes']
+
+        spans = load_spans(trace_file)
+        assert spans['root']['parentSpanId'] == ''
+        assert spans['root']['attributes'] == [{'key': 'hosts', 'value': {'intValue': '2'}}]
+        for name in ('thread', 'phase', 'failed'):
+            assert spans[name]['traceId'] == spans['root']['traceId']
+            assert spans[name]['parentSpanId'] == spans['root']['spanId']
+        assert spans['failed']['kind'] == tracing.CLIENT
+        assert spans['failed']['status'] == {'code': tracing.STATUS_ERROR, 'message': 'Broken'}
+        assert int(spans['phase']['endTimeUnixNano']) - \
+            int(spans['phase']['startTimeUnixNano']) >= 1e9 - 1e6
+
+    def test_client_sends_traceparent(self, trace_file, monkeypatch):
+        requests = []
+
+        def urlopen(request, timeout=None):
+            requests.append(request)
+            raise OSError('Connection refused')
+
+        monkeypatch.setattr('urllib.request.urlopen', urlopen)
+        with tracing.span('force run') as root:
+            assert Host('localhost').open('/') is False
+
+        parent = tracing.parse_traceparent(requests[0].get_header('Traceparent'))
+        spans = load_spans(trace_file)
+        assert parent.trace_id == root.context.trace_id
+        assert parent.span_id == spans['GET /']['spanId']
+        assert spans['GET /']['status']['code'] == tracing.STATUS_ERROR
+
+
+class TestTracingAPI(object):
+    """Unit tests for spans of the forced runs"""
+
+    config = {
+        'plugins': {'Traced': {'Command': 'hostname'}},
+        'templates': {'BasePlugin': {'Interval': 0, 'Timeout': 30, 'History': 3}},
+        'actions': dict(),
+    }
+    def test_forced_run_is_traced(self, trace_file, make_client):
+        client = make_client(self.config)
+
+        # Only requests of traced clients are traced
+        client.get('/plugins')
+        assert not os.path.exists(trace_file)
+
+        parent = tracing.new_context()
+        headers = {tracing.TRACEPARENT: tracing.format_traceparent(parent)}
+        response = client.post('/processes', headers=headers,
+                               json={'process': {'plugins': ['Traced']}})
+        assert response.status_code == 202
+
+        plugin = restserver.smokerd.pluginmgr.get_plugin('Traced')
+        plugin.current_run.join()
+        plugin.collect_new_result()
+        client.get(response.get_json()['asyncTask']['link']['poll'], headers=headers)
+
+        spans = load_spans(trace_file)
+        assert set(span['traceId'] for span in spans.values()) == {parent.trace_id}
+        assert spans['POST /processes']['parentSpanId'] == parent.span_id
+        assert spans['POST /processes']['kind'] == tracing.SERVER
+        assert spans['GET /processes/<int:id>']['parentSpanId'] == parent.span_id
+        assert spans['add_process']['parentSpanId'] == spans['POST /processes']['spanId']
+        run = spans['plugin Traced']
+        assert run['parentSpanId'] == spans['add_process']['spanId']
+        for name in ('lag', 'spawn', 'semaphore', 'exec', 'parse', 'queue'):
+            assert spans[name]['parentSpanId'] == run['spanId']
+        assert plugin.trace is None